@@ -0,0 +1,302 @@
+"""Two-tier cache backend: a small per-process LRU in front of a shared
+cache, with stampede protection for ``get_or_set``.
+
+Only keys starting with one of LOCAL_PREFIXES are kept locally. Those have
+to be versioned keys, whose value never changes once written, like the
+generation keyed catalog lists and the rendered fragments of most items: a
+delete in another process does not reach the local copies. Every other key goes
+straight to the shared cache, so the backend is a drop-in replacement.
+
+``get_or_set`` lets one process recompute a missing or expired value while
+the others serve the previous one, if there is one, or wait for it:
+
+* values with a timeout are stored with their logical expiry and the time
+  they took to compute. They are kept STALE_TIMEOUT seconds longer, and
+  before they expire a caller picks itself to recompute with a probability
+  that grows as the expiry nears (XFetch).
+* a short lock in the shared cache elects the process that recomputes.
+* ``stale_key`` keeps the latest value of a family of versioned keys, so a
+  new version can be served the previous one while it is being built.
+
+Hits, misses and stale reads are counted per process, see ``stats()``.
+"""
+import math
+import random
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# a value stored by get_or_set, with its logical expiry and compute time
+Envelope = namedtuple("Envelope", "value expires delta")
+
+_missing = object()
+
+
+class LocalCache:
+    """Thread safe LRU with a size and a time bound"""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _missing
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return _missing
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TwoTierCache(BaseCache):
+    # Django creates a backend instance per thread, the local tier and the
+    # counters are shared by all the instances of a process
+    _locals = {}
+    _stats = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.shared_alias = options.get("SHARED", "shared")
+        self.local_prefixes = tuple(options.get("LOCAL_PREFIXES", ()))
+        self.stale_timeout = options.get("STALE_TIMEOUT", 60)
+        self.lock_timeout = options.get("LOCK_TIMEOUT", 10)
+        self.beta = options.get("XFETCH_BETA", 1.0)
+        name = location or self.shared_alias
+        with self._registry_lock:
+            if name not in self._locals:
+                self._locals[name] = LocalCache(
+                    options.get("LOCAL_MAX_ENTRIES", 500),
+                    options.get("LOCAL_TIMEOUT", 60),
+                )
+                self._stats[name] = Counter()
+        self.local = self._locals[name]
+        self.counts = self._stats[name]
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def stats(self):
+        """Counters of this process: local and shared hits, misses, stale
+        values served, recomputes and waits for another recompute"""
+        return dict(self.counts)
+
+    def is_local(self, key):
+        return key.startswith(self.local_prefixes)
+
+    def local_key(self, key, version):
+        return self.shared.make_key(key, version)
+
+    def shared_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            return self.shared.default_timeout
+        return timeout
+
+    # Raw access to stored values, envelopes included
+
+    def get_raw(self, key, version=None):
+        if self.is_local(key):
+            value = self.local.get(self.local_key(key, version))
+            if value is not _missing:
+                self.counts["local_hits"] += 1
+                return value
+        value = self.shared.get(key, _missing, version)
+        if value is _missing:
+            self.counts["misses"] += 1
+            return _missing
+        self.counts["shared_hits"] += 1
+        if self.is_local(key):
+            self.local.set(self.local_key(key, version), value)
+        return value
+
+    def set_raw(self, key, value, timeout, version=None):
+        self.shared.set(key, value, timeout, version)
+        if self.is_local(key):
+            self.local.set(self.local_key(key, version), value)
+
+    def unwrap(self, value, default):
+        if isinstance(value, Envelope):
+            if value.expires < time.time():
+                return default
+            return value.value
+        return default if value is _missing else value
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        return self.unwrap(self.get_raw(key, version), default)
+
+    def get_many(self, keys, version=None):
+        found, remote = {}, []
+        for key in keys:
+            value = _missing
+            if self.is_local(key):
+                value = self.local.get(self.local_key(key, version))
+            if value is _missing:
+                remote.append(key)
+            else:
+                self.counts["local_hits"] += 1
+                found[key] = value
+        if remote:
+            fetched = self.shared.get_many(remote, version)
+            self.counts["shared_hits"] += len(fetched)
+            self.counts["misses"] += len(remote) - len(fetched)
+            for key, value in fetched.items():
+                if self.is_local(key):
+                    self.local.set(self.local_key(key, version), value)
+            found.update(fetched)
+        values = {key: self.unwrap(v, _missing) for key, v in found.items()}
+        return {key: v for key, v in values.items() if v is not _missing}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_raw(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        for key, value in data.items():
+            if self.is_local(key) and key not in failed:
+                self.local.set(self.local_key(key, version), value)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.add(key, value, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.local_key(key, version))
+        return self.shared.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.local.delete(self.local_key(key, version))
+        self.shared.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version) is not _missing
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(self.local_key(key, version))
+        return self.shared.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        self.local.delete(self.local_key(key, version))
+        return self.shared.decr(key, delta, version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    # Stampede protection
+
+    def must_recompute(self, envelope):
+        """XFetch: recompute early with a probability growing towards the
+        expiry, weighted by how long the value took to compute"""
+        early = envelope.delta * self.beta * -math.log(1 - random.random())
+        return time.time() + early >= envelope.expires
+
+    def get_or_set(
+        self,
+        key,
+        default,
+        timeout=DEFAULT_TIMEOUT,
+        version=None,
+        stale_key=None,
+    ):
+        """Return the value of key, computing it from default if missing.
+
+        Only the process holding the recompute lock calls default. The
+        others serve the stale value of key or of ``stale_key`` meanwhile,
+        or wait for the new value when there is none.
+        """
+        stored = self.get_raw(key, version)
+        stale = _missing
+        if stored is not _missing:
+            if not isinstance(stored, Envelope):
+                return stored
+            if not self.must_recompute(stored):
+                return stored.value
+            stale = stored.value
+        elif stale_key is not None:
+            stale = self.get(stale_key, _missing, version)
+
+        lock_key = f"{key}:recompute"
+        if self.shared.add(lock_key, 1, self.lock_timeout, version):
+            try:
+                return self.recompute(
+                    key, default, timeout, version, stale_key
+                )
+            finally:
+                self.shared.delete(lock_key, version)
+        if stale is not _missing:
+            self.counts["stale"] += 1
+            return stale
+
+        self.counts["waits"] += 1
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            stored = self.shared.get(key, _missing, version)
+            value = self.unwrap(stored, _missing)
+            if value is not _missing:
+                return value
+        # the recomputing process did not finish in time
+        return self.recompute(key, default, timeout, version, stale_key)
+
+    def recompute(self, key, default, timeout, version, stale_key):
+        self.counts["recomputes"] += 1
+        start = time.time()
+        value = default() if callable(default) else default
+        timeout = self.shared_timeout(timeout)
+        if timeout is None:
+            self.set_raw(key, value, None, version)
+        else:
+            now = time.time()
+            envelope = Envelope(value, now + timeout, now - start)
+            self.set_raw(key, envelope, timeout + self.stale_timeout, version)
+        if stale_key is not None:
+            self.set_raw(stale_key, value, None, version)
+        return value
+
+    async def aget_or_set(
+        self,
+        key,
+        default,
+        timeout=DEFAULT_TIMEOUT,
+        version=None,
+        stale_key=None,
+    ):
+        return await sync_to_async(self.get_or_set)(
+            key, default, timeout, version, stale_key
+        )
@@ -0,0 +1,121 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+# "IN (%s, %s, %s)" and "IN (%s)" are the same query shape
+PLACEHOLDERS_RE = re.compile(r"%s(?:\s*,\s*%s)+")
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql):
+    """The shape of a query: its sql with literals and lists collapsed"""
+    return LITERAL_RE.sub("?", PLACEHOLDERS_RE.sub("%s", sql))
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryStats:
+    """Count, time and fingerprint the queries run while recording"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @property
+    def duplicates(self):
+        """Query shapes run more than once, usually an N+1 pattern"""
+        return {sql: n for sql, n in self.fingerprints.items() if n > 1}
+
+
+def get_budget(view_name):
+    """``(max queries, max milliseconds)`` of a view, either may be None.
+
+    QUERY_BUDGETS maps view names to a number of queries, or to a dict
+    with ``queries`` and ``time`` keys.
+    """
+    budget = getattr(settings, "QUERY_BUDGETS", {}).get(view_name)
+    if budget is None or isinstance(budget, int):
+        return budget, None
+    return budget.get("queries"), budget.get("time")
+
+
+def budget_problems(view_name, stats):
+    """Describe how stats exceed the budget of view_name, if they do"""
+    queries, ms = get_budget(view_name)
+    problems = []
+    if queries is not None and stats.count > queries:
+        problems.append(f"{stats.count} queries, budget {queries}")
+    if ms is not None and stats.time * 1000 > ms:
+        problems.append(f"{stats.time * 1000:.1f} ms in the db, budget {ms}")
+    return problems
+
+
+class QueryBudgetMiddleware(MiddlewareMixin):
+    """Record the queries of every request and check them against the
+    QUERY_BUDGETS of its view. An exceeded budget logs a warning, or raises
+    QueryBudgetExceeded when QUERY_BUDGET_RAISE is set, as in tests.
+
+    The stats are kept on ``request.query_stats``. Queries run while a
+    streaming response is consumed are not counted.
+
+    Under ASGI both hooks run in the thread of the request that also runs
+    its sync_to_async calls, so the queries of async views are counted and
+    the middleware does not force the views into a thread.
+    """
+
+    def process_request(self, request):
+        stats = QueryStats()
+        request._query_recording = ExitStack()
+        request._query_recording.enter_context(stats.record())
+        request.query_stats = stats
+
+    def process_response(self, request, response):
+        recording = getattr(request, "_query_recording", None)
+        if recording is None:
+            return response
+        recording.close()
+        stats = request.query_stats
+
+        if settings.DEBUG:
+            response["Server-Timing"] = (
+                f'db;dur={stats.time * 1000:.1f};desc="{stats.count} queries"'
+            )
+        match = request.resolver_match
+        problems = budget_problems(match.view_name, stats) if match else []
+        if problems:
+            message = "%s over budget: %s. Repeated queries: %s" % (
+                match.view_name,
+                "; ".join(problems),
+                stats.duplicates or "none",
+            )
+            if getattr(settings, "QUERY_BUDGET_RAISE", False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
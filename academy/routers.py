@@ -0,0 +1,105 @@
+"""Send reads of the catalog and student data to read replicas.
+
+Reads of REPLICATED_APPS models go to a random alias of DATABASE_REPLICAS,
+everything else to the primary, ``default``. Writes always go to the
+primary and pin the current request, and with ReplicaPinMiddleware the
+client, to the primary for REPLICA_PIN_SECONDS, so users read their own
+writes while the replicas catch up. Reads inside a transaction stay on
+the primary as well.
+
+Data that is cached after being read, like the catalog lists, is read
+inside ``primary()``: a lagging replica would otherwise fill the cache
+with a version that outlives the lag.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+REPLICATED_APPS = {"courses", "students"}
+PIN_COOKIE = "primary_until"
+
+# reads of the current request or task go to the primary
+pinned = ContextVar("pinned_to_primary", default=False)
+# the current request wrote to a replicated app
+wrote = ContextVar("wrote_to_primary", default=False)
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def pin_seconds():
+    return getattr(settings, "REPLICA_PIN_SECONDS", 5)
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block"""
+    token = pinned.set(True)
+    try:
+        yield
+    finally:
+        pinned.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if (
+            not aliases
+            or model._meta.app_label not in REPLICATED_APPS
+            or pinned.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in REPLICATED_APPS:
+            pinned.set(True)
+            wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas copy the schema of the primary
+        return db not in replicas()
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """Keep clients that wrote on the primary for REPLICA_PIN_SECONDS.
+
+    The deadline is kept in a signed cookie, so it follows the client and
+    not a worker process.
+    """
+
+    def process_request(self, request):
+        until = request.get_signed_cookie(PIN_COOKIE, 0, salt=PIN_COOKIE)
+        pinned.set(float(until) > time.time())
+        wrote.set(False)
+
+    def process_response(self, request, response):
+        if wrote.get() and replicas():
+            seconds = pin_seconds()
+            response.set_signed_cookie(
+                PIN_COOKIE,
+                time.time() + seconds,
+                salt=PIN_COOKIE,
+                max_age=seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        # worker threads serve the next request with a clean state
+        pinned.set(False)
+        wrote.set(False)
+        return response
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "django.contrib.sites",
+    "django.contrib.postgres",
     # Local Apps
     "courses.apps.CoursesConfig",
     "students.apps.StudentsConfig",
@@ -80,6 +81,8 @@ CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
+    "academy.middleware.QueryBudgetMiddleware",
+    "academy.routers.ReplicaPinMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.locale.LocaleMiddleware",
@@ -92,6 +95,10 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "academy.urls"
 
+# Route the read-heavy pages to their async views, see courses.async_views.
+# Only useful under ASGI, compare with ``manage.py bench_asgi`` first.
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "0") == "1"
+
 LOGIN_REDIRECT_URL = reverse_lazy("students:student_course_list")
 
 TEMPLATES = [
@@ -127,6 +134,55 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, as comma separated hosts in
+# DB_REPLICA_HOSTS. See academy.routers for what is read from them.
+DATABASE_REPLICAS = []
+for number, host in enumerate(
+    filter(None, os.environ.get("DB_REPLICA_HOSTS", "").split(",")), 1
+):
+    DATABASES[f"replica_{number}"] = {
+        **DATABASES["default"],
+        "HOST": host.strip(),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica_{number}")
+DATABASE_ROUTERS = ["academy.routers.ReplicaRouter"]
+# seconds a client reads from the primary after writing
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 5))
+
+
+# Cache
+# A small per-process LRU in front of the cache shared by all the workers,
+# see academy.cache. Set MEMCACHED_LOCATION to share it between processes.
+CACHES = {
+    "default": {
+        "BACKEND": "academy.cache.TwoTierCache",
+        "OPTIONS": {
+            "SHARED": "shared",
+            # keys whose value never changes once written. Image fragments
+            # change when their resized variants appear, so they are left out
+            "LOCAL_PREFIXES": [
+                "catalog:data:",
+                "item_render:courses.text:",
+                "item_render:courses.file:",
+                "item_render:courses.video:",
+            ],
+            "LOCAL_MAX_ENTRIES": 500,
+            "LOCAL_TIMEOUT": 60,
+            "STALE_TIMEOUT": 60,
+            "LOCK_TIMEOUT": 10,
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+if os.environ.get("MEMCACHED_LOCATION"):
+    CACHES["shared"] = {
+        "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+        "LOCATION": os.environ["MEMCACHED_LOCATION"],
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -168,6 +224,15 @@ MEDIA_URL = "/media/"
 STATICFILES_DIRS = [BASE_DIR / "static"]
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
+
+# Partial files of chunked uploads, kept out of MEDIA_ROOT until finalized
+CHUNKED_UPLOAD_ROOT = os.path.join(BASE_DIR, "uploads/")
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024**3
+CHUNKED_UPLOAD_MAX_CHUNK = 16 * 1024**2
+
+# Offline course packages, see courses.export
+COURSE_EXPORT_ROOT = os.path.join(BASE_DIR, "exports/")
+
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
 
@@ -190,7 +255,44 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.SessionAuthentication",
         "rest_framework.authentication.TokenAuthentication",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "rest_framework.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+        "courses.api.renderers.MessagePackRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+        "courses.api.renderers.MessagePackParser",
+    ],
+}
+
+# Most queries a request of each view may run, checked by
+# academy.middleware.QueryBudgetMiddleware. Counts include the session and
+# user lookups, and assume cold caches and courses with all four item types.
+# They were measured with manage.py benchmark in a new process, where the
+# content types are loaded once, see courses.models.cache_content_types().
+QUERY_BUDGETS = {
+    "courses:course_list": 5,
+    "courses:course_list_series": 5,
+    "courses:course_detail": 5,
+    "courses:course_search": 4,
+    "courses:module_content_list": 10,
+    "courses:course_dashboard": 7,
+    "students:student_course_list": 4,
+    "students:student_course_detail": 13,
+    "students:student_course_detail_module": 13,
+    "api:course-list": 5,
+    "api:course-detail": 5,
+    "api:course-contents": 9,
+    "api:course-sync": 12,
+    "api:course-progress": 10,
+    "api:series_list": 3,
+    "api:series_detail": 3,
+    "api:search": 4,
 }
+QUERY_BUDGET_RAISE = False
 
 
 # Control the forms that django-allauth uses
@@ -0,0 +1,25 @@
+from django.test import TestCase, override_settings
+
+from .middleware import budget_problems, get_budget
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class QueryBudgetTestCase(TestCase):
+    """Requests of these tests fail with QueryBudgetExceeded as soon as a
+    view goes over its QUERY_BUDGETS entry"""
+
+    def assertWithinBudget(self, response):
+        """Check that the view of response has a budget and kept to it"""
+        request = response.wsgi_request
+        view_name = request.resolver_match.view_name
+        self.assertNotEqual(
+            get_budget(view_name), (None, None), f"{view_name} has no budget"
+        )
+        stats = request.query_stats
+        problems = budget_problems(view_name, stats)
+        self.assertFalse(
+            problems,
+            f"{view_name}: {'; '.join(problems)}. "
+            f"Repeated queries: {stats.duplicates}",
+        )
+        return stats
@@ -0,0 +1,40 @@
+"""Async entry points of the read-only course API, see courses.async_views.
+
+DRF has no async views, so each one runs its viewset action and renders the
+response in a single sync_to_async call. Authentication, permissions,
+pagination and content negotiation stay the ones of CourseViewSet.
+"""
+from asgiref.sync import sync_to_async
+from rest_framework.response import Response
+
+from .views import CourseViewSet
+
+
+def action_view(action, detail):
+    """Async view of a GET action of CourseViewSet, set up like the router
+    does"""
+    method = getattr(CourseViewSet, action)
+    view = CourseViewSet.as_view(
+        {"get": action},
+        basename="course",
+        detail=detail,
+        **getattr(method, "kwargs", {}),
+    )
+
+    def respond(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if isinstance(response, Response):
+            # render in this thread as well, not on the event loop
+            response.render()
+        return response
+
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(respond)(request, *args, **kwargs)
+
+    return async_view
+
+
+course_list = action_view("list", detail=False)
+course_detail = action_view("retrieve", detail=True)
+course_contents = action_view("contents", detail=True)
+course_sync = action_view("sync", detail=True)
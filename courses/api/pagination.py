@@ -0,0 +1,102 @@
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+# Cursor pagination seeks from the last row of the previous page, so deep
+# pages cost the same as the first one. Each ordering is backed by an index.
+
+
+class KeysetCursorPagination(CursorPagination):
+    """Cursor pagination that seeks on every field of ``ordering``.
+
+    DRF's cursor filters on the first field only and steps over the rows
+    tied with the last one using an offset. Here the position of a row holds
+    all its ordering values, and the last ordering field is unique, so the
+    cursor points between two rows and the whole index is used to seek.
+    """
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps(
+            [str(getattr(instance, name.lstrip("-"))) for name in ordering]
+        )
+
+    def seek(self, queryset, position, reverse):
+        """Rows after ``position`` in the ordering, before it if reverse"""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = None
+        # (a, b) > (x, y) is a > x or (a = x and b > y)
+        for order, value in reversed(list(zip(self.ordering, values))):
+            name = order.lstrip("-")
+            lookup = "lt" if reverse != order.startswith("-") else "gt"
+            after = Q(**{f"{name}__{lookup}": value})
+            if condition is not None:
+                after |= Q(**{name: value}) & condition
+            condition = after
+        return queryset.filter(condition)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = self.seek(queryset, current_position, reverse)
+
+        # one extra row tells whether a page follows, its position is where
+        # get_next_link() and get_previous_link() start to look for a marker
+        results = list(queryset[offset : offset + self.page_size + 1])
+        self.page = results[: self.page_size]
+        has_following = len(results) > len(self.page)
+        following_position = None
+        if has_following:
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+
+        has_current = current_position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = has_current, has_following
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next, self.has_previous = has_following, has_current
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class CourseCursorPagination(KeysetCursorPagination):
+    ordering = ("-released_date", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class SeriesCursorPagination(KeysetCursorPagination):
+    ordering = ("title", "id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
@@ -1,4 +1,5 @@
 from rest_framework.permissions import BasePermission
+from students.enrollment import is_enrolled
 
 # has_permission(): View-level permission check
 # has_object_permission(): Instance level permission check
@@ -6,4 +7,4 @@ from rest_framework.permissions import BasePermission
 class IsEnrolled(BasePermission):
     """This method return True to grant access or False otherwise"""
     def has_object_permission(self, request, view, obj):
-        return obj.students.filter(id=request.user.id).exists()
\ No newline at end of file
+        return is_enrolled(request.user, obj.pk)
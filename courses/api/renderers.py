@@ -0,0 +1,33 @@
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# dates, decimals, uuids and lazy strings are packed the way JSON shows them
+_encoder = JSONEncoder()
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Compact binary alternative to JSON: ``Accept: application/msgpack``
+    or ``?format=msgpack``"""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=_encoder.default)
+
+
+class MessagePackParser(BaseParser):
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.ExtraData) as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
@@ -1,23 +1,128 @@
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Manager, Prefetch
 from rest_framework import serializers
 
-from ..models import Content, Course, Module, Series
+from ..models import Content, Course, Module, SearchDocument, Series
+from ..rendering import render_items
+
+
+def split_fields(names):
+    """Turn ``["id", "modules.title"]`` into ``{"id": [], "modules":
+    ["title"]}``"""
+    tree = {}
+    for name in names:
+        head, _, rest = name.strip().partition(".")
+        if head:
+            tree.setdefault(head, [])
+            if rest:
+                tree[head].append(rest)
+    return tree
+
+
+def query_list(request, param):
+    value = request.query_params.get(param, "") if request else ""
+    return [name for name in value.split(",") if name.strip()]
+
+
+class SparseFieldsMixin(object):
+    """Serializer whose fields can be limited with ``?fields=id,title`` and
+    whose ``expandable_fields`` are nested with ``?expand=series``.
+
+    Dotted names limit the fields of a nested serializer, e.g.
+    ``?fields=id,modules.title``. ``optimize_queryset()`` restricts a
+    queryset to the columns and relations the remaining fields read.
+    """
+
+    expandable_fields = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if fields is None:
+            fields = query_list(request, "fields")
+        if expand is None:
+            expand = query_list(request, "expand")
+
+        for name in expand:
+            if name in self.expandable_fields:
+                self.fields[name] = self.expandable_fields[name](
+                    read_only=True
+                )
+        if fields:
+            self.limit_fields(fields)
+
+    def limit_fields(self, names):
+        tree = split_fields(names)
+        for name in list(self.fields):
+            if name not in tree:
+                self.fields.pop(name)
+            elif tree[name]:
+                nested = self.fields[name]
+                nested = getattr(nested, "child", nested)
+                if isinstance(nested, SparseFieldsMixin):
+                    nested.limit_fields(tree[name])
+
+    def optimize_queryset(self, queryset, required=()):
+        """Load only the columns and relations needed by the fields, plus
+        the ``required`` ones"""
+        opts = queryset.model._meta
+        columns = {opts.pk.name, *required}
+        select, prefetch = [], []
+        for field in self.fields.values():
+            nested = getattr(field, "child", field)
+            try:
+                model_field = opts.get_field(field.source)
+            except FieldDoesNotExist:
+                # computed values may read any column
+                return queryset
+            if model_field.one_to_many or model_field.many_to_many:
+                related = model_field.related_model._default_manager.all()
+                if isinstance(nested, SparseFieldsMixin):
+                    # the reverse foreign key joins the rows to their parent
+                    parent = (
+                        [model_field.field.name]
+                        if model_field.one_to_many
+                        else []
+                    )
+                    related = nested.optimize_queryset(related, parent)
+                prefetch.append(Prefetch(model_field.name, related))
+            else:
+                columns.add(model_field.name)
+                if model_field.is_relation and isinstance(
+                    nested, serializers.BaseSerializer
+                ):
+                    select.append(model_field.name)
+        queryset = queryset.prefetch_related(None).prefetch_related(*prefetch)
+        if select:
+            queryset = queryset.select_related(*select)
+        return queryset.only(*columns)
+
+
+class SeriesSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Series
+        fields = ("id", "title", "slug", "course_count")
 
 
-class SeriesSerializer(serializers.ModelSerializer):
+class OwnerSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Series
-        fields = ("id", "title", "slug")
+        model = get_user_model()
+        fields = ("id", "username", "first_name", "last_name")
 
 
-class ModuleSerializer(serializers.ModelSerializer):
+class ModuleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Module
-        fields = ("order", "title", "description")
+        fields = ("order", "title", "description", "content_count")
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     modules = ModuleSerializer(many=True, read_only=True)
 
+    expandable_fields = {"series": SeriesSerializer, "owner": OwnerSerializer}
+
     class Meta:
         model = Course
         fields = (
@@ -28,6 +133,8 @@ class CourseSerializer(serializers.ModelSerializer):
             "overview",
             "released_date",
             "owner",
+            "module_count",
+            "student_count",
             "modules",
         )
 
@@ -37,12 +144,21 @@ class ItemRelatedField(serializers.RelatedField):
         return value.render()
 
 
+class ContentListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Render the items of the whole list with a single cache round-trip
+        contents = list(data.all() if isinstance(data, Manager) else data)
+        render_items([content.item for content in contents])
+        return super().to_representation(contents)
+
+
 class ContentSerializer(serializers.ModelSerializer):
     item = ItemRelatedField(read_only=True)
 
     class Meta:
         model = Content
         fields = ["order", "item"]
+        list_serializer_class = ContentListSerializer
 
 
 class ModuleWithContentsSerializer(serializers.ModelSerializer):
@@ -68,3 +184,71 @@ class CourseWithContentsSerializer(serializers.ModelSerializer):
             "owner",
             "modules",
         ]
+
+
+class SearchResultSerializer(serializers.ModelSerializer):
+    type = serializers.CharField(source="content_type.model")
+    course_title = serializers.CharField(source="course.title")
+    rank = serializers.FloatField()
+
+    class Meta:
+        model = SearchDocument
+        fields = [
+            "type",
+            "object_id",
+            "title",
+            "course",
+            "course_title",
+            "module",
+            "rank",
+        ]
+
+
+# Flat representations of the objects returned by the sync API
+
+
+class SyncCourseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Course
+        fields = [
+            "id",
+            "series",
+            "title",
+            "slug",
+            "overview",
+            "released_date",
+            "updated",
+            "owner",
+        ]
+
+
+class SyncModuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Module
+        fields = ["id", "course", "order", "title", "description"]
+
+
+class SyncContentSerializer(serializers.ModelSerializer):
+    item_type = serializers.SerializerMethodField()
+    item_id = serializers.IntegerField(source="object_id")
+
+    class Meta:
+        model = Content
+        fields = ["id", "module", "order", "item_type", "item_id"]
+
+    def get_item_type(self, obj):
+        return ContentType.objects.get_for_id(obj.content_type_id).model
+
+
+class SyncItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    created = serializers.DateTimeField()
+    updated = serializers.DateTimeField()
+    html = serializers.CharField(source="render")
+
+
+class HeartbeatSerializer(serializers.Serializer):
+    content = serializers.IntegerField()
+    position = serializers.IntegerField(min_value=0, default=0)
+    completed = serializers.BooleanField(default=False)
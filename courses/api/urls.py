@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 
-from . import views
+from . import async_views, views
 
 app_name = "courses"
 
@@ -20,5 +21,26 @@ urlpatterns = [
         views.SeriesDetailView.as_view(),
         name="series_detail",
     ),
-    path("", include(router.urls)),
+    path("search/", views.SearchView.as_view(), name="search"),
 ]
+if settings.ASYNC_VIEWS:
+    # ahead of the router, which keeps serving the other actions
+    urlpatterns += [
+        path("courses/", async_views.course_list, name="course-list"),
+        path(
+            "courses/<pk>/",
+            async_views.course_detail,
+            name="course-detail",
+        ),
+        path(
+            "courses/<pk>/contents/",
+            async_views.course_contents,
+            name="course-contents",
+        ),
+        path(
+            "courses/<pk>/sync/",
+            async_views.course_sync,
+            name="course-sync",
+        ),
+    ]
+urlpatterns += [path("", include(router.urls))]
@@ -1,34 +1,157 @@
+import json
+from collections import Counter
+from functools import partial
+
+from django.contrib.contenttypes.models import ContentType
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, viewsets
+from rest_framework import generics, status, viewsets
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    NotFound,
+    PermissionDenied,
+    ValidationError,
+)
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from students import progress
+from students.cohort import FORMATS, enroll_cohort, read_identifiers
+from students.enrollment import is_enrolled
 
-from ..models import Course, Series
+from .. import conditional, sync
+from ..models import Course, SearchDocument, Series
+from ..rendering import render_items
+from ..search import search
+from .pagination import CourseCursorPagination, SeriesCursorPagination
 from .permissions import IsEnrolled
 from .serializers import (
     CourseSerializer,
     CourseWithContentsSerializer,
+    HeartbeatSerializer,
+    SearchResultSerializer,
     SeriesSerializer,
+    SparseFieldsMixin,
+    SyncContentSerializer,
+    SyncCourseSerializer,
+    SyncItemSerializer,
+    SyncModuleSerializer,
 )
 
+# heartbeats accepted in one request, players batch them while offline
+MAX_HEARTBEATS = 100
+
+SYNC_SERIALIZERS = {
+    "course": SyncCourseSerializer,
+    "module": SyncModuleSerializer,
+    "content": SyncContentSerializer,
+}
+
+
+class SparseQuerysetMixin(object):
+    """Fetch only the columns and relations read by the fields left after
+    ``?fields=`` and ``?expand=``, see SparseFieldsMixin"""
 
-class SeriesListView(generics.ListAPIView):
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer = self.get_serializer()
+        if not isinstance(serializer, SparseFieldsMixin):
+            return queryset
+        # the cursor of the next page is read from the last row
+        ordering = getattr(self.pagination_class, "ordering", ())
+        if isinstance(ordering, str):
+            ordering = [ordering]
+        return serializer.optimize_queryset(
+            queryset, [name.lstrip("-") for name in ordering]
+        )
+
+
+class SeriesListView(SparseQuerysetMixin, generics.ListAPIView):
     queryset = Series.objects.all()
     serializer_class = SeriesSerializer
+    pagination_class = SeriesCursorPagination
 
 
-class SeriesDetailView(generics.RetrieveAPIView):
+class SeriesDetailView(SparseQuerysetMixin, generics.RetrieveAPIView):
     queryset = Series.objects.all()
     serializer_class = SeriesSerializer
 
 
-class CourseViewSet(viewsets.ReadOnlyModelViewSet):
+class SearchPagination(PageNumberPagination):
+    page_size = 20
+
+
+class SearchView(generics.ListAPIView):
+    """Ranked search over courses, modules and texts: ``?q=<words>``"""
+
+    queryset = SearchDocument.objects.none()
+    serializer_class = SearchResultSerializer
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        query = self.request.query_params.get("q", "").strip()
+        if not query:
+            return self.queryset
+        return search(query)
+
+
+def cohort_type(upload):
+    """Format of an uploaded cohort file, from its name and content type"""
+    if upload.name.endswith((".jsonl", ".json")) or upload.content_type in (
+        "application/json",
+        "application/jsonl",
+        "application/x-ndjson",
+    ):
+        return "jsonl"
+    return "csv"
+
+
+class CourseViewSet(SparseQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     # Perform read-only action. list() and retreive()
-    queryset = Course.objects.all()
+    queryset = Course.objects.prefetch_related("modules")
     serializer_class = CourseSerializer
+    pagination_class = CourseCursorPagination
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == "contents":
+            qs = qs.with_contents()
+        return qs
+
+    def get_validators(self):
+        """``(etag, last_modified)`` of the response to a read action, from
+        the catalog generation and the sync journal, see
+        ``courses.conditional``"""
+        request = self.request
+        format = request.accepted_renderer.format
+        if not self.detail:
+            entry_id, _ = conditional.journal_head()
+            return conditional.catalog_etag(request, entry_id, format), None
+        try:
+            course_id = int(self.kwargs["pk"])
+        except ValueError:
+            raise NotFound
+        if self.action == "contents":
+            # only journaled objects, so the journal dates the response
+            return conditional.journal_validators(request, course_id, format)
+        # the series and student count come from the catalog
+        return conditional.course_etag(request, course_id, format), None
+
+    def list(self, request, *args, **kwargs):
+        return conditional.respond(
+            request,
+            self.get_validators(),
+            partial(super().list, request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional.respond(
+            request,
+            self.get_validators(),
+            partial(super().retrieve, request, *args, **kwargs),
+        )
 
     @action(
         detail=True,
@@ -40,6 +163,41 @@ class CourseViewSet(viewsets.ReadOnlyModelViewSet):
         course.students.add(request.user)
         return Response({"enrolled": True})
 
+    @action(
+        detail=True,
+        methods=["post"],
+        permission_classes=[IsAuthenticated],
+        url_path="enroll-cohort",
+    )
+    def enroll_cohort(self, request, *args, **kwargs):
+        """Enroll the usernames or emails of an uploaded CSV or JSON Lines
+        ``file``. Streams one JSON line per row, then a summary line.
+
+        The file type is taken from ``?type=csv|jsonl``, else from the name
+        and content type of the file. ``?format=`` is the renderer.
+        """
+        course = self.get_object()
+        if course.owner_id != request.user.id:
+            raise PermissionDenied
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": "A cohort file is required."})
+        file_type = request.query_params.get("type") or cohort_type(upload)
+        if file_type not in FORMATS:
+            raise ValidationError({"type": f"Expected one of {FORMATS}."})
+
+        def results():
+            totals = Counter()
+            rows = read_identifiers(upload, file_type)
+            for result in enroll_cohort(course, rows):
+                totals[result["status"]] += 1
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"totals": totals}) + "\n"
+
+        return StreamingHttpResponse(
+            results(), content_type="application/x-ndjson"
+        )
+
     @action(
         detail=True,
         methods=["get"],
@@ -49,6 +207,91 @@ class CourseViewSet(viewsets.ReadOnlyModelViewSet):
     def contents(self, request, *args, **kwargs):
         return self.retrieve(request, *args, **kwargs)
 
+    @action(detail=True, methods=["get"], permission_classes=[IsAuthenticated])
+    def sync(self, request, pk=None):
+        """Objects of the course changed since ``?since=<cursor>``, deleted
+        ones as tombstones. Pass the returned cursor on the next call, and
+        call again right away while ``has_more`` is true."""
+        try:
+            course_id = int(pk)
+            since = int(request.query_params.get("since", 0))
+        except ValueError:
+            raise ValidationError({"since": "Expected an integer cursor."})
+        # enrollments are cached, so an up to date client costs one query
+        if not is_enrolled(request.user, course_id) and not (
+            Course.objects.filter(pk=course_id, owner=request.user).exists()
+        ):
+            raise NotFound
+
+        entries, objects, has_more = sync.changes(course_id, since)
+        render_items(
+            [obj for obj in objects.values() if hasattr(obj, "render")]
+        )
+        changes = []
+        for entry in entries:
+            model = ContentType.objects.get_for_id(entry.content_type_id).model
+            obj = objects.get((entry.content_type_id, entry.object_id))
+            change = {
+                "type": model,
+                "id": entry.object_id,
+                "deleted": obj is None,
+            }
+            if obj is not None:
+                serializer = SYNC_SERIALIZERS.get(model, SyncItemSerializer)
+                change["data"] = serializer(obj).data
+            changes.append(change)
+        return Response(
+            {
+                "cursor": entries[-1].seq if entries else since,
+                "has_more": has_more,
+                "changes": changes,
+            }
+        )
+
+    @action(
+        detail=True,
+        methods=["get", "post"],
+        permission_classes=[IsAuthenticated],
+    )
+    def progress(self, request, pk=None):
+        """POST a heartbeat ``{content, position, completed}``, or a list
+        of them, while a student works through the course. Heartbeats are
+        buffered and written in batches, so GET may lag a few seconds."""
+        try:
+            course_id = int(pk)
+        except ValueError:
+            raise NotFound
+        if not is_enrolled(request.user, course_id):
+            raise NotFound
+
+        if request.method == "GET":
+            last_module_id, completed = progress.course_progress(
+                request.user, course_id
+            )
+            return Response(
+                {"module": last_module_id, "completed": sorted(completed)}
+            )
+
+        many = isinstance(request.data, list)
+        if many and len(request.data) > MAX_HEARTBEATS:
+            raise ValidationError(
+                f"Send at most {MAX_HEARTBEATS} heartbeats at a time."
+            )
+        serializer = HeartbeatSerializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        heartbeats = serializer.validated_data
+        if not many:
+            heartbeats = [heartbeats]
+        # contents outside the courses of the student are dropped on flush
+        for heartbeat in heartbeats:
+            progress.record(
+                request.user.id,
+                heartbeat["content"],
+                heartbeat["position"],
+                heartbeat["completed"],
+            )
+        return Response(status=status.HTTP_202_ACCEPTED)
+
 
 # class CourseEnrollView(APIView):
 #     authentication_classes = [BasicAuthentication]
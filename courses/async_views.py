@@ -0,0 +1,65 @@
+"""Async versions of the read-heavy catalog pages.
+
+The URLconfs route to these views instead of the sync ones when the
+ASYNC_VIEWS environment variable is 1. Cache lookups are awaited. Django
+4.0 has no async ORM, so the queries of a view and the rendering of its
+template each run in one sync_to_async call, in the thread of the request.
+
+The async cache methods of Django 4.0 also run in that thread, so this
+path is about as fast as the sync views under ASGI, see ``manage.py
+bench_asgi``. It starts to pay off with cache backends and an ORM that
+are natively async.
+"""
+from asgiref.sync import sync_to_async
+from django.shortcuts import get_object_or_404, render
+from students.forms import CourseEnrollForm
+
+from . import catalog, conditional
+from .models import Course, Series
+
+arender = sync_to_async(render)
+
+
+async def load_user(request):
+    """Load request.user in a thread, there is no async auth in Django 4.0"""
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def course_list(request, subject=None):
+    etag = await sync_to_async(conditional.catalog_etag)(request, subject)
+    response = conditional.not_modified(request, etag)
+    if response is not None:
+        return response
+    series = await catalog.aget_series()
+    if subject:
+        subject = await sync_to_async(get_object_or_404)(Series, slug=subject)
+    courses = await catalog.aget_courses(subject)
+    response = await arender(
+        request,
+        "courses/course/list.html",
+        {"series": series, "subject": subject, "courses": courses},
+    )
+    return conditional.add_validators(response, etag)
+
+
+async def course_detail(request, slug):
+    course = await sync_to_async(get_object_or_404)(
+        Course.objects.select_related("series", "owner"), slug=slug
+    )
+    etag = await sync_to_async(conditional.course_etag)(
+        request, course.id, series_id=course.series_id
+    )
+    response = conditional.not_modified(request, etag)
+    if response is not None:
+        return response
+    response = await arender(
+        request,
+        "courses/course/detail.html",
+        {
+            "object": course,
+            "course": course,
+            "enroll_form": CourseEnrollForm(initial={"course": course}),
+        },
+    )
+    return conditional.add_validators(response, etag)
@@ -0,0 +1,156 @@
+"""Caching of the public course catalog.
+
+Cached lists are keyed by generation counters: one for the whole catalog
+and one per series. Editing a course, module or series bumps the matching
+generations (see ``courses.signals``), so entries never need a timeout and
+stale ones are simply never read again. Right after a bump, the previous
+version is served until one process has built the new one, see
+``academy.cache.TwoTierCache.get_or_set``.
+
+The ``a``-prefixed functions are the same lookups for async views.
+"""
+import time
+
+from academy.routers import primary
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Course, Series
+
+CATALOG_CACHE_TIMEOUT = getattr(settings, "CATALOG_CACHE_TIMEOUT", None)
+
+CATALOG_GENERATION = "catalog:gen:all"
+
+
+def series_generation_key(series_id):
+    return f"catalog:gen:series:{series_id}"
+
+
+def _new_generation():
+    # Start from the clock so a counter lost to eviction never comes back
+    # with a value that was already used.
+    return int(time.time() * 1000)
+
+
+def get_generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_generation(), None)
+        generation = cache.get(key)
+    return generation
+
+
+async def aget_generation(key):
+    generation = await cache.aget(key)
+    if generation is None:
+        await cache.aadd(key, _new_generation(), None)
+        generation = await cache.aget(key)
+    return generation
+
+
+def bump_generations(series_ids=()):
+    """Invalidate the whole catalog and the course lists of the given series"""
+    keys = [CATALOG_GENERATION]
+    keys += [series_generation_key(pk) for pk in set(series_ids) if pk]
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_generation(), None)
+
+
+def _build(build):
+    # a replica behind the generation bump would cache an old version
+    with primary():
+        return build()
+
+
+def _cached(key, build, stale_key):
+    """The value of key, built once across processes. While it is being
+    built the other processes serve the latest value of stale_key."""
+    return cache.get_or_set(
+        key,
+        lambda: _build(build),
+        CATALOG_CACHE_TIMEOUT,
+        stale_key=stale_key,
+    )
+
+
+async def _acached(key, build, stale_key):
+    return await cache.aget_or_set(
+        key,
+        lambda: _build(build),
+        CATALOG_CACHE_TIMEOUT,
+        stale_key=stale_key,
+    )
+
+
+# Lists of a generation never change and are kept in the local cache of
+# each process, see LOCAL_PREFIXES. The latest list is overwritten on every
+# build, so its key stays out of the "catalog:data:" prefix.
+
+
+def series_key(generation=None):
+    """Key of the series of generation, or of the latest series"""
+    if generation is None:
+        return "catalog:latest:series"
+    return f"catalog:data:series:{generation}"
+
+
+def courses_key(generation=None, series=None):
+    """Key of the courses of generation, or of the latest courses"""
+    name = "courses" if series is None else f"series:{series.id}:courses"
+    if generation is None:
+        return f"catalog:latest:{name}"
+    return f"catalog:data:{name}:{generation}"
+
+
+def courses_queryset(series=None):
+    courses = Course.objects.select_related("series", "owner")
+    if series is not None:
+        courses = courses.filter(series=series)
+    return courses
+
+
+def get_series():
+    """All series"""
+    generation = get_generation(CATALOG_GENERATION)
+    return _cached(
+        series_key(generation),
+        lambda: list(Series.objects.all()),
+        series_key(),
+    )
+
+
+async def aget_series():
+    generation = await aget_generation(CATALOG_GENERATION)
+    return await _acached(
+        series_key(generation),
+        lambda: list(Series.objects.all()),
+        series_key(),
+    )
+
+
+def get_courses(series=None):
+    """All courses, optionally of a single series"""
+    if series is None:
+        generation = get_generation(CATALOG_GENERATION)
+    else:
+        generation = get_generation(series_generation_key(series.id))
+    return _cached(
+        courses_key(generation, series),
+        lambda: list(courses_queryset(series)),
+        courses_key(series=series),
+    )
+
+
+async def aget_courses(series=None):
+    if series is None:
+        generation = await aget_generation(CATALOG_GENERATION)
+    else:
+        generation = await aget_generation(series_generation_key(series.id))
+    return await _acached(
+        courses_key(generation, series),
+        lambda: list(courses_queryset(series)),
+        courses_key(series=series),
+    )
@@ -0,0 +1,104 @@
+"""Validators for conditional GETs of the course pages and API.
+
+ETags are hashed from version stamps that are kept up to date anyway: the
+catalog generations (see ``courses.catalog``), which course, module,
+series and enrollment changes bump, as do renamed course owners and new
+variants of a hero image, and the newest entry of the sync journal of a
+course (see ``courses.sync``), which every change of the course, its
+modules, contents and items writes. The journal head of a
+course is read with one query on ``syncentry_cursor_idx``, and its time is
+the Last-Modified of pages built only from journaled objects.
+
+Pages also depend on who asks, so the user and the CSRF cookie their forms
+embed are part of the tags. Views check the validators before building
+their context and answer 304 without rendering when the client's copy is
+current.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .catalog import (
+    CATALOG_GENERATION,
+    get_generation,
+    series_generation_key,
+)
+from .models import SyncEntry
+
+
+def make_etag(*parts):
+    return '"{}"'.format(hashlib.sha1(repr(parts).encode()).hexdigest()[:16])
+
+
+def client_parts(request):
+    return request.user.pk, request.META.get("CSRF_COOKIE")
+
+
+def journal_head(course_id=None):
+    """``(seq, created)`` of the newest journal entry of a course, or
+    ``(id, created)`` of the whole journal, ``(0, None)`` when there is
+    none"""
+    if course_id is None:
+        entries, number = SyncEntry.objects.all(), "id"
+    else:
+        entries, number = SyncEntry.objects.filter(course_id=course_id), "seq"
+    entries = entries.order_by(f"-{number}").values_list(number, "created")
+    return entries.first() or (0, None)
+
+
+def catalog_etag(request, *parts, series_id=None):
+    """ETag of a page built from the catalog, or from the courses of one
+    series"""
+    if series_id is None:
+        generation = get_generation(CATALOG_GENERATION)
+    else:
+        generation = get_generation(series_generation_key(series_id))
+    return make_etag(generation, *parts, *client_parts(request))
+
+
+def course_etag(request, course_id, *parts, series_id=None):
+    """ETag of a page of one course that also shows catalog data, like the
+    series or the student count"""
+    entry_id, _ = journal_head(course_id)
+    return catalog_etag(
+        request, course_id, entry_id, *parts, series_id=series_id
+    )
+
+
+def journal_validators(request, course_id, *parts):
+    """``(etag, last_modified)`` of a page built only from the course, its
+    modules, contents and items, whose changes are all journaled"""
+    entry_id, created = journal_head(course_id)
+    etag = make_etag(course_id, entry_id, *parts, *client_parts(request))
+    return etag, created
+
+
+def not_modified(request, etag, last_modified=None):
+    """A 304 response when the client's copy matches the validators,
+    otherwise None"""
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified and int(last_modified.timestamp()),
+    )
+    if response is not None:
+        add_validators(response, etag, last_modified)
+    return response
+
+
+def add_validators(response, etag, last_modified=None):
+    if response.status_code in (200, 304):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+def respond(request, validators, build):
+    """The response of build(), or a 304 if the client's copy is current.
+    validators is ``(etag, last_modified)``."""
+    response = not_modified(request, *validators)
+    if response is None:
+        response = add_validators(build(), *validators)
+    return response
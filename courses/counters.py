@@ -0,0 +1,66 @@
+"""Stored counters of the catalog.
+
+``Series.course_count``, ``Course.module_count``, ``Course.student_count``
+and ``Module.content_count`` are incremented and decremented with F()
+updates from ``courses.signals``, so listing pages read them instead of
+grouping the related tables. Writes that bypass signals, like bulk
+inserts, are repaired with ``manage.py recount_catalog``.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Content, Course, Module, Series
+
+
+def counters():
+    """``(model, counter field, related queryset, foreign key)`` of every
+    counter"""
+    return [
+        (Series, "course_count", Course.objects.all(), "series_id"),
+        (Course, "module_count", Module.objects.all(), "course_id"),
+        (
+            Course,
+            "student_count",
+            Course.students.through.objects.all(),
+            "course_id",
+        ),
+        (Module, "content_count", Content.objects.all(), "module_id"),
+    ]
+
+
+def add(model, field, pks, n=1):
+    """Add n to a counter of the rows pks, atomically in the database.
+    Counters stop at zero, a drifted one is left to recount()."""
+    pks = [pk for pk in pks if pk is not None]
+    if pks and n:
+        value = F(field) + n
+        if n < 0:
+            value = Greatest(value, 0)
+        model.objects.filter(pk__in=pks).update(**{field: value})
+
+
+def actual_count(related, foreign_key):
+    return Coalesce(
+        Subquery(
+            related.filter(**{foreign_key: OuterRef("pk")})
+            .order_by()
+            .values(foreign_key)
+            .annotate(n=Count("pk"))
+            .values("n")
+        ),
+        0,
+    )
+
+
+def recount():
+    """Recount every counter from the related tables. Returns the number
+    of rows corrected by counter name."""
+    corrected = {}
+    for model, field, related, foreign_key in counters():
+        actual = actual_count(related, foreign_key)
+        corrected[f"{model._meta.model_name}.{field}"] = (
+            model.objects.annotate(actual=actual)
+            .exclude(**{field: F("actual")})
+            .update(**{field: actual})
+        )
+    return corrected
@@ -0,0 +1,151 @@
+"""Streaming of File items with HTTP range and validator support.
+
+Downloads are streamed in FILE_DOWNLOAD_CHUNK_SIZE blocks and honour
+``Range``/``If-Range``, so interrupted downloads resume where they
+stopped. With FILE_DOWNLOAD_OFFLOAD set to ``"x-accel-redirect"`` (nginx)
+or ``"x-sendfile"`` (Apache, lighttpd) the checked request is handed to
+the front-end proxy instead, which then serves the bytes itself.
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseNotModified,
+)
+from django.utils.http import http_date, parse_http_date_safe
+
+FILE_DOWNLOAD_CHUNK_SIZE = getattr(
+    settings, "FILE_DOWNLOAD_CHUNK_SIZE", 64 * 1024
+)
+FILE_DOWNLOAD_OFFLOAD = getattr(settings, "FILE_DOWNLOAD_OFFLOAD", None)
+FILE_DOWNLOAD_ACCEL_PREFIX = getattr(
+    settings, "FILE_DOWNLOAD_ACCEL_PREFIX", "/protected-media/"
+)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class RangeFile:
+    """Read-only view of ``length`` bytes of a file, from its position"""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(item):
+    # strong: the stored bytes only change together with ``updated``
+    stamp = int(item.updated.timestamp() * 1_000_000)
+    return f'"file-{item.pk}-{item.file.size}-{stamp}"'
+
+
+def parse_range(header, size):
+    """Return the ``(start, end)`` byte positions, both inclusive, asked for
+    by a Range header, or None to send the whole file. Malformed and
+    multi-part ranges may be ignored according to RFC 7233."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            # an empty file has no last bytes to send
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def range_applies(request, etag, last_modified):
+    """Whether the If-Range precondition, if any, allows a partial reply"""
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified.timestamp())
+
+
+def serve_file(request, item):
+    field = item.file
+    size = field.size
+    etag = file_etag(item)
+    filename = os.path.basename(field.name)
+
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    if FILE_DOWNLOAD_OFFLOAD:
+        # the proxy handles ranges and validators of the file itself
+        content_type, _ = mimetypes.guess_type(filename)
+        response = HttpResponse(
+            content_type=content_type or "application/octet-stream"
+        )
+        if FILE_DOWNLOAD_OFFLOAD == "x-sendfile":
+            response["X-Sendfile"] = field.path
+        else:
+            response["X-Accel-Redirect"] = FILE_DOWNLOAD_ACCEL_PREFIX + quote(
+                field.name
+            )
+        response["Content-Disposition"] = (
+            f"attachment; filename*=utf-8''{quote(filename)}"
+        )
+        response["ETag"] = etag
+        return response
+
+    byte_range = None
+    if "Range" in request.headers and range_applies(
+        request, etag, item.updated
+    ):
+        try:
+            byte_range = parse_range(request.headers["Range"], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    file = field.storage.open(field.name, "rb")
+    if byte_range is None:
+        response = FileResponse(file, as_attachment=True, filename=filename)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(
+            RangeFile(file, end - start + 1),
+            status=206,
+            as_attachment=True,
+            filename=filename,
+        )
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response.block_size = FILE_DOWNLOAD_CHUNK_SIZE
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(item.updated.timestamp())
+    return response
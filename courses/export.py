@@ -0,0 +1,306 @@
+"""Offline packages of a course.
+
+A package is a zip holding ``index.html``, one static page per module made
+of the rendered items, and the media those pages refer to. Every file of a
+package has a stamp derived from the ``updated`` timestamps of what it is
+built from; the package version is a hash of these stamps, so it changes
+exactly when a learner would see a difference.
+
+Packages are produced as a stream and never held in memory, neither the
+archive nor the media it copies. While a package is streamed it is also
+written to COURSE_EXPORT_ROOT and later requests for the same version are
+served from there. A delta pack built ``since`` an earlier version only
+holds the files whose stamp changed, and lists the files to delete in its
+``manifest.json``. ``manage.py purge_exports`` deletes the packages and
+manifests that were not used for a while.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+import zipfile
+
+from django.conf import settings
+from django.db.models.fields.files import ImageFieldFile
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from .images import IMAGE_VARIANT_FORMATS, variant_name, variant_widths
+from .models import File, Image
+
+COURSE_EXPORT_ROOT = getattr(
+    settings,
+    "COURSE_EXPORT_ROOT",
+    os.path.join(settings.BASE_DIR, "exports"),
+)
+COURSE_EXPORT_CHUNK_SIZE = getattr(
+    settings, "COURSE_EXPORT_CHUNK_SIZE", 256 * 1024
+)
+
+VERSION_RE = re.compile(r"^[0-9a-f]{16}$")
+
+
+def stamp(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def updated_stamp(obj):
+    return int(obj.updated.timestamp() * 1_000_000)
+
+
+def media_files(field_file):
+    """Storage names of field_file and of the image variants it has"""
+    if not field_file:
+        return []
+    names = [field_file.name]
+    if isinstance(field_file, ImageFieldFile):
+        for width in variant_widths(field_file):
+            for ext in IMAGE_VARIANT_FORMATS:
+                name = variant_name(field_file.name, width, ext)
+                if field_file.storage.exists(name):
+                    names.append(name)
+    return names
+
+
+def localize(html, item):
+    """Point the media URLs of a rendered item into the package"""
+    if isinstance(item, File):
+        html = html.replace(
+            reverse("courses:file_download", args=[item.pk]),
+            f"media/{item.file.name}",
+        )
+    return html.replace(settings.MEDIA_URL, "media/")
+
+
+class StreamBuffer:
+    """Write-only file that hands out the bytes written since the last
+    ``pop()``. zipfile sees it can't seek and streams its entries."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class Package:
+    """The offline package of a course, optionally as a delta pack holding
+    only what changed since the package version ``since``.
+
+    ``course`` should come with its contents prefetched, see
+    ``Course.objects.with_contents()``.
+    """
+
+    def __init__(self, course, since=None):
+        self.course = course
+        self.entries = self.collect_entries()
+        self.files = {path: file_stamp for path, file_stamp, _ in self.entries}
+        self.version = stamp(sorted(self.files.items()))
+        self.base = None
+        self.base_files = {}
+        if since and VERSION_RE.match(since):
+            base_files = self.load_manifest(since)
+            # an unknown base version gets the full package
+            if base_files is not None:
+                self.base, self.base_files = since, base_files
+
+    def collect_entries(self):
+        """``(path, stamp, source)`` of every file of the package. source is
+        a callable returning the page, or the storage holding the media."""
+        course = self.course
+        modules = list(course.modules.all())
+        entries = [
+            (
+                "index.html",
+                stamp(
+                    updated_stamp(course),
+                    [(module.id, module.title) for module in modules],
+                ),
+                lambda: render_to_string(
+                    "courses/export/index.html",
+                    {"course": course, "modules": modules},
+                ),
+            )
+        ]
+        for name in media_files(course.hero_image):
+            entries.append(
+                (f"media/{name}", updated_stamp(course), course.hero_image)
+            )
+
+        for module in modules:
+            items = [content.item for content in module.contents.all()]
+            items = [item for item in items if item is not None]
+            item_stamps = [
+                (item._meta.label_lower, item.pk, updated_stamp(item))
+                for item in items
+            ]
+            entries.append(
+                (
+                    f"module-{module.id}.html",
+                    stamp(module.title, module.description, item_stamps),
+                    lambda module=module, items=items: self.render_module(
+                        module, items
+                    ),
+                )
+            )
+            for item in items:
+                if isinstance(item, File):
+                    field_file = item.file
+                elif isinstance(item, Image):
+                    field_file = item.module_image
+                else:
+                    continue
+                for name in media_files(field_file):
+                    entries.append(
+                        (f"media/{name}", updated_stamp(item), field_file)
+                    )
+
+        # an item placed in several modules is stored once
+        unique = {}
+        for entry in entries:
+            unique.setdefault(entry[0], entry)
+        return list(unique.values())
+
+    def render_module(self, module, items):
+        return render_to_string(
+            "courses/export/module.html",
+            {
+                "course": self.course,
+                "module": module,
+                "items": [localize(item.render(), item) for item in items],
+            },
+        )
+
+    def manifest(self):
+        manifest = {
+            "course": self.course.pk,
+            "version": self.version,
+            "base": self.base,
+            "files": self.files,
+        }
+        if self.base:
+            deleted = set(self.base_files) - set(self.files)
+            manifest["deleted"] = sorted(deleted)
+        return manifest
+
+    def changed_entries(self):
+        return [
+            entry
+            for entry in self.entries
+            if self.base_files.get(entry[0]) != entry[1]
+        ]
+
+    @property
+    def filename(self):
+        slug = self.course.slug or f"course-{self.course.pk}"
+        if self.base:
+            return f"{slug}-{self.base}-{self.version}.zip"
+        return f"{slug}-{self.version}.zip"
+
+    @property
+    def path(self):
+        return os.path.join(
+            COURSE_EXPORT_ROOT, f"{self.course.pk}-{self.filename}"
+        )
+
+    def manifest_path(self, version):
+        return os.path.join(
+            COURSE_EXPORT_ROOT, f"{self.course.pk}-{version}.json"
+        )
+
+    def load_manifest(self, version):
+        path = self.manifest_path(version)
+        try:
+            with open(path) as manifest:
+                files = json.load(manifest)["files"]
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return files
+
+    def save_manifest(self):
+        """Remember the files of this version, to build delta packs from it"""
+        os.makedirs(COURSE_EXPORT_ROOT, exist_ok=True)
+        tmp = f"{self.manifest_path(self.version)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as manifest:
+            json.dump({"version": self.version, "files": self.files}, manifest)
+        os.replace(tmp, self.manifest_path(self.version))
+
+    def is_cached(self):
+        return os.path.exists(self.path)
+
+    def touch(self):
+        """Mark the cached package and its manifest as used, see
+        ``manage.py purge_exports``"""
+        for path in (self.path, self.manifest_path(self.version)):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    def stream(self):
+        """Yield the zip archive of the package chunk by chunk"""
+        buffer = StreamBuffer()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(
+                "manifest.json", json.dumps(self.manifest(), indent=2)
+            )
+            yield buffer.pop()
+            for path, _, source in self.changed_entries():
+                if callable(source):
+                    archive.writestr(path, source())
+                    yield buffer.pop()
+                    continue
+                # media is compressed already and is copied as is
+                info = zipfile.ZipInfo(path, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                name = path.split("/", 1)[1]
+                with source.storage.open(name, "rb") as media, archive.open(
+                    info, "w", force_zip64=True
+                ) as entry:
+                    while True:
+                        block = media.read(COURSE_EXPORT_CHUNK_SIZE)
+                        if not block:
+                            break
+                        entry.write(block)
+                        yield buffer.pop()
+        yield buffer.pop()
+
+    def stream_to_cache(self):
+        """Yield the archive like ``stream()`` and keep a copy of it in
+        COURSE_EXPORT_ROOT once it was produced completely. Its manifest is
+        only saved then, so deltas are never built against a version that
+        no client could have received."""
+        os.makedirs(COURSE_EXPORT_ROOT, exist_ok=True)
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "wb") as copy:
+                for chunk in self.stream():
+                    copy.write(chunk)
+                    yield chunk
+            os.replace(tmp, self.path)
+            self.save_manifest()
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def build(self):
+        """Write the package to the cache, unless it is there already, and
+        return its path"""
+        if self.is_cached():
+            self.touch()
+        else:
+            for _ in self.stream_to_cache():
+                pass
+        return self.path
@@ -1,34 +1,277 @@
+import random
+import time
+from bisect import bisect_left
+
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils.translation import gettext_lazy as _
 
+# Sparse keys are millisecond timestamps shifted left by SPARSE_BITS with
+# random low bits, so every append sorts last without reading its siblings.
+# They stay below MAX_KEY, the largest integer JSON clients read exactly,
+# until 2248. Two appends in the same millisecond pick the same key once in
+# SPARSE_GAP times, the second insert is then retried with a new key, see
+# SparseOrderMixin.
+SPARSE_BITS = 10
+SPARSE_GAP = 1 << SPARSE_BITS
+MAX_KEY = 2**53 - 1
+SPARSE_RETRIES = 5
+
+# Groups with neighbouring keys closer than this are compacted by
+# ``manage.py rebalance_order``.
+SPARSE_MIN_GAP = 1 << 4
+
+
+def sparse_key():
+    """Return a key greater than every key handed out before"""
+    now = time.time_ns() // 1_000_000
+    return (now << SPARSE_BITS) | random.getrandbits(SPARSE_BITS)
+
+
+def keys_between(low, high, count, taken=()):
+    """Return ``count`` increasing keys strictly between low and high.
+
+    ``low`` may be None for the start of the list and ``high`` None for its
+    end. Keys in ``taken`` are never returned. Returns None when the gap is
+    too small, in which case the group has to be rebalanced first.
+    """
+    low = -1 if low is None else low
+    if high is None:
+        # never past the key of an append made now, which has to sort last
+        high = sparse_key() + 1
+    step = (high - low) // (count + 1)
+    if step < 1:
+        return None
+    keys = [low + step * (i + 1) for i in range(count)]
+    if keys[-1] > MAX_KEY or set(keys) & set(taken):
+        return None
+    return keys
+
+
+def spread_keys(count, taken=()):
+    """``count`` evenly gapped keys from SPARSE_GAP on, none of them in
+    taken, so rows can be rewritten in any order without a conflict"""
+    for offset in range(SPARSE_GAP):
+        keys = [(i + 1) * SPARSE_GAP + offset for i in range(count)]
+        if not set(taken) & set(keys):
+            return keys
+
+
+def increasing_run(keys):
+    """Indexes of a longest strictly increasing subsequence of keys"""
+    tails, tail_indexes, previous = [], [], [None] * len(keys)
+    for i, key in enumerate(keys):
+        pos = bisect_left(tails, key)
+        if pos == len(tails):
+            tails.append(key)
+            tail_indexes.append(i)
+        else:
+            tails[pos] = key
+            tail_indexes[pos] = i
+        previous[i] = tail_indexes[pos - 1] if pos else None
+
+    run = []
+    i = tail_indexes[-1] if tail_indexes else None
+    while i is not None:
+        run.append(i)
+        i = previous[i]
+    return run[::-1]
+
 
 class OrderField(models.PositiveIntegerField):
+    """Position of an object among the objects sharing ``for_fields``.
+
+    By default new objects get the dense position after the last one. With
+    ``sparse=True`` positions are gapped keys: appending an object writes
+    only that row and never reads its siblings, and a reorder only writes
+    the rows that moved, see ``reorder()``.
+    """
+
     description = _("Order field for objects")
 
-    def __init__(self, for_fields=None, *args, **kwargs):
+    def __init__(self, for_fields=None, sparse=False, *args, **kwargs):
         self.for_fields = for_fields
+        self.sparse = sparse
         super().__init__(*args, **kwargs)
 
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.sparse:
+            kwargs["sparse"] = True
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        # sparse keys don't fit in a 32 bit column
+        if self.sparse:
+            return "PositiveBigIntegerField"
+        return super().get_internal_type()
+
+    def group(self, model_instance):
+        """Queryset of the objects ordered together with model_instance"""
+        qs = self.model._default_manager.all()
+        if self.for_fields:
+            query = {
+                field.attname: getattr(model_instance, field.attname)
+                for field in map(self.model._meta.get_field, self.for_fields)
+            }
+            qs = qs.filter(**query)
+        return qs
+
     def pre_save(self, model_instance, add):
         if getattr(model_instance, self.attname) is None:
             # no current value
-            try:
-                qs = self.model.objects.all()
-                if self.for_fields:
-                    query = {
-                        field: getattr(model_instance, field)
-                        for field in self.for_fields
-                    }
-                    print("QUERY", query)
-                    qs = qs.filter(**query)
-                    print("QS", qs)
-                # get the order of the last item
-                last_item = qs.latest(self.attname)
-                value = last_item.order + 1
-            except ObjectDoesNotExist:
-                value = 0
+            if self.sparse:
+                value = sparse_key()
+            else:
+                try:
+                    # get the order of the last item
+                    last_item = self.group(model_instance).latest(
+                        self.attname
+                    )
+                    value = getattr(last_item, self.attname) + 1
+                except ObjectDoesNotExist:
+                    value = 0
             setattr(model_instance, self.attname, value)
             return value
         else:
             return super().pre_save(model_instance, add)
+
+    def reorder(self, rows):
+        """Give rows, listed in their new order, increasing keys.
+
+        In sparse mode the longest run of rows that is already in order keeps
+        its keys and only the other rows get a key between their neighbours.
+        New keys never equal a key in use, so the changed rows can be written
+        with one statement. Returns the rows whose key changed.
+        """
+        name = self.attname
+        keys = [getattr(row, name) for row in rows]
+        if not self.sparse:
+            changed = [pos for pos, key in enumerate(keys) if pos != key]
+            for pos in changed:
+                setattr(rows[pos], name, pos)
+            return [rows[pos] for pos in changed]
+
+        keep = set(increasing_run(keys))
+        taken = set(keys)
+        changed = []
+        start = 0
+        while start < len(rows):
+            if start in keep:
+                start += 1
+                continue
+            end = start
+            while end < len(rows) and end not in keep:
+                end += 1
+            low = keys[start - 1] if start else None
+            high = keys[end] if end < len(rows) else None
+            new_keys = keys_between(low, high, end - start, taken)
+            if new_keys is None:
+                # no room left between the neighbours, spread the keys of
+                # every row instead
+                new_keys = spread_keys(len(rows), taken)
+                for row, key in zip(rows, new_keys):
+                    setattr(row, name, key)
+                return list(rows)
+            for row, key in zip(rows[start:end], new_keys):
+                setattr(row, name, key)
+                changed.append(row)
+            start = end
+        return changed
+
+    def needs_rebalance(self, keys):
+        return any(b - a < SPARSE_MIN_GAP for a, b in zip(keys, keys[1:]))
+
+    @transaction.atomic
+    def rebalance(self, model_instance):
+        """Spread the keys of model_instance's group evenly, keeping order"""
+        name = self.attname
+        rows = list(
+            self.group(model_instance)
+            .select_for_update()
+            .order_by(name)
+            .only("pk", name)
+        )
+        # none of the new keys is still in use, so the update never trips
+        # the unique constraint halfway through
+        keys = spread_keys(len(rows), {getattr(row, name) for row in rows})
+        for row, key in zip(rows, keys):
+            setattr(row, name, key)
+        self.model._default_manager.bulk_update(rows, [name])
+        return len(rows)
+
+
+class SparseOrderMixin(object):
+    """Retry the insert of an object whose sparse order key was taken by
+    a concurrent append in the same millisecond, see sparse_key()"""
+
+    def save(self, *args, **kwargs):
+        fields = [
+            field
+            for field in self._meta.concrete_fields
+            if isinstance(field, OrderField)
+            and field.sparse
+            and getattr(self, field.attname) is None
+        ]
+        if not self._state.adding or not fields:
+            return super().save(*args, **kwargs)
+        for attempt in range(SPARSE_RETRIES):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                taken = [
+                    field
+                    for field in fields
+                    if field.group(self)
+                    .filter(**{field.attname: getattr(self, field.attname)})
+                    .exists()
+                ]
+                if not taken or attempt == SPARSE_RETRIES - 1:
+                    raise
+                for field in taken:
+                    setattr(self, field.attname, None)
+
+
+class CounterField(models.PositiveIntegerField):
+    """Stored number of related rows, kept up to date with F() updates from
+    ``courses.signals`` and repaired by ``manage.py recount_catalog``.
+
+    Counters are never edited in forms and are left out of regular saves,
+    see CountersMixin.
+    """
+
+    description = _("Counter of related objects")
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("default", 0)
+        kwargs["editable"] = False
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs["editable"]
+        if kwargs.get("default") == 0:
+            del kwargs["default"]
+        return name, path, args, kwargs
+
+
+class CountersMixin(object):
+    """Leave the counter fields out of updates, so saving an instance that
+    was read before a concurrent increment does not write back its stale
+    count"""
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and not args
+            and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+        ):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and not isinstance(field, CounterField)
+            ]
+        super().save(*args, **kwargs)
@@ -0,0 +1,188 @@
+"""Resized variants of uploaded course images.
+
+Every width in IMAGE_VARIANT_WIDTHS below the width of the original is
+stored as WebP and JPEG next to it, e.g. ``images/cow.w640.webp``. Images
+are never scaled up: the larger widths are replaced by one variant at the
+width of the original. Variants are rendered in a small
+thread pool after an upload, and again lazily when a template asks for one
+that is missing. An on-disk lock file keeps two workers, in this process or
+another, from rendering the same variant.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .catalog import bump_generations
+from .models import Course
+from .rendering import forget_item
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_WIDTHS = getattr(
+    settings, "IMAGE_VARIANT_WIDTHS", (320, 640, 1280)
+)
+IMAGE_VARIANT_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+IMAGE_VARIANT_QUALITY = 80
+
+# A lock older than this belongs to a worker that died mid-render
+LOCK_TIMEOUT = 300
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "IMAGE_VARIANT_WORKERS", 2),
+    thread_name_prefix="image-variants",
+)
+_scheduled = set()
+
+
+def variant_name(name, width, ext):
+    root, _ = os.path.splitext(name)
+    return f"{root}.w{width}.{ext}"
+
+
+def _local_path(field_file, name):
+    try:
+        return field_file.storage.path(name)
+    except NotImplementedError:
+        # remote storages have no local path to lock and write to
+        return None
+
+
+def variant_widths(field_file):
+    """Widths of the variants of field_file, none above the original"""
+    try:
+        original = field_file.width
+    except (OSError, ValueError):
+        # missing or unreadable originals get no variants
+        return []
+    if not original:
+        return []
+    widths = [width for width in IMAGE_VARIANT_WIDTHS if width < original]
+    if len(widths) < len(IMAGE_VARIANT_WIDTHS):
+        widths.append(original)
+    return widths
+
+
+def existing_variants(field_file, ext, widths=None):
+    """``(width, url)`` of the variants of field_file that are on disk"""
+    found = []
+    for width in variant_widths(field_file) if widths is None else widths:
+        name = variant_name(field_file.name, width, ext)
+        path = _local_path(field_file, name)
+        if path and os.path.exists(path):
+            found.append((width, field_file.storage.url(name)))
+    return found
+
+
+def missing_variants(field_file):
+    """``(width, ext, path)`` of the variants of field_file to render"""
+    missing = []
+    for width in variant_widths(field_file):
+        for ext in IMAGE_VARIANT_FORMATS:
+            name = variant_name(field_file.name, width, ext)
+            path = _local_path(field_file, name)
+            if path and not os.path.exists(path):
+                missing.append((width, ext, path))
+    return missing
+
+
+def schedule_variants(field_file):
+    """Render the missing variants of field_file in the worker pool"""
+    if not field_file or field_file.name in _scheduled:
+        return
+    _scheduled.add(field_file.name)
+    _executor.submit(_render_scheduled, field_file)
+
+
+def _render_scheduled(field_file):
+    try:
+        if generate_variants(field_file):
+            # cached fragments and pages were rendered without the new
+            # variants
+            instance = getattr(field_file, "instance", None)
+            if hasattr(instance, "render_fragment"):
+                forget_item(instance)
+            elif isinstance(instance, Course):
+                bump_generations([instance.series_id])
+    except Exception:
+        logger.exception("Could not render variants of %s", field_file.name)
+    finally:
+        _scheduled.discard(field_file.name)
+
+
+def _take_lock(lock):
+    """Create the lock file, replacing it once if it is stale"""
+    for _ in range(2):
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) <= LOCK_TIMEOUT:
+                    return False
+                os.remove(lock)
+            except FileNotFoundError:
+                # released by its worker in the meantime
+                pass
+    return False
+
+
+@contextmanager
+def variant_lock(path):
+    """Yield True when the lock next to path was taken, False when another
+    worker is already rendering it"""
+    lock = f"{path}.lock"
+    if not _take_lock(lock):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        os.remove(lock)
+
+
+def generate_variants(field_file):
+    """Render the missing variants of field_file. Returns the number of
+    variants written."""
+    missing = missing_variants(field_file)
+    if not missing:
+        return 0
+    written = 0
+    with Image.open(_local_path(field_file, field_file.name)) as original:
+        original = ImageOps.exif_transpose(original)
+        for width, ext, path in missing:
+            with variant_lock(path) as locked:
+                if not locked or os.path.exists(path):
+                    continue
+                image = original.copy()
+                image.thumbnail((width, image.height))
+                if ext == "jpg" and image.mode != "RGB":
+                    image = image.convert("RGB")
+                elif image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA")
+                # write aside and rename, so readers never see half a file
+                tmp = f"{path}.tmp"
+                image.save(
+                    tmp,
+                    IMAGE_VARIANT_FORMATS[ext],
+                    quality=IMAGE_VARIANT_QUALITY,
+                )
+                os.replace(tmp, path)
+                written += 1
+    return written
+
+
+def srcset(field_file, ext):
+    """``srcset`` value of the variants of field_file that exist. Missing
+    variants are scheduled for rendering and left out until they exist."""
+    if not field_file:
+        return ""
+    widths = variant_widths(field_file)
+    variants = existing_variants(field_file, ext, widths)
+    if len(variants) < len(widths):
+        schedule_variants(field_file)
+    return ", ".join(f"{url} {width}w" for width, url in variants)
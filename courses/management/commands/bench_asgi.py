@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from courses.models import Course
+
+from .benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the ASGI application in process with many concurrent slow "
+        "clients, once with the sync views and once with ASYNC_VIEWS, and "
+        "report throughput, latency, threads and memory per process as "
+        "JSON. Run seed_academy first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--connections",
+            type=int,
+            nargs="+",
+            default=[10, 50, 200],
+            help="Numbers of concurrent connections to try",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=400, help="Requests per run"
+        )
+        parser.add_argument(
+            "--client-delay",
+            type=float,
+            default=50,
+            help="Milliseconds a slow client takes to accept each chunk",
+        )
+        parser.add_argument("--output", help="Write the report to a file")
+        # runs one mode in a child process
+        parser.add_argument("--child", action="store_true", help="Internal")
+
+    def handle(self, *args, **options):
+        if options["child"]:
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+            ):
+                report = self.run_child(options)
+            self.stdout.write(json.dumps(report))
+            return
+
+        report = {
+            "requests": options["requests"],
+            "client_delay_ms": options["client_delay"],
+        }
+        for mode, flag in (("sync", "0"), ("async", "1")):
+            # URLconfs pick their views on import, so every mode gets a
+            # fresh process
+            child = subprocess.run(
+                [
+                    sys.executable,
+                    sys.argv[0],
+                    "bench_asgi",
+                    "--child",
+                    "--requests",
+                    str(options["requests"]),
+                    "--client-delay",
+                    str(options["client_delay"]),
+                    "--connections",
+                    *map(str, options["connections"]),
+                ],
+                env={**os.environ, "ASYNC_VIEWS": flag},
+                capture_output=True,
+                text=True,
+            )
+            if child.returncode:
+                raise CommandError(child.stderr)
+            report[mode] = json.loads(child.stdout)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def scenarios(self):
+        """``(name, path, cookie)`` of the requests to drive"""
+        enrollment = (
+            Course.students.through.objects.select_related("user")
+            .order_by("course_id", "user_id")
+            .first()
+        )
+        if enrollment is None:
+            raise CommandError(
+                "No course with students. Run seed_academy first."
+            )
+        client = Client()
+        client.force_login(enrollment.user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}=" + (
+            client.cookies[settings.SESSION_COOKIE_NAME].value
+        )
+        course_id = enrollment.course_id
+        return [
+            ("course_list", reverse("courses:course_list"), None),
+            (
+                "student_course_detail",
+                reverse("students:student_course_detail", args=[course_id]),
+                cookie,
+            ),
+            (
+                "api_course_contents",
+                reverse("api:course-contents", args=[course_id]),
+                None,
+            ),
+        ]
+
+    def run_child(self, options):
+        application = get_asgi_application()
+        results = {}
+        for name, path, cookie in self.scenarios():
+            results[name] = {
+                str(connections): asyncio.run(
+                    self.drive(
+                        application,
+                        path,
+                        cookie,
+                        connections,
+                        options["requests"],
+                        options["client_delay"] / 1000,
+                    )
+                )
+                for connections in options["connections"]
+            }
+        return {
+            "async_views": settings.ASYNC_VIEWS,
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "results": results,
+        }
+
+    async def drive(
+        self, application, path, cookie, connections, total, delay
+    ):
+        """Send total requests over concurrent connections whose clients
+        take delay seconds to accept each chunk of the response"""
+        headers = [(b"host", b"testserver")]
+        if cookie:
+            headers.append((b"cookie", cookie.encode()))
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        timings, statuses, threads = [], set(), [threading.active_count()]
+        pending = iter(range(total))
+
+        async def connection():
+            for _ in pending:
+                start = time.perf_counter()
+                request_sent = False
+
+                async def receive():
+                    nonlocal request_sent
+                    if not request_sent:
+                        request_sent = True
+                        return {"type": "http.request", "body": b""}
+                    # the client never disconnects
+                    await asyncio.Future()
+
+                async def send(message):
+                    if message["type"] == "http.response.start":
+                        statuses.add(message["status"])
+                    else:
+                        threads.append(threading.active_count())
+                        await asyncio.sleep(delay)
+
+                await application(dict(scope), receive, send)
+                timings.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(connections)))
+        elapsed = time.perf_counter() - start
+        return {
+            "status": sorted(statuses),
+            "requests_per_s": round(total / elapsed, 1),
+            "p50_ms": round(percentile(timings, 50), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+            "peak_threads": max(threads),
+        }
@@ -0,0 +1,184 @@
+import json
+import math
+import time
+import tracemalloc
+
+from academy.middleware import QueryStats
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from courses.models import Course
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Request the catalog, course, student and API views through the "
+        "test client and report p50/p95 latency, queries and peak memory "
+        "as JSON. Run seed_academy first for representative data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=30)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument(
+            "--cold",
+            action="store_true",
+            help="Clear the cache before every request",
+        )
+        parser.add_argument(
+            "--only", nargs="+", help="Names of the scenarios to run"
+        )
+        parser.add_argument("--output", help="Write the report to a file")
+        parser.add_argument(
+            "--compare", help="Report of an earlier run to compare with"
+        )
+
+    def handle(self, *args, **options):
+        scenarios = self.scenarios()
+        if options["only"]:
+            scenarios = [s for s in scenarios if s[0] in options["only"]]
+
+        results = {}
+        with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+        ):
+            for name, url, user in scenarios:
+                client = Client()
+                if user is not None:
+                    client.force_login(user)
+                results[name] = self.run(client, url, options)
+
+        report = {
+            "database": connection.vendor,
+            "cache": settings.CACHES["default"]["BACKEND"],
+            "repeat": options["repeat"],
+            "cold": options["cold"],
+            "results": results,
+        }
+        if hasattr(cache, "stats"):
+            report["cache_stats"] = cache.stats()
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                self.compare(json.load(f)["results"], results)
+
+    def scenarios(self):
+        """``(name, url, user)`` of the requests to time"""
+        enrollment = (
+            Course.students.through.objects.select_related("course", "user")
+            .order_by("course_id", "user_id")
+            .first()
+        )
+        if enrollment is None:
+            raise CommandError(
+                "No course with students. Run seed_academy first."
+            )
+        course, student = enrollment.course, enrollment.user
+        series = course.series
+        last_module = course.modules.last()
+        return [
+            ("course_list", reverse("courses:course_list"), None),
+            (
+                "course_list_series",
+                reverse("courses:course_list_series", args=[series.slug]),
+                None,
+            ),
+            (
+                "course_detail",
+                reverse("courses:course_detail", args=[course.slug]),
+                student,
+            ),
+            (
+                "student_course_detail",
+                reverse("students:student_course_detail", args=[course.id]),
+                student,
+            ),
+            (
+                "student_course_detail_module",
+                reverse(
+                    "students:student_course_detail_module",
+                    args=[course.id, last_module.id],
+                ),
+                student,
+            ),
+            ("api_course_list", reverse("api:course-list"), None),
+            (
+                "api_course_detail",
+                reverse("api:course-detail", args=[course.id]),
+                None,
+            ),
+            (
+                "api_course_contents",
+                reverse("api:course-contents", args=[course.id]),
+                None,
+            ),
+            (
+                "api_course_sync",
+                reverse("api:course-sync", args=[course.id]),
+                student,
+            ),
+            ("api_series_list", reverse("api:series_list"), None),
+            ("api_search", reverse("api:search") + "?q=soil", None),
+        ]
+
+    def request(self, client, url, cold):
+        if cold:
+            cache.clear()
+        return client.get(url)
+
+    def run(self, client, url, options):
+        for _ in range(options["warmup"]):
+            self.request(client, url, options["cold"])
+
+        timings, queries, db_time = [], [], []
+        for _ in range(options["repeat"]):
+            stats = QueryStats()
+            with stats.record():
+                start = time.perf_counter()
+                response = self.request(client, url, options["cold"])
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(stats.count)
+            db_time.append(stats.time * 1000)
+
+        # tracing slows everything down, so memory gets its own request
+        tracemalloc.start()
+        self.request(client, url, options["cold"])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {
+            "url": url,
+            "status": response.status_code,
+            "p50_ms": round(percentile(timings, 50), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+            "mean_ms": round(sum(timings) / len(timings), 2),
+            "queries": max(queries),
+            "db_ms": round(percentile(db_time, 50), 2),
+            "peak_kib": round(peak / 1024, 1),
+        }
+
+    def compare(self, before, after):
+        for name, result in after.items():
+            if name not in before:
+                continue
+            old = before[name]
+            changes = [
+                f"{key} {old[key]} -> {result[key]}"
+                for key in ("p50_ms", "p95_ms", "queries", "peak_kib")
+            ]
+            self.stderr.write(f"{name}: {', '.join(changes)}")
@@ -0,0 +1,43 @@
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.export import Package
+from courses.models import Course
+
+
+class Command(BaseCommand):
+    help = (
+        "Export a course as an offline zip package. With --since only the "
+        "files changed since that package version are included."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_id", type=int)
+        parser.add_argument(
+            "--since",
+            help="Version of the package the delta pack is built against",
+        )
+        parser.add_argument(
+            "--output",
+            help="Where to copy the package, instead of printing its path",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            course = Course.objects.with_contents().get(
+                pk=options["course_id"]
+            )
+        except Course.DoesNotExist:
+            raise CommandError(f"Course {options['course_id']} not found")
+
+        package = Package(course, since=options["since"])
+        if options["since"] and not package.base:
+            self.stderr.write(
+                f"Unknown version {options['since']}, exporting everything"
+            )
+        path = package.build()
+        if options["output"]:
+            shutil.copyfile(path, options["output"])
+            path = options["output"]
+        self.stdout.write(f"{package.version} {path}")
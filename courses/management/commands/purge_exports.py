@@ -0,0 +1,38 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from courses import export
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the cached course packages and manifests that have not been "
+        "used for a while. Delta packs against a deleted manifest fall back "
+        "to the full package."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Age of the last use after which a package is deleted",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = time.time() - options["days"] * 24 * 60 * 60
+        count = 0
+        try:
+            entries = list(os.scandir(export.COURSE_EXPORT_ROOT))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                count += 1
+        self.stdout.write(f"Purged {count} export files")
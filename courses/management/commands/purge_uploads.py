@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from courses import uploads
+from courses.models import Upload
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete chunked uploads that have not received a chunk for a while, "
+        "together with their partial files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="Age of the last chunk after which an upload is abandoned",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        stale = Upload.objects.filter(updated__lt=cutoff)
+        count = 0
+        for upload in stale.iterator():
+            uploads.discard(upload)
+            upload.delete()
+            count += 1
+        self.stdout.write(f"Purged {count} uploads")
@@ -0,0 +1,52 @@
+from itertools import groupby
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from courses import sync
+from courses.fields import OrderField
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact the keys of sparse order fields whose neighbouring keys "
+        "are running out of room. Safe to run periodically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rebalance every group, not only the crowded ones",
+        )
+
+    def handle(self, *args, **options):
+        for model in apps.get_app_config("courses").get_models():
+            for field in model._meta.fields:
+                if isinstance(field, OrderField) and field.sparse:
+                    self.rebalance_field(model, field, options["all"])
+
+    def rebalance_field(self, model, field, everything):
+        parents = [
+            model._meta.get_field(name).attname
+            for name in field.for_fields or []
+        ]
+        rows = (
+            model._default_manager.order_by(*parents, field.attname)
+            .values_list(*parents, field.attname)
+            .iterator()
+        )
+        groups = rebalanced = 0
+        for parent, keys in groupby(rows, key=lambda row: row[:-1]):
+            groups += 1
+            keys = [row[-1] for row in keys]
+            if everything or field.needs_rebalance(keys):
+                instance = model(**dict(zip(parents, parent)))
+                field.rebalance(instance)
+                # the keys were rewritten with bulk_update, without signals
+                sync.record(list(field.group(instance).only("pk", *parents)))
+                rebalanced += 1
+        self.stdout.write(
+            f"{model._meta.label}.{field.name}: "
+            f"rebalanced {rebalanced} of {groups} groups"
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from courses.models import Course, Module, SearchDocument, Text
+from courses.search import update_document
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search documents of all courses, modules and texts"
+
+    def handle(self, *args, **options):
+        SearchDocument.objects.all().delete()
+        for model in (Course, Module, Text):
+            total = 0
+            for obj in model.objects.order_by("pk").iterator():
+                update_document(obj)
+                total += 1
+            self.stdout.write(f"Indexed {total} {model._meta.verbose_name_plural}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from courses import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the dashboard totals of every course from the raw tables "
+        "into today's rollups. Run nightly, and after bulk imports."
+    )
+
+    def handle(self, *args, **options):
+        created, drifted = rollups.reconcile()
+        self.stdout.write(
+            f"Created {created} rollups, corrected {drifted} that had drifted"
+        )
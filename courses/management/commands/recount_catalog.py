@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from courses import catalog, counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the stored course, module, student and content counters "
+        "of the catalog and correct the ones that have drifted."
+    )
+
+    def handle(self, *args, **options):
+        corrected = counters.recount()
+        if any(corrected.values()):
+            catalog.bump_generations()
+        for name, n in corrected.items():
+            self.stdout.write(f"{name}: corrected {n}")
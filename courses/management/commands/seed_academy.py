@@ -0,0 +1,223 @@
+import io
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.text import slugify
+from PIL import Image as PILImage
+
+from courses import catalog, sync
+from courses.fields import SPARSE_GAP
+from courses.models import (
+    Content,
+    Course,
+    File,
+    Image,
+    Module,
+    Series,
+    Text,
+    Video,
+)
+
+User = get_user_model()
+
+PREFIX = "seed"
+BATCH_SIZE = 1000
+
+WORDS = (
+    "soil crop maize cassava irrigation compost harvest seed market goat "
+    "poultry yield pest rotation water storage credit cooperative weather "
+    "fertilizer drought orchard dairy feed vaccine tractor"
+).split()
+VIDEO_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible synthetic catalog with bulk inserts: series "
+        "x courses x modules x items, and enrolled students. Seeded rows "
+        f"are prefixed with '{PREFIX}-' and replaced on every run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--series", type=int, default=5)
+        parser.add_argument(
+            "--courses", type=int, default=10, help="Courses per series"
+        )
+        parser.add_argument(
+            "--modules", type=int, default=8, help="Modules per course"
+        )
+        parser.add_argument(
+            "--items",
+            type=int,
+            default=12,
+            help="Items per module, a mix of texts, videos, images and files",
+        )
+        parser.add_argument("--students", type=int, default=200)
+        parser.add_argument(
+            "--enrollments",
+            type=int,
+            default=5,
+            help="Courses each student is enrolled in",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.clear()
+        with transaction.atomic():
+            instructor = User.objects.create_user(
+                f"{PREFIX}-instructor",
+                f"{PREFIX}-instructor@example.com",
+                "seed",
+                type=User.Types.INSTRUCTOR,
+            )
+            series = self.create_series(options["series"])
+            courses = self.create_courses(
+                series, instructor, options["courses"]
+            )
+            modules = self.create_modules(courses, options["modules"])
+            contents = self.create_items(
+                modules, instructor, options["items"]
+            )
+            students = self.create_students(
+                courses, options["students"], options["enrollments"]
+            )
+
+        # bulk inserts send no signals, so refresh what they would have
+        sync.journal_courses(course.id for course in courses)
+        call_command("recount_catalog", stdout=io.StringIO())
+        catalog.bump_generations(s.id for s in series)
+        call_command("rebuild_search_index", stdout=io.StringIO())
+        call_command("reconcile_rollups", stdout=io.StringIO())
+        self.stdout.write(
+            f"Seeded {len(series)} series, {len(courses)} courses, "
+            f"{len(modules)} modules, {contents} items and "
+            f"{students} students"
+        )
+
+    def clear(self):
+        Series.objects.filter(slug__startswith=f"{PREFIX}-").delete()
+        # deletes the items of the seeded instructor as well
+        User.objects.filter(username__startswith=f"{PREFIX}-").delete()
+
+    def words(self, count):
+        return " ".join(self.random.choice(WORDS) for _ in range(count))
+
+    def create_series(self, count):
+        return Series.objects.bulk_create(
+            Series(title=f"Series {i} {self.words(2)}", slug=f"{PREFIX}-{i}")
+            for i in range(count)
+        )
+
+    def create_courses(self, series, owner, count):
+        courses = []
+        for s in series:
+            for i in range(count):
+                title = f"{s.title} course {i} {self.words(2)}"
+                courses.append(
+                    Course(
+                        owner=owner,
+                        series=s,
+                        title=title,
+                        slug=slugify(title),
+                        overview=self.words(60),
+                    )
+                )
+        return Course.objects.bulk_create(courses, batch_size=BATCH_SIZE)
+
+    def create_modules(self, courses, count):
+        return Module.objects.bulk_create(
+            (
+                Module(
+                    course=course,
+                    title=f"Module {i + 1}: {self.words(3)}",
+                    description=self.words(25),
+                    order=(i + 1) * SPARSE_GAP,
+                )
+                for course in courses
+                for i in range(count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+    def create_items(self, modules, creator, count):
+        """Create ``count`` items per module, mostly texts, and their
+        contents. Image and file items share one stored file each."""
+        image_name, file_name = self.store_media()
+        kinds = [Text] * 5 + [Video] * 3 + [Image, File]
+        placements = {Text: [], Video: [], Image: [], File: []}
+        for module in modules:
+            for i in range(count):
+                model = self.random.choice(kinds)
+                fields = {"creator": creator, "title": self.words(4)}
+                if model is Text:
+                    fields["content"] = self.words(120)
+                elif model is Video:
+                    fields["video_url"] = VIDEO_URL
+                elif model is Image:
+                    fields["module_image"] = image_name
+                else:
+                    fields["file"] = file_name
+                placements[model].append((module, i, model(**fields)))
+
+        contents = []
+        for model, rows in placements.items():
+            items = model.objects.bulk_create(
+                [item for _, _, item in rows], batch_size=BATCH_SIZE
+            )
+            content_type = ContentType.objects.get_for_model(model)
+            for (module, position, _), item in zip(rows, items):
+                contents.append(
+                    Content(
+                        module=module,
+                        content_type=content_type,
+                        object_id=item.id,
+                        order=(position + 1) * SPARSE_GAP,
+                    )
+                )
+        Content.objects.bulk_create(contents, batch_size=BATCH_SIZE)
+        return len(contents)
+
+    def store_media(self):
+        image_name = f"images/{PREFIX}.jpg"
+        if not default_storage.exists(image_name):
+            image = io.BytesIO()
+            PILImage.new("RGB", (640, 360), (86, 130, 3)).save(image, "JPEG")
+            default_storage.save(image_name, ContentFile(image.getvalue()))
+        file_name = f"files/{PREFIX}.txt"
+        if not default_storage.exists(file_name):
+            text = " ".join(WORDS * 100)
+            default_storage.save(file_name, ContentFile(text.encode()))
+        return image_name, file_name
+
+    def create_students(self, courses, count, enrollments):
+        password = make_password("seed")
+        students = User.objects.bulk_create(
+            (
+                User(
+                    username=f"{PREFIX}-student-{i}",
+                    email=f"{PREFIX}-student-{i}@example.com",
+                    password=password,
+                    type=User.Types.STUDENT,
+                )
+                for i in range(count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        Enrollment = Course.students.through
+        rows = [
+            Enrollment(course_id=course.id, user_id=student.id)
+            for student in students
+            for course in self.random.sample(
+                courses, min(enrollments, len(courses))
+            )
+        ]
+        Enrollment.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        return len(students)
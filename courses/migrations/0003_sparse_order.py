@@ -0,0 +1,24 @@
+# Generated by Django 4.0.6 on 2026-10-18 07:51
+
+import courses.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='content',
+            name='order',
+            field=courses.fields.OrderField(blank=True, sparse=True),
+        ),
+        migrations.AlterField(
+            model_name='module',
+            name='order',
+            field=courses.fields.OrderField(blank=True, sparse=True),
+        ),
+    ]
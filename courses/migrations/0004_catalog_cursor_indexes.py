@@ -0,0 +1,21 @@
+# Generated by Django 4.0.6 on 2026-10-18 07:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0003_sparse_order'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-released_date', '-id'], name='course_released_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='series',
+            index=models.Index(fields=['title', 'id'], name='series_title_id_idx'),
+        ),
+    ]
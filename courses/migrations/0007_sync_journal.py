@@ -0,0 +1,100 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_journal(apps, schema_editor):
+    """Journal every existing object, so that syncing from cursor 0 returns
+    the current state of a course"""
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    Content = apps.get_model("courses", "Content")
+    SyncEntry = apps.get_model("courses", "SyncEntry")
+    SyncSequence = apps.get_model("courses", "SyncSequence")
+    alias = schema_editor.connection.alias
+
+    def content_type(model):
+        return ContentType.objects.db_manager(alias).get_or_create(
+            app_label="courses", model=model
+        )[0]
+
+    entries = []
+    for model, course_field in (("course", "id"), ("module", "course_id")):
+        rows = apps.get_model("courses", model).objects.using(alias)
+        entries += [
+            SyncEntry(
+                course_id=course_id,
+                content_type=content_type(model),
+                object_id=object_id,
+            )
+            for object_id, course_id in rows.values_list("id", course_field)
+        ]
+    contents = Content.objects.using(alias).values_list(
+        "id", "module__course_id", "content_type_id", "object_id"
+    )
+    for content_id, course_id, item_type_id, item_id in contents:
+        entries.append(
+            SyncEntry(
+                course_id=course_id,
+                content_type=content_type("content"),
+                object_id=content_id,
+            )
+        )
+        entries.append(
+            SyncEntry(
+                course_id=course_id,
+                content_type_id=item_type_id,
+                object_id=item_id,
+            )
+        )
+    # number the entries of every course and continue after the last one
+    last = {}
+    for entry in entries:
+        last[entry.course_id] = entry.seq = last.get(entry.course_id, 0) + 1
+    SyncEntry.objects.using(alias).bulk_create(entries, batch_size=1000)
+    SyncSequence.objects.using(alias).bulk_create(
+        SyncSequence(course_id=course_id, last=seq)
+        for course_id, seq in last.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('courses', '0006_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_id', models.PositiveIntegerField()),
+                ('seq', models.PositiveBigIntegerField(default=0)),
+                ('object_id', models.PositiveIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'verbose_name_plural': 'sync entries',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncSequence',
+            fields=[
+                ('course_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('last', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='syncentry',
+            index=models.Index(fields=['course_id', 'seq'], name='syncentry_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='syncentry',
+            index=models.Index(fields=['content_type', 'object_id'], name='syncentry_object_idx'),
+        ),
+        migrations.RunPython(fill_journal, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_sync_journal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_id', models.PositiveIntegerField()),
+                ('date', models.DateField()),
+                ('new_students', models.IntegerField(default=0)),
+                ('left_students', models.IntegerField(default=0)),
+                ('students', models.IntegerField(default=0)),
+                ('modules', models.IntegerField(default=0)),
+                ('texts', models.IntegerField(default=0)),
+                ('videos', models.IntegerField(default=0)),
+                ('images', models.IntegerField(default=0)),
+                ('files', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'course daily stats',
+                'unique_together': {('course_id', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:15
+
+import courses.fields
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    Series = apps.get_model("courses", "Series")
+    Course = apps.get_model("courses", "Course")
+    Module = apps.get_model("courses", "Module")
+    Content = apps.get_model("courses", "Content")
+    counters = [
+        (Series, "course_count", Course, "series_id"),
+        (Course, "module_count", Module, "course_id"),
+        (Course, "student_count", Course.students.through, "course_id"),
+        (Module, "content_count", Content, "module_id"),
+    ]
+    for model, field, related, foreign_key in counters:
+        count = (
+            related.objects.filter(**{foreign_key: OuterRef("pk")})
+            .order_by()
+            .values(foreign_key)
+            .annotate(n=Count("pk"))
+            .values("n")
+        )
+        model.objects.using(alias).update(
+            **{field: Coalesce(Subquery(count), 0)}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_course_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='module_count',
+            field=courses.fields.CounterField(),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='student_count',
+            field=courses.fields.CounterField(),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='content_count',
+            field=courses.fields.CounterField(),
+        ),
+        migrations.AddField(
+            model_name='series',
+            name='course_count',
+            field=courses.fields.CounterField(),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,29 +1,53 @@
+import uuid
+
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.template.loader import render_to_string
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
-from .fields import OrderField
+from .fields import (
+    CounterField,
+    CountersMixin,
+    OrderField,
+    SparseOrderMixin,
+)
+from .rendering import render_items
 
 User = settings.AUTH_USER_MODEL
 
 
-class Series(models.Model):
+class Series(CountersMixin, models.Model):
     title = models.CharField(max_length=200, verbose_name=_("Series title"))
     slug = models.SlugField(max_length=200, unique=True)
+    course_count = CounterField()
 
     class Meta:
         ordering = ["title"]
         verbose_name_plural = "series"
+        indexes = [
+            models.Index(fields=["title", "id"], name="series_title_id_idx")
+        ]
 
     def __str__(self) -> str:
         return self.title
 
 
-class Course(models.Model):
+class CourseQuerySet(models.QuerySet):
+    def with_contents(self):
+        """Prefetch modules, their contents and the content items, so a
+        whole course costs a fixed number of queries."""
+        return self.prefetch_related(
+            models.Prefetch(
+                "modules__contents", queryset=Content.objects.with_items()
+            )
+        )
+
+
+class Course(CountersMixin, models.Model):
     owner = models.ForeignKey(
         User,
         on_delete=models.SET_NULL,
@@ -51,19 +75,28 @@ class Course(models.Model):
     )
     released_date = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    module_count = CounterField()
+    student_count = CounterField()
+
+    objects = CourseQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title
 
     class Meta:
         ordering = ["-released_date"]
+        indexes = [
+            models.Index(
+                fields=["-released_date", "-id"], name="course_released_id_idx"
+            )
+        ]
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.title)
         super(Course, self).save(*args, **kwargs)
 
 
-class Module(models.Model):
+class Module(SparseOrderMixin, CountersMixin, models.Model):
     course = models.ForeignKey(
         Course,
         related_name="modules",
@@ -71,15 +104,24 @@ class Module(models.Model):
         on_delete=models.CASCADE,
     )
     title = models.CharField(max_length=200, verbose_name=_("Module title"))
-    order = OrderField(blank=True, for_fields=["course"])
+    order = OrderField(blank=True, for_fields=["course"], sparse=True)
     description = models.TextField(verbose_name=_("Description"), blank=True)
+    content_count = CounterField()
 
     class Meta:
         unique_together = ("course", "order")
         ordering = ["order"]
 
     def __str__(self) -> str:
-        return f"{self.order}. {self.title}"
+        return self.title
+
+
+class ContentQuerySet(models.QuerySet):
+    def with_items(self):
+        """Resolve the generic ``item`` of every row in one query per
+        content type instead of one query per row."""
+        cache_content_types()
+        return self.prefetch_related("item")
 
 
 class Content(models.Model):
@@ -94,7 +136,9 @@ class Content(models.Model):
     )
     object_id = models.PositiveIntegerField()
     item = GenericForeignKey("content_type", "object_id")
-    order = OrderField(blank=True, for_fields=["module"])
+    order = OrderField(blank=True, for_fields=["module"], sparse=True)
+
+    objects = ContentQuerySet.as_manager()
 
     class Meta:
         ordering = ["order"]
@@ -115,6 +159,12 @@ class ItemBase(models.Model):
         return self.title
 
     def render(self):
+        """Return the rendered item, served from the fragment cache"""
+        if getattr(self, "_rendered", None) is None:
+            render_items([self])
+        return self._rendered
+
+    def render_fragment(self):
         return render_to_string(
             f"courses/content/{self._meta.model_name}.html", {"item": self}
         )
@@ -136,6 +186,149 @@ class Video(ItemBase):
     video_url = models.URLField()
 
 
+def cache_content_types():
+    """Load the content types of the course models into the ContentType
+    cache, with one query in a new process and none afterwards, instead of
+    one lookup per type the first time each is resolved"""
+    ContentType.objects.get_for_models(
+        Course, Module, Content, Text, File, Image, Video
+    )
+
+
+class Upload(models.Model):
+    """Chunked, resumable upload of the file of a new File or Image item"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        User, related_name="uploads", on_delete=models.CASCADE
+    )
+    module = models.ForeignKey(
+        Module, related_name="uploads", on_delete=models.CASCADE
+    )
+    model_name = models.CharField(
+        max_length=10, choices=[("file", "File"), ("image", "Image")]
+    )
+    title = models.CharField(max_length=250)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return self.filename
+
+
+class SearchDocument(models.Model):
+    """Searchable text of a course, a module or a text item"""
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    item = GenericForeignKey("content_type", "object_id")
+    course = models.ForeignKey(
+        Course, related_name="search_documents", on_delete=models.CASCADE
+    )
+    module = models.ForeignKey(
+        Module,
+        related_name="search_documents",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    title = models.CharField(max_length=250)
+    body = models.TextField(blank=True)
+    # Only filled on PostgreSQL, where it carries a GIN index
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        unique_together = ("content_type", "object_id")
+
+    def __str__(self) -> str:
+        return self.title
+
+
+class SearchTerm(models.Model):
+    """Inverted index of search documents, used on databases without
+    built-in full-text search"""
+
+    term = models.CharField(max_length=64)
+    document = models.ForeignKey(
+        SearchDocument, related_name="terms", on_delete=models.CASCADE
+    )
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ("term", "document")
+
+
+class SyncEntry(models.Model):
+    """Change journal behind the sync API.
+
+    An object has one entry per course it belongs to, the one of its latest
+    change, so the entries of a course after a cursor are exactly the
+    objects that changed since. Entries of deleted objects are tombstones.
+    ``seq`` numbers the entries of a course in commit order, see
+    SyncSequence.
+    """
+
+    # not a foreign key, tombstones outlive the course
+    course_id = models.PositiveIntegerField()
+    seq = models.PositiveBigIntegerField(default=0)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["course_id", "seq"], name="syncentry_cursor_idx"
+            ),
+            models.Index(
+                fields=["content_type", "object_id"],
+                name="syncentry_object_idx",
+            ),
+        ]
+        verbose_name_plural = "sync entries"
+
+
+class SyncSequence(models.Model):
+    """Last ``SyncEntry.seq`` handed out in the journal of a course.
+
+    The row stays locked from the moment a transaction takes numbers until
+    it commits, so the entries of a course become visible in the order of
+    their numbers and a cursor never passes an entry committed later.
+    """
+
+    course_id = models.PositiveIntegerField(primary_key=True)
+    last = models.PositiveBigIntegerField(default=0)
+
+
+class CourseDailyStats(models.Model):
+    """Activity and size of a course on one day, for the instructor
+    dashboard. Kept up to date from signals, see ``courses.rollups``.
+
+    ``new_students`` and ``left_students`` count the enrollment changes of
+    the day, the other columns are totals at the end of the day.
+    """
+
+    # not a foreign key, rows are written while a course is being deleted
+    course_id = models.PositiveIntegerField()
+    date = models.DateField()
+    new_students = models.IntegerField(default=0)
+    left_students = models.IntegerField(default=0)
+    students = models.IntegerField(default=0)
+    modules = models.IntegerField(default=0)
+    texts = models.IntegerField(default=0)
+    videos = models.IntegerField(default=0)
+    images = models.IntegerField(default=0)
+    files = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("course_id", "date")
+        verbose_name_plural = "course daily stats"
+
+
 # class Question(models.Model):
 #     course = models.ForeignKey(
 #         Course,
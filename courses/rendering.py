@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.cache import cache
+
+# Fragments are keyed by their ``updated`` stamp, so an entry can never be
+# served for a newer version of the item; the timeout only bounds memory.
+RENDER_CACHE_TIMEOUT = getattr(
+    settings, "ITEM_RENDER_CACHE_TIMEOUT", 60 * 60 * 24 * 7
+)
+
+
+def render_cache_key(item):
+    """Cache key of the rendered fragment for the current version of item"""
+    return "item_render:{}:{}:{}".format(
+        item._meta.label_lower,
+        item.pk,
+        int(item.updated.timestamp() * 1_000_000),
+    )
+
+
+def render_items(items):
+    """Render content items with a single multi-get against the cache.
+
+    Fragments that are not cached yet are rendered and stored with a single
+    set_many. The html is also kept on each instance so later calls to
+    ``item.render()`` don't touch the cache again.
+    """
+    items = [item for item in items if item is not None]
+    keys = {render_cache_key(item): item for item in items}
+    cached = cache.get_many(list(keys))
+    missing = {}
+    for key, item in keys.items():
+        if key not in cached:
+            cached[key] = missing[key] = item.render_fragment()
+    if missing:
+        cache.set_many(missing, RENDER_CACHE_TIMEOUT)
+
+    for item in items:
+        item._rendered = cached[render_cache_key(item)]
+    return [item._rendered for item in items]
+
+
+def forget_item(item):
+    """Drop the cached fragment of the stored version of item"""
+    if item.pk and item.updated:
+        cache.delete(render_cache_key(item))
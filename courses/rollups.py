@@ -0,0 +1,185 @@
+"""Daily per-course rollups behind the instructor dashboard.
+
+Signals call ``bump()`` with the change of a count, which adds it to the
+row of the course for today with an F() expression. The first change of a
+day copies the totals of the latest earlier row, so a course only has a
+row for the days it changed until ``reconcile()`` runs. The nightly
+``manage.py reconcile_rollups`` recounts the totals from the raw tables,
+repairing drift from writes that bypass signals, and writes a row for
+every course.
+
+Enrollments have no timestamp, so new and left students of a day are only
+known from the signals and are never recounted.
+"""
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Content, Course, CourseDailyStats, Module
+
+TOTALS = ("students", "modules", "texts", "videos", "images", "files")
+# content counts by item model
+ITEM_FIELDS = {
+    "text": "texts",
+    "video": "videos",
+    "image": "images",
+    "file": "files",
+}
+
+
+def item_field(content):
+    """The rollup column counting the item type of content"""
+    model = ContentType.objects.get_for_id(content.content_type_id).model
+    return ITEM_FIELDS.get(model)
+
+
+def count_totals(course_ids):
+    """Totals of the courses counted from the raw tables, by course id"""
+    totals = {course_id: dict.fromkeys(TOTALS, 0) for course_id in course_ids}
+    enrollments = (
+        Course.students.through.objects.filter(course_id__in=course_ids)
+        .values_list("course_id")
+        .annotate(n=Count("id"))
+    )
+    for course_id, n in enrollments:
+        totals[course_id]["students"] = n
+    modules = (
+        Module.objects.filter(course_id__in=course_ids)
+        .values_list("course_id")
+        .annotate(n=Count("id"))
+    )
+    for course_id, n in modules:
+        totals[course_id]["modules"] = n
+    contents = (
+        Content.objects.filter(module__course_id__in=course_ids)
+        .values_list("module__course_id", "content_type_id")
+        .annotate(n=Count("id"))
+    )
+    for course_id, content_type_id, n in contents:
+        model = ContentType.objects.get_for_id(content_type_id).model
+        if model in ITEM_FIELDS:
+            totals[course_id][ITEM_FIELDS[model]] = n
+    return totals
+
+
+def today_row(course_id, today):
+    """Make sure course_id has a row for today. Returns True when its
+    totals were counted, so they already include the change being made."""
+    if CourseDailyStats.objects.filter(
+        course_id=course_id, date=today
+    ).exists():
+        return False
+    totals = (
+        CourseDailyStats.objects.filter(course_id=course_id, date__lt=today)
+        .order_by("-date")
+        .values(*TOTALS)
+        .first()
+    )
+    counted = totals is None
+    if counted:
+        totals = count_totals([course_id])[course_id]
+    try:
+        # a savepoint, a concurrent request may have created the row
+        with transaction.atomic():
+            CourseDailyStats.objects.create(
+                course_id=course_id, date=today, **totals
+            )
+    except IntegrityError:
+        return False
+    return counted
+
+
+def bump(course_ids, **changes):
+    """Add changes, like ``modules=1``, to today's rows of the courses.
+    Called after the change was written."""
+    changes = {field: n for field, n in changes.items() if n}
+    if not changes:
+        return
+    today = timezone.localdate()
+    for course_id in set(course_ids):
+        updates = changes
+        if today_row(course_id, today):
+            updates = {
+                field: n for field, n in changes.items() if field not in TOTALS
+            }
+        if updates:
+            CourseDailyStats.objects.filter(
+                course_id=course_id, date=today
+            ).update(**{field: F(field) + n for field, n in updates.items()})
+
+
+def forget_course(course_id):
+    CourseDailyStats.objects.filter(course_id=course_id).delete()
+
+
+@transaction.atomic
+def reconcile(batch_size=500):
+    """Recount the totals of every course into today's rows. Returns the
+    number of rows created and of rows that had drifted."""
+    today = timezone.localdate()
+    course_ids = list(Course.objects.values_list("id", flat=True))
+    created = drifted = 0
+    for start in range(0, len(course_ids), batch_size):
+        batch = course_ids[start : start + batch_size]
+        rows = {
+            row.course_id: row
+            for row in CourseDailyStats.objects.filter(
+                course_id__in=batch, date=today
+            )
+        }
+        new, changed = [], []
+        for course_id, counts in count_totals(batch).items():
+            row = rows.get(course_id)
+            if row is None:
+                new.append(
+                    CourseDailyStats(course_id=course_id, date=today, **counts)
+                )
+            elif any(getattr(row, f) != n for f, n in counts.items()):
+                for field, n in counts.items():
+                    setattr(row, field, n)
+                changed.append(row)
+        CourseDailyStats.objects.bulk_create(new)
+        CourseDailyStats.objects.bulk_update(changed, TOTALS)
+        created += len(new)
+        drifted += len(changed)
+    # rollups of courses deleted without signals
+    CourseDailyStats.objects.exclude(
+        course_id__in=Course.objects.values("id")
+    ).delete()
+    return created, drifted
+
+
+def dashboard(course_ids, days=28):
+    """``(latest, daily)`` rollups of the courses. ``latest`` maps course
+    ids to their latest row, ``daily`` lists the enrollment changes of all
+    the courses on each of the last days, oldest first. Two queries on the
+    (course_id, date) index."""
+    latest_date = (
+        CourseDailyStats.objects.filter(course_id=OuterRef("course_id"))
+        .order_by("-date")
+        .values("date")[:1]
+    )
+    latest = {
+        row.course_id: row
+        for row in CourseDailyStats.objects.filter(
+            course_id__in=course_ids, date=Subquery(latest_date)
+        )
+    }
+
+    today = timezone.localdate()
+    daily = {
+        today - timedelta(days=n): {"new_students": 0, "left_students": 0}
+        for n in reversed(range(days))
+    }
+    rows = CourseDailyStats.objects.filter(
+        course_id__in=course_ids,
+        date__gt=today - timedelta(days=days),
+        date__lte=today,
+    ).values_list("date", "new_students", "left_students")
+    for date, new_students, left_students in rows:
+        daily[date]["new_students"] += new_students
+        daily[date]["left_students"] += left_students
+    return latest, [{"date": date, **day} for date, day in daily.items()]
@@ -0,0 +1,145 @@
+"""Full-text search over courses, modules and text items.
+
+Every searchable object has a SearchDocument. On PostgreSQL documents are
+matched through their GIN-indexed ``search_vector``; on other databases
+through the SearchTerm inverted index. Documents are kept up to date from
+``courses.signals``; ``manage.py rebuild_search_index`` refills them.
+"""
+import re
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Sum
+
+from .models import Content, Course, Module, SearchDocument, SearchTerm, Text
+
+SEARCH_CONFIG = "english"
+
+TITLE_WEIGHT = 4
+BODY_WEIGHT = 1
+
+WORD_RE = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has in is it of on or that the to "
+    "was were will with".split()
+)
+
+
+def use_full_text():
+    """Whether the search index lives in a PostgreSQL database"""
+    alias = router.db_for_write(SearchDocument)
+    return connections[alias].vendor == "postgresql"
+
+
+def tokenize(text):
+    return [
+        word[:64]
+        for word in WORD_RE.findall(text.lower())
+        if len(word) > 1 and word not in STOP_WORDS
+    ]
+
+
+def document_source(obj):
+    """Return ``(course_id, module_id, title, body)`` for obj, or None when
+    obj is not searchable (yet)"""
+    if isinstance(obj, Course):
+        return obj.id, None, obj.title, obj.overview
+    if isinstance(obj, Module):
+        return obj.course_id, obj.id, obj.title, obj.description
+    if isinstance(obj, Text):
+        # a text becomes searchable once it is attached to a module
+        placement = (
+            Content.objects.filter(
+                content_type=ContentType.objects.get_for_model(Text),
+                object_id=obj.pk,
+            )
+            .values_list("module__course_id", "module_id")
+            .first()
+        )
+        if placement:
+            return (*placement, obj.title, obj.content)
+    return None
+
+
+@transaction.atomic
+def update_document(obj):
+    """Index obj, unless the document already holds its searchable text"""
+    source = document_source(obj)
+    if source is None:
+        remove_document(obj)
+        return
+    course_id, module_id, title, body = source
+    fields = {
+        "course_id": course_id,
+        "module_id": module_id,
+        "title": title,
+        "body": body,
+    }
+    content_type = ContentType.objects.get_for_model(obj)
+    document = SearchDocument.objects.filter(
+        content_type=content_type, object_id=obj.pk
+    ).first()
+    if document is None:
+        document = SearchDocument.objects.create(
+            content_type=content_type, object_id=obj.pk, **fields
+        )
+    elif all(getattr(document, name) == fields[name] for name in fields):
+        # saved without a change to its searchable text
+        return
+    else:
+        SearchDocument.objects.filter(pk=document.pk).update(**fields)
+
+    if use_full_text():
+        SearchDocument.objects.filter(pk=document.pk).update(
+            search_vector=SearchVector(
+                "title", weight="A", config=SEARCH_CONFIG
+            )
+            + SearchVector("body", weight="B", config=SEARCH_CONFIG)
+        )
+        return
+
+    weights = Counter()
+    for term in tokenize(title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(body):
+        weights[term] += BODY_WEIGHT
+    document.terms.all().delete()
+    SearchTerm.objects.bulk_create(
+        SearchTerm(term=term, document=document, weight=weight)
+        for term, weight in weights.items()
+    )
+
+
+def remove_document(obj):
+    SearchDocument.objects.filter(
+        content_type=ContentType.objects.get_for_model(obj),
+        object_id=obj.pk,
+    ).delete()
+
+
+def search(query):
+    """Documents matching every word of query, best matches first"""
+    documents = SearchDocument.objects.select_related(
+        "content_type", "course", "module"
+    )
+    if use_full_text():
+        query = SearchQuery(
+            query, search_type="websearch", config=SEARCH_CONFIG
+        )
+        return (
+            documents.filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "id")
+        )
+
+    terms = set(tokenize(query))
+    if not terms:
+        return documents.none()
+    return (
+        documents.filter(terms__term__in=terms)
+        .annotate(rank=Sum("terms__weight"), matched=Count("terms"))
+        .filter(matched=len(terms))
+        .order_by("-rank", "id")
+    )
@@ -0,0 +1,282 @@
+from django.conf import settings
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_save,
+)
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import catalog, counters, rollups, search, sync
+from .images import schedule_variants
+from .models import (
+    Content,
+    Course,
+    File,
+    Image,
+    Module,
+    Series,
+    Text,
+    Video,
+)
+from .rendering import forget_item
+
+ITEM_MODELS = (Text, File, Image, Video)
+
+
+def drop_rendered_item(sender, instance, **kwargs):
+    """Evict the fragment of the version being replaced or deleted.
+    On pre_save ``updated`` still holds the stored timestamp."""
+    forget_item(instance)
+
+
+for model in ITEM_MODELS:
+    pre_save.connect(drop_rendered_item, sender=model)
+    post_delete.connect(drop_rendered_item, sender=model)
+
+
+# Catalog cache invalidation
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_series(sender, instance, **kwargs):
+    """Keep the stored series so moving a course refreshes both lists"""
+    instance._stored_series_id = (
+        Course.objects.filter(pk=instance.pk)
+        .values_list("series_id", flat=True)
+        .first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, **kwargs):
+    catalog.bump_generations(
+        [instance.series_id, getattr(instance, "_stored_series_id", None)]
+    )
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def module_changed(sender, instance, **kwargs):
+    catalog.bump_generations(
+        Course.objects.filter(pk=instance.course_id).values_list(
+            "series_id", flat=True
+        )
+    )
+
+
+@receiver(post_save, sender=Series)
+@receiver(post_delete, sender=Series)
+def series_changed(sender, instance, **kwargs):
+    catalog.bump_generations([instance.id])
+
+
+# the names of the owner are shown with the course
+OWNER_FIELDS = {"username", "first_name", "last_name", "name"}
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def owner_changed(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and not OWNER_FIELDS & set(update_fields)):
+        # e.g. last_login on every login
+        return
+    series_ids = set(
+        Course.objects.filter(owner=instance).values_list(
+            "series_id", flat=True
+        )
+    )
+    if series_ids:
+        catalog.bump_generations(series_ids)
+
+
+# Search index
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Module)
+@receiver(post_save, sender=Text)
+def index_document(sender, instance, **kwargs):
+    search.update_document(instance)
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Module)
+@receiver(post_delete, sender=Text)
+def unindex_document(sender, instance, **kwargs):
+    search.remove_document(instance)
+
+
+@receiver(post_save, sender=Content)
+def index_content_item(sender, instance, created, **kwargs):
+    # texts are only searchable once they are placed in a module
+    if created and instance.content_type.model == "text":
+        search.update_document(instance.item)
+
+
+# Image variants
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Image)
+def render_image_variants(sender, instance, **kwargs):
+    image = (
+        instance.hero_image if sender is Course else instance.module_image
+    )
+    if image:
+        transaction.on_commit(lambda: schedule_variants(image))
+
+
+# Sync journal
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Module)
+def journal_change(sender, instance, **kwargs):
+    sync.record([instance])
+
+
+@receiver(post_delete, sender=Module)
+@receiver(post_delete, sender=Content)
+def journal_delete(sender, instance, **kwargs):
+    sync.record([instance], deleted=True)
+
+
+@receiver(post_delete, sender=Course)
+def journal_course_delete(sender, instance, **kwargs):
+    sync.forget_course(instance.pk)
+
+
+@receiver(post_save, sender=Content)
+def journal_content(sender, instance, created, **kwargs):
+    course_ids = sync.course_ids_of(instance)
+    sync.record([instance], course_ids)
+    if created and instance.item is not None:
+        # the item becomes part of the course together with its content
+        sync.record([instance.item], course_ids)
+
+
+def journal_item(sender, instance, **kwargs):
+    sync.record([instance], deleted=kwargs["signal"] is post_delete)
+
+
+for model in ITEM_MODELS:
+    post_save.connect(journal_item, sender=model)
+    post_delete.connect(journal_item, sender=model)
+
+
+# Dashboard rollups
+
+
+@receiver(post_save, sender=Course)
+def start_rollup(sender, instance, created, **kwargs):
+    if created:
+        rollups.today_row(instance.pk, timezone.localdate())
+
+
+@receiver(post_delete, sender=Course)
+def forget_rollups(sender, instance, **kwargs):
+    rollups.forget_course(instance.pk)
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def count_module(sender, instance, **kwargs):
+    if kwargs.get("created", True):
+        # a deleted module has no created argument
+        change = 1 if kwargs["signal"] is post_save else -1
+        rollups.bump([instance.course_id], modules=change)
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+def count_content(sender, instance, **kwargs):
+    field = rollups.item_field(instance)
+    if field and kwargs.get("created", True):
+        change = 1 if kwargs["signal"] is post_save else -1
+        rollups.bump(sync.course_ids_of(instance), **{field: change})
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def count_students(sender, instance, action, reverse, pk_set, **kwargs):
+    """Update the rollups and the student counters of the courses, and
+    the catalog lists that show them"""
+    related = instance.courses_joined if reverse else instance.students
+    if action == "pre_clear":
+        # pk_set is empty on clear, so collect the other side beforehand
+        instance._cleared_rollup_ids = set(
+            related.values_list("id", flat=True)
+        )
+        return
+    if action == "pre_remove":
+        # pk_set holds every id passed to remove(), related or not
+        instance._removed_rollup_ids = set(
+            related.filter(id__in=pk_set).values_list("id", flat=True)
+        )
+        return
+    if action == "post_clear":
+        pk_set, action = instance._cleared_rollup_ids, "post_remove"
+    elif action == "post_remove":
+        pk_set = instance._removed_rollup_ids
+    if not pk_set:
+        return
+    if action == "post_add":
+        sign, changes = 1, {"new_students": 1, "students": 1}
+    elif action == "post_remove":
+        sign, changes = -1, {"left_students": 1, "students": -1}
+    else:
+        return
+    if reverse:
+        # instance is a student joining or leaving the courses of pk_set
+        course_ids = pk_set
+        counters.add(Course, "student_count", pk_set, sign)
+        for course_id in pk_set:
+            rollups.bump([course_id], **changes)
+    else:
+        course_ids, n = [instance.pk], len(pk_set)
+        counters.add(Course, "student_count", [instance.pk], sign * n)
+        rollups.bump(
+            [instance.pk], **{field: c * n for field, c in changes.items()}
+        )
+    # the cached catalog lists carry student_count
+    catalog.bump_generations(
+        Course.objects.filter(pk__in=course_ids).values_list(
+            "series_id", flat=True
+        )
+    )
+
+
+# Catalog counters
+
+
+@receiver(post_save, sender=Course)
+def count_course(sender, instance, created, **kwargs):
+    stored_series_id = getattr(instance, "_stored_series_id", None)
+    if created or stored_series_id != instance.series_id:
+        counters.add(Series, "course_count", [stored_series_id], -1)
+        counters.add(Series, "course_count", [instance.series_id])
+
+
+@receiver(post_delete, sender=Course)
+def uncount_course(sender, instance, **kwargs):
+    counters.add(Series, "course_count", [instance.series_id], -1)
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def count_course_module(sender, instance, **kwargs):
+    if kwargs.get("created", True):
+        change = 1 if kwargs["signal"] is post_save else -1
+        counters.add(Course, "module_count", [instance.course_id], change)
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+def count_module_content(sender, instance, **kwargs):
+    if kwargs.get("created", True):
+        change = 1 if kwargs["signal"] is post_save else -1
+        counters.add(Module, "content_count", [instance.module_id], change)
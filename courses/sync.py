@@ -0,0 +1,215 @@
+"""Change journal of courses, modules, contents and items for delta sync.
+
+Every change writes a SyncEntry for each course the object belongs to and
+removes the previous entry of that object, so the journal holds one entry
+per object. Entries are numbered per course in commit order, see
+``reserve()``. A client passes the number of the last entry it has seen
+as its cursor and receives the objects journaled after it, deleted
+objects as tombstones. Cursor 0 returns the whole course.
+
+Entries are written from ``courses.signals``. Bulk writes that bypass the
+signals, like reordering, call ``record()`` themselves.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import (
+    Content,
+    Course,
+    Module,
+    SyncEntry,
+    SyncSequence,
+    cache_content_types,
+)
+
+SYNC_PAGE_SIZE = 500
+
+
+def course_ids_of(obj):
+    """Ids of the courses obj is part of"""
+    if isinstance(obj, Course):
+        return [obj.pk]
+    if isinstance(obj, Module):
+        return [obj.course_id]
+    if isinstance(obj, Content):
+        return list(
+            Module.objects.filter(pk=obj.module_id).values_list(
+                "course_id", flat=True
+            )
+        )
+    # items belong to the courses of the modules they are placed in
+    return list(
+        Content.objects.filter(
+            content_type=ContentType.objects.get_for_model(obj),
+            object_id=obj.pk,
+        )
+        .values_list("module__course_id", flat=True)
+        .distinct()
+    )
+
+
+def reserve(course_id, count):
+    """Take count sequence numbers of the journal of a course and return
+    the first one.
+
+    Ids of concurrent transactions may commit out of order, so a cursor
+    over them can pass an entry that becomes visible later. The update
+    keeps the sequence row locked until the transaction ends, so numbers
+    of the same course are committed in order instead.
+    """
+    sequences = SyncSequence.objects.filter(course_id=course_id)
+    if not sequences.update(last=F("last") + count):
+        try:
+            with transaction.atomic():
+                SyncSequence.objects.create(course_id=course_id, last=count)
+            return 1
+        except IntegrityError:
+            # created by a concurrent transaction
+            sequences.update(last=F("last") + count)
+    return sequences.values_list("last", flat=True).get() - count + 1
+
+
+def number_entries(entries):
+    """Give entries the next sequence numbers of their courses. Courses are
+    locked in the order of their ids, to avoid deadlocks."""
+    by_course = {}
+    for entry in entries:
+        by_course.setdefault(entry.course_id, []).append(entry)
+    for course_id in sorted(by_course):
+        course_entries = by_course[course_id]
+        first = reserve(course_id, len(course_entries))
+        for seq, entry in enumerate(course_entries, first):
+            entry.seq = seq
+    return entries
+
+
+@transaction.atomic
+def record(objs, course_ids=None, deleted=False):
+    """Journal a change of objs, all of the same model. course_ids defaults
+    to the courses of the first object."""
+    if not objs:
+        return
+    if course_ids is None:
+        course_ids = course_ids_of(objs[0])
+    if not course_ids:
+        return
+    content_type = ContentType.objects.get_for_model(objs[0])
+    object_ids = [obj.pk for obj in objs]
+    entries = number_entries(
+        [
+            SyncEntry(
+                course_id=course_id,
+                content_type=content_type,
+                object_id=object_id,
+                deleted=deleted,
+            )
+            for course_id in course_ids
+            for object_id in object_ids
+        ]
+    )
+    SyncEntry.objects.filter(
+        content_type=content_type,
+        object_id__in=object_ids,
+        course_id__in=course_ids,
+    ).delete()
+    SyncEntry.objects.bulk_create(entries)
+
+
+@transaction.atomic
+def forget_course(course_id):
+    """Replace the journal of a deleted course by its tombstone"""
+    (tombstone,) = number_entries(
+        [
+            SyncEntry(
+                course_id=course_id,
+                content_type=ContentType.objects.get_for_model(Course),
+                object_id=course_id,
+                deleted=True,
+            )
+        ]
+    )
+    SyncEntry.objects.filter(course_id=course_id).delete()
+    tombstone.save()
+
+
+def journal_courses(course_ids, batch_size=500):
+    """Journal every object of the courses from scratch. Used for data that
+    was written without signals, like bulk inserts."""
+    get_for_model = ContentType.objects.get_for_model
+    course_type = get_for_model(Course)
+    module_type = get_for_model(Module)
+    content_type = get_for_model(Content)
+    course_ids = list(course_ids)
+    for start in range(0, len(course_ids), batch_size):
+        batch = course_ids[start : start + batch_size]
+        entries = [
+            SyncEntry(
+                course_id=course_id,
+                content_type=course_type,
+                object_id=course_id,
+            )
+            for course_id in batch
+        ]
+        modules = Module.objects.filter(course_id__in=batch).values_list(
+            "id", "course_id"
+        )
+        for module_id, course_id in modules:
+            entries.append(
+                SyncEntry(
+                    course_id=course_id,
+                    content_type=module_type,
+                    object_id=module_id,
+                )
+            )
+        contents = Content.objects.filter(
+            module__course_id__in=batch
+        ).values_list(
+            "id", "module__course_id", "content_type_id", "object_id"
+        )
+        for content_id, course_id, item_type_id, item_id in contents:
+            entries.append(
+                SyncEntry(
+                    course_id=course_id,
+                    content_type=content_type,
+                    object_id=content_id,
+                )
+            )
+            entries.append(
+                SyncEntry(
+                    course_id=course_id,
+                    content_type_id=item_type_id,
+                    object_id=item_id,
+                )
+            )
+        with transaction.atomic():
+            number_entries(entries)
+            SyncEntry.objects.filter(course_id__in=batch).delete()
+            SyncEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+def changes(course_id, since=0, limit=SYNC_PAGE_SIZE):
+    """Return ``(entries, objects, has_more)`` for the entries of a course
+    after the cursor since. ``objects`` maps the content type and id of
+    every entry that is not a tombstone to the current object."""
+    entries = list(
+        SyncEntry.objects.filter(course_id=course_id, seq__gt=since).order_by(
+            "seq"
+        )[: limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    wanted = {}
+    for entry in entries:
+        if not entry.deleted:
+            wanted.setdefault(entry.content_type_id, []).append(
+                entry.object_id
+            )
+    cache_content_types()
+    objects = {}
+    for content_type_id, ids in wanted.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        for obj in model._default_manager.filter(pk__in=ids):
+            objects[content_type_id, obj.pk] = obj
+    return entries, objects, has_more
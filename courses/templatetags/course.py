@@ -1,5 +1,7 @@
 from django import template
 
+from courses.images import srcset as variant_srcset
+
 register = template.Library()
 
 @register.filter
@@ -7,4 +9,11 @@ def model_name(obj):
     try:
         return obj._meta.model_name
     except AttributeError:
-        return None
\ No newline at end of file
+        return None
+
+
+@register.filter
+def srcset(image, ext="jpg"):
+    """srcset of the resized variants of an image field, e.g.
+    ``{{ item.module_image|srcset:"webp" }}``"""
+    return variant_srcset(image, ext)
@@ -1,3 +1,1635 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from academy import routers
+from academy.cache import Envelope, LocalCache, TwoTierCache
+from academy.middleware import QueryStats
+from academy.routers import ReplicaPinMiddleware, ReplicaRouter
+from academy.testing import QueryBudgetTestCase
+import msgpack
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import connection
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from . import (
+    async_views,
+    catalog,
+    counters,
+    export,
+    images,
+    rollups,
+    search,
+    sync,
+    uploads,
+    views,
+)
+from .rendering import render_cache_key, render_items
+from .api import async_views as api_async_views
+from .downloads import RangeNotSatisfiable, parse_range
+from .fields import (
+    MAX_KEY,
+    SPARSE_GAP,
+    OrderField,
+    increasing_run,
+    keys_between,
+    sparse_key,
+)
+from .models import (
+    Content,
+    Course,
+    CourseDailyStats,
+    File,
+    Image,
+    Module,
+    SearchTerm,
+    Series,
+    SyncEntry,
+    Text,
+    Upload,
+    Video,
+)
+
+User = get_user_model()
+
+
+def create_course(owner, series, modules=1, items=1):
+    """Create a course whose modules each hold ``items`` texts and videos"""
+    course = Course.objects.create(
+        owner=owner, series=series, title=f"Course {modules}", overview="-"
+    )
+    for m in range(modules):
+        module = Module.objects.create(course=course, title=f"Module {m}")
+        for i in range(items):
+            text = Text.objects.create(
+                creator=owner, title=f"Text {i}", content="Crop rotation"
+            )
+            video = Video.objects.create(
+                creator=owner,
+                title=f"Video {i}",
+                video_url="https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            )
+            Content.objects.create(module=module, item=text)
+            Content.objects.create(module=module, item=video)
+    return course
+
+
+class TempMediaMixin(object):
+    """Keep the files of a test class in a temporary MEDIA_ROOT. The module
+    level directories listed in ``media_dirs`` as ``(module, attribute)``
+    are moved to a new empty directory in it for every test."""
+
+    media_dirs = ()
+
+    @classmethod
+    def setUpClass(cls):
+        media = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media.cleanup)
+        cls.media_root = media.name
+        # enabled before setUpTestData, which may store files
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        for module, name in self.media_dirs:
+            path = tempfile.mkdtemp(dir=self.media_root)
+            patch = mock.patch.object(module, name, path)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+
+class CourseContentsApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        cls.series = Series.objects.create(title="Soil", slug="soil")
+
+    def setUp(self):
+        cache.clear()
+
+    def assertContentsQueries(self, course, num):
+        url = reverse("api:course-contents", args=[course.id])
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_query_count_does_not_depend_on_course_size(self):
+        # journal head, course, modules, contents and one query per item
+        # type
+        small = create_course(self.owner, self.series, modules=1, items=1)
+        large = create_course(self.owner, self.series, modules=6, items=8)
+
+        self.assertContentsQueries(small, 6)
+        response = self.assertContentsQueries(large, 6)
+
+        modules = response.json()["modules"]
+        self.assertEqual(len(modules), 6)
+        self.assertEqual(len(modules[0]["contents"]), 16)
+        self.assertIn("<p>Crop rotation</p>", modules[0]["contents"][0]["item"])
+
+
+class RenderingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+
+    def setUp(self):
+        cache.clear()
+        self.text = Text.objects.create(
+            creator=self.owner, title="Soil", content="Crop rotation"
+        )
+
+    def render(self):
+        # a fresh instance, like the next request would load
+        return render_items([Text.objects.get(pk=self.text.pk)])[0]
+
+    def test_fragments_are_served_from_the_cache(self):
+        self.assertIn("Crop rotation", self.render())
+        key = render_cache_key(self.text)
+        cache.set(key, "cached")
+        self.assertEqual(self.render(), "cached")
+
+    def test_editing_an_item_changes_what_is_rendered(self):
+        self.render()
+        old_key = render_cache_key(self.text)
+        self.text.content = "Cover crops"
+        self.text.save()
+        self.assertIsNone(cache.get(old_key))
+        self.assertIn("Cover crops", self.render())
+
+    def test_deleting_an_item_drops_its_fragment(self):
+        self.render()
+        key = render_cache_key(self.text)
+        self.text.delete()
+        self.assertIsNone(cache.get(key))
+
+
+class CatalogGenerationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        cls.series = Series.objects.create(title="Soil", slug="soil")
+        cls.other = Series.objects.create(title="Water", slug="water")
+        cls.course = create_course(cls.owner, cls.series)
+
+    def setUp(self):
+        cache.clear()
+
+    def generations(self):
+        return [
+            catalog.get_generation(key)
+            for key in (
+                catalog.CATALOG_GENERATION,
+                catalog.series_generation_key(self.series.id),
+                catalog.series_generation_key(self.other.id),
+            )
+        ]
+
+    def assertBumped(self, change, expected):
+        before = self.generations()
+        change()
+        bumped = [a != b for a, b in zip(before, self.generations())]
+        self.assertEqual(bumped, expected)
+
+    def test_edits_bump_the_generations_of_their_series(self):
+        course, module = self.course, self.course.modules.get()
+        course.title = "Crop rotation"
+        self.assertBumped(course.save, [True, True, False])
+        module.title = "Cover crops"
+        self.assertBumped(module.save, [True, True, False])
+        self.other.title = "Irrigation"
+        self.assertBumped(self.other.save, [True, False, True])
+
+        # moving a course refreshes both series
+        course.series = self.other
+        self.assertBumped(course.save, [True, True, True])
+
+    def test_cached_lists_follow_the_edits(self):
+        self.assertEqual(catalog.get_courses(self.series), [self.course])
+        Course.objects.create(
+            owner=self.owner, series=self.series, title="Compost"
+        )
+        self.assertEqual(len(catalog.get_courses(self.series)), 2)
+        self.series.title = "Soils"
+        self.series.save()
+        self.assertIn("Soils", [s.title for s in catalog.get_series()])
+
+    def test_enrollments_refresh_the_student_counts(self):
+        student = User.objects.create_user("student", "s@example.com")
+        catalog.get_courses()
+        self.assertBumped(
+            lambda: student.courses_joined.add(self.course),
+            [True, True, False],
+        )
+        self.assertEqual(catalog.get_courses()[0].student_count, 1)
+        self.assertBumped(
+            lambda: student.courses_joined.clear(), [True, True, False]
+        )
+
+
+class OrderKeyTests(SimpleTestCase):
+    def test_sparse_keys_are_exact_in_json(self):
+        first = sparse_key()
+        time.sleep(0.002)
+        self.assertGreater(sparse_key(), first)
+        self.assertLessEqual(first, MAX_KEY)
+
+    def test_keys_between(self):
+        self.assertEqual(keys_between(0, 100, 3), [25, 50, 75])
+        self.assertEqual(keys_between(None, 4, 1), [1])
+        self.assertIsNone(keys_between(1, 2, 1))
+        self.assertIsNone(keys_between(0, 100, 1, taken={50}))
+        keys = keys_between(100, None, 2)
+        self.assertTrue(100 < keys[0] < keys[1] <= MAX_KEY)
+        # moved to the end, and still before the next append
+        self.assertLess(keys[1], sparse_key() + SPARSE_GAP)
+        time.sleep(0.002)
+        self.assertLess(keys[1], sparse_key())
+
+    def test_increasing_run(self):
+        self.assertEqual(increasing_run([5, 1, 2, 9, 3]), [1, 2, 4])
+        self.assertEqual(increasing_run([]), [])
+
+    def test_dense_reorder_writes_the_rows_off_their_position(self):
+        field = OrderField()
+        field.set_attributes_from_name("order")
+        rows = [SimpleNamespace(order=i) for i in range(4)]
+        rows[1], rows[2] = rows[2], rows[1]
+        self.assertEqual(field.reorder(rows), [rows[1], rows[2]])
+        self.assertEqual([row.order for row in rows], [0, 1, 2, 3])
+
+
+class SparseOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(owner, series, modules=5, items=0)
+        cls.field = Module._meta.get_field("order")
+
+    def modules(self):
+        return list(self.course.modules.order_by("order"))
+
+    def set_keys(self, keys):
+        for module, key in zip(self.modules(), keys):
+            Module.objects.filter(pk=module.pk).update(order=key)
+
+    def test_appends_retry_a_key_taken_in_the_same_millisecond(self):
+        last = self.modules()[-1]
+        with mock.patch(
+            "courses.fields.sparse_key",
+            side_effect=[last.order, last.order + 1],
+        ):
+            module = Module.objects.create(course=self.course, title="Mulch")
+        self.assertEqual(module.order, last.order + 1)
+        self.assertEqual(self.modules()[-1], module)
+
+    def test_reorder_only_rekeys_the_moved_rows(self):
+        rows = self.modules()
+        old = {row.pk: row.order for row in rows}
+        rows.insert(0, rows.pop())
+        changed = self.field.reorder(rows)
+        self.assertEqual(changed, [rows[0]])
+        keys = [row.order for row in rows]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(
+            [old[row.pk] for row in rows[1:]], [row.order for row in rows[1:]]
+        )
+
+    def test_reorder_without_room_respreads_the_group(self):
+        self.set_keys([1, 2, 3, 4, 5])
+        rows = self.modules()
+        rows.insert(1, rows.pop())
+        changed = self.field.reorder(rows)
+        self.assertEqual(len(changed), 5)
+        keys = [row.order for row in rows]
+        self.assertEqual(keys, sorted(keys))
+        self.assertFalse({1, 2, 3, 4, 5} & set(keys))
+
+    def test_rebalance_keeps_the_order(self):
+        self.set_keys([1, 2, 3, 4, 5])
+        before = [module.pk for module in self.modules()]
+        self.assertTrue(self.field.needs_rebalance([1, 2, 3, 4, 5]))
+        self.assertEqual(self.field.rebalance(self.modules()[0]), 5)
+        modules = self.modules()
+        self.assertEqual([module.pk for module in modules], before)
+        keys = [module.order for module in modules]
+        self.assertFalse(self.field.needs_rebalance(keys))
+        self.assertEqual(keys[1] - keys[0], SPARSE_GAP)
+
+    def test_rebalance_order_command(self):
+        self.set_keys([1, 2, 3, 4, 5])
+        roomy = create_course(self.course.owner, self.course.series)
+        roomy_keys = [module.order for module in roomy.modules.all()]
+        last_entry = SyncEntry.objects.order_by("id").last().id
+        out = StringIO()
+        call_command("rebalance_order", stdout=out)
+        self.assertIn(
+            "courses.Module.order: rebalanced 1 of 2 groups", out.getvalue()
+        )
+        keys = [module.order for module in self.modules()]
+        self.assertFalse(self.field.needs_rebalance(keys))
+        self.assertEqual(
+            [module.order for module in roomy.modules.all()], roomy_keys
+        )
+        # the new keys reach sync clients
+        self.assertEqual(
+            SyncEntry.objects.filter(id__gt=last_entry).count(), 5
+        )
+
+        call_command("rebalance_order", "--all", stdout=out)
+        self.assertIn("Module.order: rebalanced 2 of 2 groups", out.getvalue())
+
+
+class ReorderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(cls.owner, series, modules=4, items=1)
+        cls.url = reverse("courses:module_order")
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def modules(self):
+        return list(self.course.modules.order_by("order"))
+
+    def post(self, payload, url=None):
+        return self.client.post(
+            url or self.url, payload, content_type="application/json"
+        )
+
+    def reorder(self, rows):
+        ids = [row.id for row in rows]
+        keys = {row.id: row.order for row in self.modules()}
+        last_entry = SyncEntry.objects.order_by("id").last().id
+        response = self.post(
+            {"order": ids, "version": views.order_version(self.modules())}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["order"], ids)
+        self.assertEqual([row.id for row in self.modules()], ids)
+        written = [
+            row.id for row in self.modules() if row.order != keys[row.id]
+        ]
+        journaled = SyncEntry.objects.filter(id__gt=last_entry).count()
+        self.assertEqual(journaled, len(written))
+        return response, written
+
+    def test_only_the_moved_rows_are_written(self):
+        rows = self.modules()
+        rows.insert(0, rows.pop())
+        response, written = self.reorder(rows)
+        self.assertEqual(written, [rows[0].id])
+        self.assertEqual(
+            response.json()["version"], views.order_version(self.modules())
+        )
+
+        # reversing keeps one row of the longest increasing run
+        rows = self.modules()[::-1]
+        _, written = self.reorder(rows)
+        self.assertEqual(len(written), 3)
+
+    def test_stale_orders_are_rejected(self):
+        stale = views.order_version(self.modules())
+        rows = self.modules()
+        rows.append(rows.pop(0))
+        self.reorder(rows)
+
+        keys = [row.order for row in self.modules()]
+        ids = [row.id for row in self.modules()[::-1]]
+        response = self.post({"order": ids, "version": stale})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            response.json()["order"], [row.id for row in self.modules()]
+        )
+        self.assertEqual([row.order for row in self.modules()], keys)
+
+    def test_orders_need_every_child_and_a_version(self):
+        rows = self.modules()
+        version = views.order_version(rows)
+        ids = [row.id for row in rows]
+        legacy = {str(id): position for position, id in enumerate(ids)}
+        for payload in (
+            legacy,
+            {"order": ids},
+            {"order": ids[1:], "version": version},
+        ):
+            with self.subTest(payload):
+                self.assertEqual(self.post(payload).status_code, 400)
+
+    def test_other_owners_cannot_reorder(self):
+        other = User.objects.create_user("other", "o@example.com")
+        self.client.force_login(other)
+        rows = self.modules()
+        response = self.post(
+            {
+                "order": [row.id for row in rows[::-1]],
+                "version": views.order_version(rows),
+            }
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_contents_are_reordered_within_their_module(self):
+        module = self.course.modules.first()
+        contents = list(module.contents.order_by("order"))
+        response = self.post(
+            {
+                "order": [content.id for content in contents[::-1]],
+                "version": views.order_version(contents),
+            },
+            reverse("courses:content_order"),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(module.contents.order_by("order")), contents[::-1]
+        )
+
+
+class CourseQueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        cls.series = Series.objects.create(title="Soil", slug="soil")
+        cls.small = create_course(cls.owner, cls.series, modules=1, items=1)
+        cls.large = create_course(cls.owner, cls.series, modules=6, items=8)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.owner)
+
+    def get_within_budget(self, name, *args, query=""):
+        response = self.client.get(reverse(name, args=args) + query)
+        self.assertEqual(response.status_code, 200)
+        return self.assertWithinBudget(response)
+
+    def test_public_views(self):
+        self.get_within_budget("courses:course_list")
+        self.get_within_budget("courses:course_list_series", "soil")
+        self.get_within_budget("courses:course_search", query="?q=crop")
+        self.get_within_budget("api:course-list")
+        self.get_within_budget("api:series_list")
+        self.get_within_budget("api:series_detail", self.series.id)
+        self.get_within_budget("api:search", query="?q=crop")
+
+    def test_course_views_do_not_depend_on_course_size(self):
+        views = [
+            ("courses:course_detail", lambda course: course.slug),
+            (
+                "courses:module_content_list",
+                lambda course: course.modules.first().id,
+            ),
+            ("api:course-detail", lambda course: course.id),
+            ("api:course-contents", lambda course: course.id),
+            ("api:course-sync", lambda course: course.id),
+        ]
+        for name, arg in views:
+            with self.subTest(name):
+                # cold caches, as in a new process
+                cache.clear()
+                ContentType.objects.clear_cache()
+                small = self.get_within_budget(name, arg(self.small))
+                cache.clear()
+                ContentType.objects.clear_cache()
+                large = self.get_within_budget(name, arg(self.large))
+                self.assertEqual(small.count, large.count)
+
+
+class SparseFieldsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        cls.series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(owner, cls.series, modules=2)
+        cls.url = reverse("api:course-detail", args=[cls.course.id])
+
+    def get(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [q["sql"] for q in queries.captured_queries]
+
+    def test_fields(self):
+        data, queries = self.get("?fields=id,title,unknown")
+        self.assertEqual(data, {"id": self.course.id, "title": "Course 2"})
+        course_query = next(q for q in queries if "courses_course" in q)
+        self.assertNotIn("overview", course_query)
+        self.assertFalse([q for q in queries if "courses_module" in q])
+
+    def test_nested_fields(self):
+        data, queries = self.get("?fields=id,modules.title")
+        self.assertEqual(
+            data["modules"], [{"title": "Module 0"}, {"title": "Module 1"}]
+        )
+        module_query = next(q for q in queries if "courses_module" in q)
+        self.assertNotIn("description", module_query)
+
+    def test_expand(self):
+        data, _ = self.get("?fields=id,series&expand=series")
+        self.assertEqual(
+            data["series"],
+            {
+                "id": self.series.id,
+                "title": "Soil",
+                "slug": "soil",
+                "course_count": 1,
+            },
+        )
+        data, _ = self.get("?fields=series")
+        self.assertEqual(data, {"series": self.series.id})
+
+
+class MessagePackTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(owner, series)
+        cls.student = User.objects.create_user("student", "s@example.com")
+        cls.student.courses_joined.add(cls.course)
+
+    def test_render(self):
+        url = reverse("api:course-detail", args=[self.course.id])
+        expected = self.client.get(url).json()
+        for headers, query in (
+            ({"HTTP_ACCEPT": "application/msgpack"}, ""),
+            ({}, "?format=msgpack"),
+        ):
+            with self.subTest(query or headers):
+                response = self.client.get(url + query, **headers)
+                self.assertEqual(
+                    response["Content-Type"], "application/msgpack"
+                )
+                self.assertEqual(msgpack.unpackb(response.content), expected)
+
+    def test_parse(self):
+        self.client.force_login(self.student)
+        url = reverse("api:course-progress", args=[self.course.id])
+        content = self.course.modules.get().contents.first()
+        heartbeats = [{"content": content.id, "position": 30}]
+        response = self.client.post(
+            url,
+            msgpack.packb(heartbeats),
+            content_type="application/msgpack",
+        )
+        self.assertEqual(response.status_code, 202)
+
+        response = self.client.post(
+            url, b"\x92\x01", content_type="application/msgpack"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class SyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(cls.owner, series, modules=2)
+        cls.other = create_course(cls.owner, series)
+        cls.student = User.objects.create_user("student", "s@example.com")
+        cls.student.courses_joined.add(cls.course)
+        cls.url = reverse("api:course-sync", args=[cls.course.id])
+
+    def setUp(self):
+        self.client.force_login(self.student)
+
+    def sync(self, since=0):
+        response = self.client.get(self.url, {"since": since})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        changes = {
+            (change["type"], change["id"]): change
+            for change in data["changes"]
+        }
+        return data["cursor"], changes
+
+    def test_full_sync(self):
+        cursor, changes = self.sync()
+        # the course, 2 modules, 4 contents and their 4 items
+        self.assertEqual(len(changes), 11)
+        self.assertEqual(
+            changes["course", self.course.id]["data"]["title"],
+            self.course.title,
+        )
+        self.assertEqual(self.sync(cursor), (cursor, {}))
+
+    def test_changes_and_tombstones(self):
+        cursor, _ = self.sync()
+        module = self.course.modules.first()
+        module.title = "Harvest"
+        module.save()
+        content = module.contents.first()
+        content_id, item = content.id, content.item
+        content.delete()
+        cursor, changes = self.sync(cursor)
+        self.assertEqual(
+            set(changes), {("module", module.id), ("content", content_id)}
+        )
+        self.assertEqual(
+            changes["module", module.id]["data"]["title"], "Harvest"
+        )
+        self.assertEqual(
+            changes["content", content_id],
+            {"type": "content", "id": content_id, "deleted": True},
+        )
+
+        # deleted and placed again, the object is current once more
+        Content.objects.create(module=module, item=item)
+        _, changes = self.sync(cursor)
+        self.assertEqual(len(changes), 2)
+        created = module.contents.order_by("id").last()
+        self.assertFalse(changes["content", created.id]["deleted"])
+        item_type = created.content_type.model
+        self.assertFalse(changes[item_type, created.object_id]["deleted"])
+
+    def test_deleted_courses_leave_a_tombstone(self):
+        course_id = self.other.id
+        last = sync.changes(course_id)[0][-1].seq
+        self.other.delete()
+        entries, objects, _ = sync.changes(course_id)
+        self.assertEqual(
+            [(entry.object_id, entry.deleted) for entry in entries],
+            [(course_id, True)],
+        )
+        self.assertGreater(entries[0].seq, last)
+        self.assertEqual(objects, {})
+
+    def test_pages(self):
+        entries, _, has_more = sync.changes(self.course.id, limit=4)
+        self.assertTrue(has_more)
+        seen = [entry.seq for entry in entries]
+        while has_more:
+            entries, _, has_more = sync.changes(
+                self.course.id, seen[-1], limit=4
+            )
+            seen += [entry.seq for entry in entries]
+        self.assertEqual(len(seen), 11)
+        self.assertEqual(seen, sorted(set(seen)))
+
+    def test_entries_are_numbered_per_course(self):
+        cursor, _ = self.sync()
+        self.other.modules.get().save()
+        module = self.course.modules.first()
+        module.save()
+        self.course.save()
+        entries, _, _ = sync.changes(self.course.id, cursor)
+        self.assertEqual(
+            [entry.seq for entry in entries], [cursor + 1, cursor + 2]
+        )
+
+    def test_only_students_and_the_owner_sync(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        outsider = User.objects.create_user("other", "o@example.com")
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.logout()
+        self.assertIn(self.client.get(self.url).status_code, (401, 403))
+        self.client.force_login(self.student)
+        response = self.client.get(self.url, {"since": "x"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = Course.objects.create(
+            owner=owner,
+            series=series,
+            title="Crop rotation",
+            overview="Planning the harvest",
+        )
+        cls.module = Module.objects.create(
+            course=cls.course,
+            title="Legumes",
+            description="Which crop fixes nitrogen",
+        )
+        cls.text = Text.objects.create(
+            creator=owner, title="Notes", content="Crop and harvest notes"
+        )
+
+    def results(self, query):
+        response = self.client.get(reverse("api:search"), {"q": query})
+        return [
+            (row["type"], row["object_id"], row["rank"])
+            for row in response.json()["results"]
+        ]
+
+    def test_titles_rank_first(self):
+        self.assertFalse(search.use_full_text())
+        self.assertEqual(
+            self.results("crop"),
+            [
+                ("course", self.course.id, search.TITLE_WEIGHT),
+                ("module", self.module.id, search.BODY_WEIGHT),
+            ],
+        )
+
+    def test_every_word_has_to_match(self):
+        self.assertEqual(
+            self.results("the crop harvest"),
+            [("course", self.course.id, 5)],
+        )
+        self.assertEqual(self.results("the and"), [])
+
+    def test_texts_are_found_once_placed(self):
+        self.assertEqual(self.results("notes"), [])
+        Content.objects.create(module=self.module, item=self.text)
+        self.assertEqual(self.results("notes"), [("text", self.text.id, 5)])
+        self.text.delete()
+        self.assertEqual(self.results("notes"), [])
+
+    def test_unchanged_text_is_not_reindexed(self):
+        terms = set(SearchTerm.objects.values_list("id", flat=True))
+        self.course.overview = "Planning the harvest"
+        self.course.save()
+        self.module.save()
+        self.assertEqual(
+            set(SearchTerm.objects.values_list("id", flat=True)), terms
+        )
+
+        self.course.title = "Cover crops"
+        self.course.save()
+        self.assertEqual(self.results("rotation"), [])
+        self.assertEqual(
+            self.results("cover")[0][:2], ("course", self.course.id)
+        )
+
+
+class CourseExportTests(TempMediaMixin, TestCase):
+    media_dirs = [(export, "COURSE_EXPORT_ROOT")]
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(owner, series, modules=2)
+        # the same handout in both modules
+        handout = File.objects.create(
+            creator=owner,
+            title="Handout",
+            file=SimpleUploadedFile("handout.txt", b"Rotate crops"),
+        )
+        for module in cls.course.modules.all():
+            Content.objects.create(module=module, item=handout)
+        cls.handout = f"media/{handout.file.name}"
+        cls.student = User.objects.create_user("student", "s@example.com")
+        cls.student.courses_joined.add(cls.course)
+        cls.url = reverse("courses:course_export", args=[cls.course.id])
+
+    def setUp(self):
+        super().setUp()
+        self.root = export.COURSE_EXPORT_ROOT
+        self.client.force_login(self.student)
+
+    def download(self, query=""):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        chunks = response.streaming_content
+        first = next(chunks)
+        # the manifest is saved once the whole package was produced
+        saved = [
+            name for name in os.listdir(self.root) if name.endswith(".json")
+        ]
+        package = zipfile.ZipFile(BytesIO(first + b"".join(chunks)))
+        manifest = json.loads(package.read("manifest.json"))
+        self.assertEqual(manifest["version"], response["X-Package-Version"])
+        return package, manifest, saved
+
+    def test_package(self):
+        package, manifest, saved = self.download()
+        self.assertEqual(saved, [])
+        names = package.namelist()
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(
+            sorted(names),
+            sorted(["manifest.json", *manifest["files"]]),
+        )
+        self.assertEqual(package.read(self.handout), b"Rotate crops")
+        for module in self.course.modules.all():
+            page = package.read(f"module-{module.id}.html").decode()
+            self.assertIn(module.title, page)
+            self.assertIn(self.handout, page)
+        self.assertEqual(
+            sorted(os.listdir(self.root)),
+            sorted(
+                [
+                    f"{self.course.id}-{manifest['version']}.json",
+                    f"{self.course.id}-{self.course.slug}-"
+                    f"{manifest['version']}.zip",
+                ]
+            ),
+        )
+
+    def test_delta(self):
+        _, manifest, _ = self.download()
+        module = self.course.modules.first()
+        module.title = "Harvest"
+        module.save()
+        package, delta, _ = self.download(f"?since={manifest['version']}")
+        self.assertEqual(delta["base"], manifest["version"])
+        self.assertEqual(
+            sorted(package.namelist()),
+            ["index.html", "manifest.json", f"module-{module.id}.html"],
+        )
+
+    def test_purge(self):
+        self.download()
+        out = StringIO()
+        call_command("purge_exports", days=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Purged 0 export files")
+        old = time.time() - 2 * 24 * 60 * 60
+        for name in os.listdir(self.root):
+            os.utime(os.path.join(self.root, name), (old, old))
+        call_command("purge_exports", days=1, stdout=out)
+        self.assertIn("Purged 2 export files", out.getvalue())
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class ChunkedUploadTests(TempMediaMixin, TestCase):
+    media_dirs = [(uploads, "CHUNKED_UPLOAD_ROOT")]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.module = create_course(cls.owner, series).modules.get()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+        response = self.client.post(
+            reverse(
+                "courses:module_content_upload", args=[self.module.id, "file"]
+            ),
+            {"title": "Notes", "filename": "notes.txt", "size": 10},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.upload = Upload.objects.get()
+        self.url = response["Location"]
+
+    def patch(self, offset, data):
+        return self.client.patch(
+            self.url,
+            data,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_resume(self):
+        response = self.patch(0, b"01234")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response["Upload-Offset"], "5")
+
+        # a client that lost the reply asks where to go on
+        response = self.patch(0, b"01234")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Upload-Offset"], "5")
+        response = self.client.head(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Upload-Offset"], "5")
+        self.assertEqual(response["Upload-Length"], "10")
+
+        self.assertEqual(self.patch(5, b"56789").status_code, 204)
+        response = self.client.post(
+            reverse("courses:content_upload_finalize", args=[self.upload.id])
+        )
+        self.assertEqual(response.status_code, 201)
+        item = File.objects.get(id=response.json()["id"])
+        with item.file.open() as f:
+            self.assertEqual(f.read(), b"0123456789")
+        self.assertTrue(self.module.contents.filter(object_id=item.id))
+        self.assertFalse(Upload.objects.exists())
+        self.assertFalse(os.path.exists(uploads.partial_path(self.upload)))
+
+    def test_bad_headers_are_named(self):
+        cases = [
+            ({"HTTP_UPLOAD_OFFSET": ""}, b"Upload-Offset required"),
+            ({"HTTP_UPLOAD_OFFSET": "-1"}, b"Invalid Upload-Offset"),
+            ({"CONTENT_LENGTH": ""}, b"Content-Length required"),
+            ({"CONTENT_LENGTH": "ten"}, b"Invalid Content-Length"),
+        ]
+        for headers, message in cases:
+            with self.subTest(message):
+                response = self.client.patch(
+                    self.url,
+                    b"0123",
+                    content_type="application/offset+octet-stream",
+                    **{"HTTP_UPLOAD_OFFSET": "0", **headers},
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.content, message)
+        self.assertEqual(self.client.head(self.url)["Upload-Offset"], "0")
+
+    def test_incomplete_uploads_are_not_finalized(self):
+        self.patch(0, b"0123")
+        response = self.client.post(
+            reverse("courses:content_upload_finalize", args=[self.upload.id])
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["offset"], 4)
+
+    def test_purge_keeps_active_uploads(self):
+        Upload.objects.update(updated=timezone.now() - timedelta(hours=2))
+        self.patch(0, b"0123")
+        call_command("purge_uploads", hours=1, stdout=StringIO())
+        self.assertTrue(Upload.objects.exists())
+
+        Upload.objects.update(updated=timezone.now() - timedelta(hours=2))
+        out = StringIO()
+        call_command("purge_uploads", hours=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Purged 1 uploads")
+        self.assertFalse(Upload.objects.exists())
+        self.assertFalse(os.path.exists(uploads.partial_path(self.upload)))
+
+
+class FileDownloadTests(TempMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(cls.owner, series)
+        cls.item = File.objects.create(
+            creator=cls.owner,
+            title="Notes",
+            file=SimpleUploadedFile("notes.txt", b"0123456789"),
+        )
+        Content.objects.create(module=cls.course.modules.get(), item=cls.item)
+        cls.student = User.objects.create_user("student", "s@example.com")
+        cls.student.courses_joined.add(cls.course)
+        cls.url = reverse("courses:file_download", args=[cls.item.id])
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.student)
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b"".join(getattr(response, "streaming_content", []))
+        return response, body
+
+    def test_parse_range(self):
+        for header, size, expected in (
+            ("bytes=2-5", 10, (2, 5)),
+            ("bytes=2-", 10, (2, 9)),
+            ("bytes=5-100", 10, (5, 9)),
+            ("bytes=-3", 10, (7, 9)),
+            ("bytes=-30", 10, (0, 9)),
+            ("bytes=1-2,4-5", 10, None),
+            ("items=1-2", 10, None),
+            ("bytes=x-2", 10, None),
+        ):
+            with self.subTest(header):
+                self.assertEqual(parse_range(header, size), expected)
+        for header, size in (
+            ("bytes=10-", 10),
+            ("bytes=5-2", 10),
+            ("bytes=-0", 10),
+            ("bytes=-1", 0),
+            ("bytes=0-", 0),
+        ):
+            with self.subTest(header, size=size):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_range(header, size)
+
+    def test_ranges(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, b"0123456789")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        for header, status, expected, content_range in (
+            ("bytes=2-5", 206, b"2345", "bytes 2-5/10"),
+            ("bytes=7-", 206, b"789", "bytes 7-9/10"),
+            ("bytes=-2", 206, b"89", "bytes 8-9/10"),
+            ("bytes=20-", 416, b"", "bytes */10"),
+        ):
+            with self.subTest(header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(body, expected)
+                self.assertEqual(response["Content-Range"], content_range)
+
+    def test_if_range(self):
+        response, _ = self.get()
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+        for if_range, status in (
+            (etag, 206),
+            (last_modified, 206),
+            ('"file-0"', 200),
+            ("Thu, 01 Jan 2015 00:00:00 GMT", 200),
+        ):
+            with self.subTest(if_range):
+                response, body = self.get(
+                    HTTP_RANGE="bytes=0-3", HTTP_IF_RANGE=if_range
+                )
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(len(body), 4 if status == 206 else 10)
+
+    def test_not_modified(self):
+        response, _ = self.get()
+        response, body = self.get(HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b"")
+
+        self.item.file.save("notes.txt", SimpleUploadedFile("n", b"new"))
+        response, body = self.get(HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, b"new")
+
+    def test_empty_files_have_no_suffix(self):
+        self.item.file.save("empty.txt", SimpleUploadedFile("e", b""))
+        response, body = self.get(HTTP_RANGE="bytes=-1")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */0")
+
+    def test_only_students_and_the_owner_download(self):
+        other = User.objects.create_user("other", "o@example.com")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class ImageVariantTests(TempMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+
+    def setUp(self):
+        super().setUp()
+        # a new original for every test, so it starts without variants
+        self.image = Image.objects.create(
+            creator=self.owner,
+            title="Cow",
+            module_image=SimpleUploadedFile("cow.png", self.png(800, 400)),
+        )
+        self.field_file = self.image.module_image
+
+    def png(self, width, height):
+        data = BytesIO()
+        PILImage.new("RGB", (width, height), "green").save(data, "PNG")
+        return data.getvalue()
+
+    def test_variants_are_never_wider_than_the_original(self):
+        self.assertEqual(
+            images.variant_widths(self.field_file), [320, 640, 800]
+        )
+        self.assertEqual(images.generate_variants(self.field_file), 6)
+        self.assertEqual(images.generate_variants(self.field_file), 0)
+        path = self.field_file.storage.path
+        for width in (320, 640, 800):
+            name = images.variant_name(self.field_file.name, width, "webp")
+            with PILImage.open(path(name)) as variant:
+                self.assertEqual(variant.size, (width, width // 2))
+        self.assertFalse(
+            os.path.exists(
+                path(images.variant_name(self.field_file.name, 1280, "jpg"))
+            )
+        )
+
+    def test_srcset(self):
+        with mock.patch.object(images, "schedule_variants") as schedule:
+            self.assertEqual(images.srcset(self.field_file, "jpg"), "")
+            schedule.assert_called_once_with(self.field_file)
+
+            images.generate_variants(self.field_file)
+            schedule.reset_mock()
+            url = self.field_file.url[: -len(".png")]
+            self.assertEqual(
+                images.srcset(self.field_file, "webp"),
+                f"{url}.w320.webp 320w, {url}.w640.webp 640w, "
+                f"{url}.w800.webp 800w",
+            )
+            schedule.assert_not_called()
+
+    def test_stale_locks_are_taken_over(self):
+        path = self.field_file.storage.path(
+            images.variant_name(self.field_file.name, 320, "jpg")
+        )
+        with images.variant_lock(path) as locked:
+            self.assertTrue(locked)
+            with images.variant_lock(path) as again:
+                self.assertFalse(again)
+        self.assertFalse(os.path.exists(path + ".lock"))
+
+        open(path + ".lock", "w").close()
+        old = time.time() - images.LOCK_TIMEOUT - 1
+        os.utime(path + ".lock", (old, old))
+        with images.variant_lock(path) as locked:
+            self.assertTrue(locked)
+        self.assertFalse(os.path.exists(path + ".lock"))
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        for i in range(7):
+            Course.objects.create(
+                owner=owner, series=series, title=f"Course {i}", overview="-"
+            )
+        # courses imported together share their released date
+        released = Course.objects.order_by("id").first().released_date
+        Course.objects.exclude(title="Course 6").update(released_date=released)
+        for i, title in enumerate(("Soil", "Water", "Water", "Water")):
+            Series.objects.create(title=title, slug=f"series-{i}")
+
+    def pages(self, url, key="next"):
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            ids.append([row["id"] for row in page["results"]])
+            url = page[key]
+        return ids
+
+    def test_envelope(self):
+        page = self.client.get(reverse("api:course-list") + "?page_size=2")
+        self.assertEqual(list(page.json()), ["next", "previous", "results"])
+        self.assertIsNone(page.json()["previous"])
+        self.assertEqual(len(page.json()["results"]), 2)
+
+    def test_pages_across_ties(self):
+        for name, model, ordering in (
+            ("api:course-list", Course, ("-released_date", "-id")),
+            ("api:series_list", Series, ("title", "id")),
+        ):
+            with self.subTest(name):
+                expected = list(
+                    model.objects.order_by(*ordering).values_list(
+                        "id", flat=True
+                    )
+                )
+                pages = self.pages(reverse(name) + "?page_size=2")
+                self.assertEqual(sum(pages, []), expected)
+                self.assertEqual(len(pages), (len(expected) + 1) // 2)
+
+                # and back again from the last page
+                last = self.client.get(reverse(name) + "?page_size=2")
+                while last.json()["next"]:
+                    last = self.client.get(last.json()["next"])
+                back = self.pages(last.json()["previous"], "previous")
+                self.assertEqual(sum(back[::-1], []), expected[:-1])
+
+    def test_cursor_seeks_on_the_id(self):
+        url = self.client.get(reverse("api:course-list") + "?page_size=3")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url.json()["next"])
+        page_query = next(
+            query["sql"]
+            for query in queries.captured_queries
+            if "LIMIT 4" in query["sql"]
+        )
+        self.assertIn('"courses_course"."id" <', page_query)
+        self.assertNotIn("OFFSET", page_query)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("api:course-list") + "?cursor=x")
+        self.assertEqual(response.status_code, 404)
+
+
+class RollupTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        cls.owner.user_permissions.add(
+            Permission.objects.get(codename="view_course")
+        )
+        cls.series = Series.objects.create(title="Soil", slug="soil")
+        cls.students = [
+            User.objects.create_user(f"student{i}", f"s{i}@example.com")
+            for i in range(3)
+        ]
+
+    def assertRollupsReconciled(self):
+        self.assertEqual(rollups.reconcile(), (0, 0))
+
+    def test_signals_keep_rollups_in_sync(self):
+        course = create_course(self.owner, self.series, modules=2, items=2)
+        course.students.add(*self.students)
+        self.students[0].courses_joined.remove(course)
+        course.modules.first().delete()
+        self.assertRollupsReconciled()
+
+        stats = CourseDailyStats.objects.get(course_id=course.id)
+        self.assertEqual((stats.new_students, stats.left_students), (3, 1))
+        self.assertEqual((stats.students, stats.modules), (2, 1))
+        self.assertEqual((stats.texts, stats.videos), (2, 2))
+
+        course.students.clear()
+        self.assertRollupsReconciled()
+        course.delete()
+        self.assertFalse(CourseDailyStats.objects.exists())
+
+    def test_dashboard_does_not_depend_on_course_count(self):
+        self.client.force_login(self.owner)
+        counts = []
+        for _ in range(2):
+            course = create_course(self.owner, self.series, modules=2)
+            course.students.add(*self.students)
+            cache.clear()
+            response = self.client.get(reverse("courses:course_dashboard"))
+            self.assertEqual(response.status_code, 200)
+            counts.append(self.assertWithinBudget(response).count)
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(response.context["week"]["new_students"], 6)
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        cls.student = User.objects.create_user("student", "s@example.com")
+        cls.soil = Series.objects.create(title="Soil", slug="soil")
+        cls.water = Series.objects.create(title="Water", slug="water")
+
+    def assertCounters(self, obj, **expected):
+        obj.refresh_from_db()
+        for field, n in expected.items():
+            self.assertEqual(getattr(obj, field), n, field)
+
+    def test_signals_keep_counters_in_sync(self):
+        course = create_course(self.owner, self.soil, modules=2, items=2)
+        self.assertCounters(self.soil, course_count=1)
+        self.assertCounters(course, module_count=2, student_count=0)
+        self.assertCounters(course.modules.first(), content_count=4)
+
+        course.students.add(self.student)
+        self.student.courses_joined.add(
+            create_course(self.owner, self.soil)
+        )
+        course.modules.first().contents.first().delete()
+        course.modules.last().delete()
+        course.series = self.water
+        course.save()
+        self.assertCounters(self.soil, course_count=1)
+        self.assertCounters(self.water, course_count=1)
+        self.assertCounters(course, module_count=1, student_count=1)
+        self.assertCounters(course.modules.first(), content_count=3)
+
+        self.student.courses_joined.clear()
+        self.assertCounters(course, student_count=0)
+        self.assertFalse(any(counters.recount().values()))
+
+    def test_drifted_counters_stop_at_zero(self):
+        course = create_course(self.owner, self.soil, modules=2)
+        course.students.add(self.student)
+        Course.objects.update(module_count=0, student_count=0)
+        course.students.remove(self.student)
+        course.modules.first().delete()
+        self.assertCounters(course, module_count=0, student_count=0)
+        self.assertEqual(counters.recount()["course.module_count"], 1)
+        self.assertCounters(course, module_count=1)
+
+    def test_removing_students_that_are_not_enrolled(self):
+        course = create_course(self.owner, self.soil)
+        other = User.objects.create_user("other", "o@example.com")
+        course.students.add(self.student)
+        course.students.remove(self.student, other)
+        other.courses_joined.remove(course)
+        self.assertCounters(course, student_count=0)
+        stats = CourseDailyStats.objects.get(course_id=course.id)
+        self.assertEqual((stats.students, stats.left_students), (0, 1))
+        self.assertFalse(any(counters.recount().values()))
+
+    def test_saving_a_stale_instance_keeps_the_counters(self):
+        course = create_course(self.owner, self.soil)
+        stale = Course.objects.get(pk=course.pk)
+        course.students.add(self.student)
+        stale.title = "Crops"
+        stale.save()
+        self.assertCounters(course, title="Crops", student_count=1)
+
+    def test_recount_repairs_drift(self):
+        course = create_course(self.owner, self.soil, modules=2)
+        Course.objects.filter(pk=course.pk).update(module_count=7)
+        self.assertEqual(counters.recount()["course.module_count"], 1)
+        self.assertCounters(course, module_count=2)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        cls.series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(cls.owner, cls.series, modules=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, view, user=None, **kwargs):
+        request = AsyncRequestFactory().get("/")
+        request.user = user or AnonymousUser()
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_course_list_renders_like_the_sync_view(self):
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        expected = views.CourseListView.as_view()(request, subject="soil")
+        response = self.get(async_views.course_list, subject="soil")
+        self.assertEqual(response.content, expected.render().content)
+
+    def test_course_detail(self):
+        response = self.get(
+            async_views.course_detail, self.owner, slug=self.course.slug
+        )
+        self.assertContains(response, self.course.title)
+        self.assertContains(response, "2 modules")
+
+    def test_api_course_contents(self):
+        response = self.get(api_async_views.course_contents, pk=self.course.pk)
+        self.assertEqual(len(response.data["modules"]), 2)
+
+    def test_course_list_answers_not_modified(self):
+        etag = self.get(async_views.course_list)["ETag"]
+        request = AsyncRequestFactory().get("/", **{"If-None-Match": etag})
+        request.user = AnonymousUser()
+        response = async_to_sync(async_views.course_list)(request)
+        self.assertEqual(response.status_code, 304)
+
+
+async def count_courses(request):
+    """Async view for the middleware tests, whose query runs in the thread
+    of sync_to_async"""
+    request.threads = {"view": threading.get_ident()}
+
+    def count():
+        request.threads["query"] = threading.get_ident()
+        return Course.objects.count()
+
+    return HttpResponse(str(await sync_to_async(count)()))
+
+
+urlpatterns = [path("count/", count_courses, name="count_courses")]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class QueryBudgetAsyncTests(TestCase):
+    async def get(self):
+        threads = []
+        record = QueryStats.record
+
+        def record_in_thread(stats):
+            threads.append(threading.get_ident())
+            return record(stats)
+
+        with mock.patch.object(QueryStats, "record", record_in_thread):
+            response = await self.async_client.get("/count/")
+        return response, threads
+
+    async def test_queries_of_async_views_are_counted(self):
+        response, threads = await self.get()
+        self.assertEqual(response.content, b"0")
+        self.assertEqual(response.asgi_request.query_stats.count, 1)
+        # the hooks share the thread of the view's sync_to_async calls, and
+        # the view itself runs on the event loop of the client
+        view_threads = response.asgi_request.threads
+        self.assertEqual(threads, [view_threads["query"]])
+        self.assertEqual(view_threads["view"], threading.get_ident())
+        self.assertNotEqual(view_threads["view"], view_threads["query"])
+
+    @override_settings(QUERY_BUDGETS={"count_courses": 0})
+    async def test_budgets_apply_to_async_views(self):
+        with self.assertLogs("academy.middleware", "WARNING") as logs:
+            await self.async_client.get("/count/")
+        self.assertIn("count_courses over budget: 1 queries", logs.output[0])
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        cls.series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(cls.owner, cls.series)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.owner)
+
+    def assertNotModified(self, url):
+        # the first response sets the CSRF cookie the page depends on
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+        return response
+
+    def test_pages_change_with_the_course(self):
+        urls = [
+            reverse("courses:course_list"),
+            reverse("courses:course_list_series", args=["soil"]),
+            reverse("courses:course_detail", args=[self.course.slug]),
+            reverse("api:course-list"),
+            reverse("api:course-detail", args=[self.course.id]),
+            reverse("api:course-contents", args=[self.course.id]),
+        ]
+        etags = {url: self.assertNotModified(url)["ETag"] for url in urls}
+
+        Module.objects.create(course=self.course, title="Harvest")
+        for url, etag in etags.items():
+            with self.subTest(url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], etag)
+
+    def test_contents_are_dated_by_the_journal(self):
+        url = reverse("api:course-contents", args=[self.course.id])
+        last_modified = self.assertNotModified(url)["Last-Modified"]
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        text = Text.objects.get()
+        etag = self.client.get(url)["ETag"]
+        text.content = "Cover crops"
+        text.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Cover crops")
+
+    def test_course_page_changes_with_the_owner_and_hero_image(self):
+        url = reverse("courses:course_detail", args=[self.course.slug])
+        etag = self.assertNotModified(url)["ETag"]
+        self.owner.first_name = "Ada"
+        self.owner.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Ada")
+
+        etag = response["ETag"]
+        self.owner.save(update_fields=["last_login"])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.course.hero_image = "courses/field.jpg"
+        with mock.patch.object(images, "generate_variants", return_value=2):
+            images._render_scheduled(self.course.hero_image)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_users_get_their_own_etags(self):
+        url = reverse("courses:course_detail", args=[self.course.slug])
+        etag = self.assertNotModified(url)["ETag"]
+        student = User.objects.create_user("student", "s@example.com")
+        self.client.force_login(student)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_PIN_SECONDS=30)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        # writes of the test data pin the context of the test runner
+        routers.pinned.set(False)
+        routers.wrote.set(False)
+        self.addCleanup(routers.pinned.set, False)
+        self.addCleanup(routers.wrote.set, False)
+
+    def test_reads_go_to_replicas_until_a_write(self):
+        self.assertEqual(self.router.db_for_read(Course), "replica")
+        self.assertEqual(self.router.db_for_read(User), "default")
+        with routers.primary():
+            self.assertEqual(self.router.db_for_read(Course), "default")
+        self.assertEqual(self.router.db_for_read(Course), "replica")
+
+        self.assertEqual(self.router.db_for_write(Module), "default")
+        self.assertEqual(self.router.db_for_read(Course), "default")
+
+    def test_writing_clients_are_pinned_to_the_primary(self):
+        def view(request):
+            if request.method == "POST":
+                self.router.db_for_write(Content)
+            return HttpResponse(self.router.db_for_read(Course))
+
+        middleware = ReplicaPinMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.post("/"))
+        cookie = response.cookies[routers.PIN_COOKIE]
+        self.assertEqual(cookie["max-age"], 30)
+
+        factory.cookies[routers.PIN_COOKIE] = cookie.value
+        self.assertEqual(middleware(factory.get("/")).content, b"default")
+        factory.cookies[routers.PIN_COOKIE] = "forged"
+        self.assertEqual(middleware(factory.get("/")).content, b"replica")
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TwoTierCache(
+            self.id(), {"OPTIONS": {"LOCAL_PREFIXES": ["catalog:data:"]}}
+        )
+        caches["shared"].clear()
+        self.addCleanup(caches["shared"].clear)
+
+    def test_local_tier_is_bounded(self):
+        local = LocalCache(max_entries=2, timeout=60)
+        for key in "abc":
+            local.set(key, key)
+        self.assertEqual(list(local.entries), ["b", "c"])
+        local.timeout = -1
+        local.set("d", "d")
+        self.assertIsNot(local.get("d"), "d")
+
+    def test_only_local_prefixes_are_kept_locally(self):
+        self.cache.set("catalog:data:courses:1", ["course"])
+        self.cache.set("enrolled:1", [1])
+        caches["shared"].clear()
+        self.assertEqual(self.cache.get("catalog:data:courses:1"), ["course"])
+        self.assertIsNone(self.cache.get("enrolled:1"))
+        self.assertEqual(
+            self.cache.stats(), {"local_hits": 1, "misses": 1}
+        )
+
+    def test_mutable_keys_are_not_kept_locally(self):
+        options = settings.CACHES["default"]["OPTIONS"]
+        two_tier = TwoTierCache(self.id(), {"OPTIONS": options})
+        now = timezone.now()
+        local = [
+            catalog.series_key(1),
+            catalog.courses_key(1),
+            render_cache_key(Text(pk=1, updated=now)),
+        ]
+        shared = [
+            catalog.series_key(),
+            catalog.courses_key(),
+            catalog.courses_key(series=Series(pk=1)),
+            # fragments of images change once their variants are rendered
+            render_cache_key(Image(pk=1, updated=now)),
+        ]
+        for key in local:
+            self.assertTrue(two_tier.is_local(key), key)
+        for key in shared:
+            self.assertFalse(two_tier.is_local(key), key)
+
+    def test_stale_value_is_served_while_another_process_recomputes(self):
+        self.cache.get_or_set(
+            "catalog:data:courses:1", lambda: ["old"], stale_key="latest"
+        )
+        caches["shared"].add("catalog:data:courses:2:recompute", 1)
+
+        def build():
+            raise AssertionError("recomputed without the lock")
+
+        value = self.cache.get_or_set(
+            "catalog:data:courses:2", build, stale_key="latest"
+        )
+        self.assertEqual(value, ["old"])
+        self.assertEqual(self.cache.stats()["stale"], 1)
+
+        caches["shared"].delete("catalog:data:courses:2:recompute")
+        value = self.cache.get_or_set(
+            "catalog:data:courses:2", lambda: ["new"], stale_key="latest"
+        )
+        self.assertEqual(value, ["new"])
+        self.assertEqual(self.cache.get("latest"), ["new"])
+
+    def test_expiring_values_are_recomputed_by_one_caller(self):
+        self.cache.set("key", Envelope("fresh", time.time() + 60, 0.01))
+        self.assertEqual(self.cache.get_or_set("key", lambda: "new"), "fresh")
+
+        self.cache.set("key", Envelope("expired", time.time() - 1, 0.01))
+        self.assertIsNone(self.cache.get("key"))
+        caches["shared"].add("key:recompute", 1)
+        self.assertEqual(self.cache.get_or_set("key", "new"), "expired")
+        caches["shared"].delete("key:recompute")
+        self.assertEqual(self.cache.get_or_set("key", "new", 60), "new")
+        self.assertEqual(self.cache.get("key"), "new")
@@ -0,0 +1,124 @@
+"""Storage side of chunked, resumable uploads.
+
+The protocol follows tus: an upload is created with its final size, chunks
+are appended with PATCH requests carrying the ``Upload-Offset`` they start
+at, and ``HEAD`` reports the offset to resume from after a disconnect.
+Chunks are streamed from the request straight into a partial file under
+CHUNKED_UPLOAD_ROOT and never held in memory.
+"""
+import base64
+import fcntl
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+CHUNKED_UPLOAD_ROOT = getattr(
+    settings,
+    "CHUNKED_UPLOAD_ROOT",
+    os.path.join(settings.BASE_DIR, "uploads"),
+)
+CHUNKED_UPLOAD_MAX_SIZE = getattr(
+    settings, "CHUNKED_UPLOAD_MAX_SIZE", 2 * 1024**3
+)
+CHUNKED_UPLOAD_MAX_CHUNK = getattr(
+    settings, "CHUNKED_UPLOAD_MAX_CHUNK", 16 * 1024**2
+)
+BLOCK_SIZE = 64 * 1024
+
+CHECKSUM_ALGORITHMS = {"sha1": hashlib.sha1, "sha256": hashlib.sha256}
+
+
+class ChunkError(Exception):
+    """The chunk was rejected. ``status`` is the HTTP status to reply with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def partial_path(upload):
+    return os.path.join(CHUNKED_UPLOAD_ROOT, f"{upload.id}.part")
+
+
+def start(upload):
+    os.makedirs(CHUNKED_UPLOAD_ROOT, exist_ok=True)
+    open(partial_path(upload), "wb").close()
+
+
+def discard(upload):
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def parse_checksum(header):
+    """Parse an ``Upload-Checksum: <algorithm> <base64 digest>`` header"""
+    if not header:
+        return None
+    algorithm, _, digest = header.partition(" ")
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ChunkError("Unsupported checksum algorithm")
+    try:
+        return algorithm, base64.b64decode(digest, validate=True)
+    except ValueError:
+        raise ChunkError("Malformed checksum")
+
+
+def append_chunk(upload, stream, offset, length, checksum=None):
+    """Append ``length`` bytes read from stream to the upload's partial file
+    and return the new offset.
+
+    The chunk must start at the current offset. Without a checksum the bytes
+    that arrived before a disconnect are kept, so the client can resume from
+    there; with one, a chunk that is incomplete or does not match is dropped.
+    """
+    if offset != upload.offset:
+        raise ChunkError("Upload-Offset does not match", status=409)
+    if length > CHUNKED_UPLOAD_MAX_CHUNK:
+        raise ChunkError("Chunk too large", status=413)
+    if offset + length > upload.size:
+        raise ChunkError("Chunk exceeds the upload size", status=413)
+    expected = parse_checksum(checksum)
+    digest = CHECKSUM_ALGORITHMS[expected[0]]() if expected else None
+
+    with open(partial_path(upload), "r+b") as part:
+        try:
+            # one writer per upload, across threads and processes
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ChunkError("Another chunk is being written", status=409)
+        part.seek(offset)
+        part.truncate()
+        received = 0
+        while received < length:
+            block = stream.read(min(BLOCK_SIZE, length - received))
+            if not block:
+                break
+            part.write(block)
+            if digest:
+                digest.update(block)
+            received += len(block)
+
+        if digest and (received != length or digest.digest() != expected[1]):
+            part.truncate(offset)
+            # 460 Checksum Mismatch, as defined by the tus protocol
+            raise ChunkError("Checksum mismatch", status=460)
+    return offset + received
+
+
+class PartialUpload(UploadedFile):
+    """A finished partial file, handed to a model form like a regular
+    upload. Storage moves it into place instead of copying it."""
+
+    def __init__(self, upload):
+        super().__init__(
+            file=open(partial_path(upload), "rb"),
+            name=upload.filename,
+            size=upload.size,
+        )
+
+    def temporary_file_path(self):
+        return self.file.name
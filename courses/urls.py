@@ -1,20 +1,35 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+course_list = views.CourseListView.as_view()
+course_detail = views.CourseDetailView.as_view()
+if settings.ASYNC_VIEWS:
+    course_list = async_views.course_list
+    course_detail = async_views.course_detail
 
 app_name = "courses"
 urlpatterns = [
-    path("", views.CourseListView.as_view(), name="course_list"),
+    path("", course_list, name="course_list"),
     path(
         "mine/",
         views.ManageCourseList.as_view(),
         name="manage_course_list",
     ),
+    path(
+        "mine/dashboard/",
+        views.CourseDashboardView.as_view(),
+        name="course_dashboard",
+    ),
     path("create/", views.CourseCreateView.as_view(), name="course_create"),
     path("<pk>/edit/", views.CourseUpdateView.as_view(), name="course_edit"),
     path(
         "<pk>/delete/", views.CourseDeleteView.as_view(), name="course_delete"
     ),
+    path(
+        "<pk>/export/", views.CourseExportView.as_view(), name="course_export"
+    ),
     path(
         "<pk>/module",
         views.CourseModuleUpdateView.as_view(),
@@ -25,16 +40,36 @@ urlpatterns = [
         views.ContentCreateUpdateView.as_view(),
         name="module_content_create",
     ),
+    path(
+        "module/<int:module_id>/content/<model_name>/upload/",
+        views.UploadCreateView.as_view(),
+        name="module_content_upload",
+    ),
     path(
         "module/<int:module_id>/content/<model_name>/<id>/",
         views.ContentCreateUpdateView.as_view(),
         name="module_content_update",
     ),
+    path(
+        "upload/<uuid:id>/",
+        views.UploadView.as_view(),
+        name="content_upload",
+    ),
+    path(
+        "upload/<uuid:id>/finalize/",
+        views.UploadFinalizeView.as_view(),
+        name="content_upload_finalize",
+    ),
     path(
         "content/<int:id>/delete/",
         views.ContentDeleteView.as_view(),
         name="module_content_delete",
     ),
+    path(
+        "content/file/<int:id>/download/",
+        views.FileDownloadView.as_view(),
+        name="file_download",
+    ),
     path(
         "module/<int:module_id>/",
         views.ModuleContentListView.as_view(),
@@ -51,11 +86,10 @@ urlpatterns = [
     # Display all courses for a series
     path(
         "series/<slug:subject>",
-        views.CourseListView.as_view(),
+        course_list,
         name="course_list_series",
     ),
+    path("search/", views.CourseSearchView.as_view(), name="course_search"),
     # display a single course overview
-    path(
-        "<slug:slug>/", views.CourseDetailView.as_view(), name="course_detail"
-    ),
+    path("<slug:slug>/", course_detail, name="course_detail"),
 ]
@@ -1,24 +1,45 @@
+import hashlib
+import json
+import os
+
 from braces.views import CsrfExemptMixin, JsonRequestResponseMixin
 from django.apps import apps
 from django.contrib.auth.mixins import (
     LoginRequiredMixin,
     PermissionRequiredMixin,
 )
-from django.core.cache import cache
-from django.db.models import Count
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import transaction
 from django.forms.models import modelform_factory
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
 from django.views.generic.base import TemplateResponseMixin, View
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django.views.generic.list import ListView
+from students.enrollment import is_enrolled
 from students.forms import CourseEnrollForm
 
 from courses.models import Course
 
+from . import catalog, conditional, rollups, sync, uploads
+from .downloads import serve_file
+from .export import Package
 from .forms import ModuleInlineFormSet
-from .models import Content, Module, Series
+from .models import Content, File, Module, SearchDocument, Series, Upload
+from .search import search
 
 
 class OwnerMixin(object):
@@ -62,6 +83,31 @@ class ManageCourseList(OwnerCourseMixin, ListView):
     context_object_name = "my_courses"
 
 
+class CourseDashboardView(OwnerCourseMixin, ListView):
+    """Enrollments, size and recent activity of the courses of the current
+    user, read from the daily rollups only"""
+
+    template_name = "courses/manage/course/dashboard.html"
+    permission_required = "courses.view_course"
+
+    def get_queryset(self):
+        return super().get_queryset().only("id", "title").order_by("title")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        courses = context["object_list"]
+        latest, daily = rollups.dashboard([course.id for course in courses])
+        context["courses"] = [
+            (course, latest.get(course.id)) for course in courses
+        ]
+        context["daily"] = daily
+        context["week"] = {
+            field: sum(day[field] for day in daily[-7:])
+            for field in ("new_students", "left_students")
+        }
+        return context
+
+
 class CourseCreateView(OwnerCourseEditMixin, CreateView):
     permission_required = "courses.add_course"
 
@@ -108,13 +154,8 @@ class CourseModuleUpdateView(LoginRequiredMixin, TemplateResponseMixin, View):
         )
 
 
-# Adding content to course modules.
-# There are four different content types.
-class ContentCreateUpdateView(LoginRequiredMixin, TemplateResponseMixin, View):
-    module = None
-    model = None
-    obj = None
-    template_name: str = "courses/manage/content/form.html"
+class ContentFormMixin(object):
+    """Build the model form used to create or update a content item"""
 
     def get_model(self, model_name):
         if model_name in ["text", "video", "image", "file"]:
@@ -128,6 +169,17 @@ class ContentCreateUpdateView(LoginRequiredMixin, TemplateResponseMixin, View):
         )
         return Form(*args, **kwargs)
 
+
+# Adding content to course modules.
+# There are four different content types.
+class ContentCreateUpdateView(
+    ContentFormMixin, LoginRequiredMixin, TemplateResponseMixin, View
+):
+    module = None
+    model = None
+    obj = None
+    template_name: str = "courses/manage/content/form.html"
+
     def dispatch(self, request, module_id, model_name, id=None):
 
         self.module = get_object_or_404(
@@ -165,6 +217,137 @@ class ContentCreateUpdateView(LoginRequiredMixin, TemplateResponseMixin, View):
         return self.render_to_response({"form": form, "object": self.obj})
 
 
+# Chunked uploads of large File and Image content, see courses.uploads
+
+
+class UploadCreateView(LoginRequiredMixin, View):
+    """Start an upload: ``{"title", "filename", "size"}`` as JSON"""
+
+    def post(self, request, module_id, model_name):
+        module = get_object_or_404(
+            Module, id=module_id, course__owner=request.user
+        )
+        try:
+            data = json.loads(request.body)
+            upload = Upload(
+                owner=request.user,
+                module=module,
+                model_name=model_name,
+                title=data["title"],
+                filename=os.path.basename(data["filename"]),
+                size=int(data["size"]),
+            )
+            upload.full_clean()
+        except (ValueError, KeyError, TypeError, ValidationError):
+            return JsonResponse({"errors": ["Invalid upload"]}, status=400)
+        if upload.size > uploads.CHUNKED_UPLOAD_MAX_SIZE:
+            return JsonResponse({"errors": ["File too large"]}, status=413)
+
+        upload.save()
+        uploads.start(upload)
+        location = reverse("courses:content_upload", args=[upload.id])
+        response = JsonResponse(
+            {"id": upload.id, "offset": 0, "url": location}, status=201
+        )
+        response["Location"] = location
+        return response
+
+
+class UploadView(LoginRequiredMixin, View):
+    """HEAD reports the offset to resume from, PATCH appends a chunk that
+    starts at ``Upload-Offset`` and DELETE cancels the upload."""
+
+    def dispatch(self, request, id):
+        self.upload = get_object_or_404(Upload, id=id, owner=request.user)
+        return super().dispatch(request, id)
+
+    def offset_response(self, status=204):
+        response = HttpResponse(status=status)
+        response["Upload-Offset"] = self.upload.offset
+        response["Upload-Length"] = self.upload.size
+        response["Cache-Control"] = "no-store"
+        return response
+
+    def head(self, request, id):
+        return self.offset_response(status=200)
+
+    def patch(self, request, id):
+        values = {}
+        for header in ("Upload-Offset", "Content-Length"):
+            value = request.headers.get(header)
+            if not value:
+                return HttpResponseBadRequest(f"{header} required")
+            if not (value.isascii() and value.isdigit()):
+                return HttpResponseBadRequest(f"Invalid {header}")
+            values[header] = int(value)
+        try:
+            new_offset = uploads.append_chunk(
+                self.upload,
+                request,
+                values["Upload-Offset"],
+                values["Content-Length"],
+                request.headers.get("Upload-Checksum"),
+            )
+        except uploads.ChunkError as error:
+            response = self.offset_response(status=error.status)
+            response.content = str(error)
+            if error.status == 460:
+                response.reason_phrase = "Checksum Mismatch"
+            return response
+
+        # update() skips auto_now, and purge_uploads goes by ``updated``
+        Upload.objects.filter(id=self.upload.id).update(
+            offset=new_offset, updated=timezone.now()
+        )
+        self.upload.offset = new_offset
+        return self.offset_response()
+
+    def delete(self, request, id):
+        uploads.discard(self.upload)
+        self.upload.delete()
+        return HttpResponse(status=204)
+
+
+class UploadFinalizeView(ContentFormMixin, LoginRequiredMixin, View):
+    """Turn a complete upload into its item and Content row, the same way
+    ContentCreateUpdateView does for a form upload"""
+
+    def post(self, request, id):
+        upload = get_object_or_404(Upload, id=id, owner=request.user)
+        if upload.offset != upload.size:
+            return JsonResponse(
+                {"errors": ["Upload incomplete"], "offset": upload.offset},
+                status=409,
+            )
+
+        model = self.get_model(upload.model_name)
+        field = "module_image" if upload.model_name == "image" else "file"
+        with uploads.PartialUpload(upload) as upload_file:
+            form = self.get_form(
+                model,
+                data={"title": upload.title},
+                files={field: upload_file},
+            )
+            if not form.is_valid():
+                return JsonResponse({"errors": form.errors}, status=400)
+            obj = form.save(commit=False)
+            obj.creator = request.user
+            obj.save()
+
+        Content.objects.create(module=upload.module, item=obj)
+        uploads.discard(upload)
+        upload.delete()
+        return JsonResponse(
+            {
+                "id": obj.id,
+                "url": reverse(
+                    "courses:module_content_list", args=[upload.module_id]
+                ),
+            },
+            status=201,
+        )
+
+
 class ContentDeleteView(View):
     def post(self, request, id):
         content = get_object_or_404(
@@ -177,6 +360,59 @@ class ContentDeleteView(View):
         return redirect("courses:module_content_list", module.id)
 
 
+class FileDownloadView(LoginRequiredMixin, View):
+    """Stream a File item to its creator, the course owner or an enrolled
+    student. Supports resuming through HTTP range requests."""
+
+    def get(self, request, id):
+        item = get_object_or_404(File, id=id)
+        placements = Content.objects.filter(
+            content_type=ContentType.objects.get_for_model(File),
+            object_id=item.id,
+        ).values_list("module__course_id", "module__course__owner_id")
+        allowed = item.creator_id == request.user.id or any(
+            owner_id == request.user.id or is_enrolled(request.user, course_id)
+            for course_id, owner_id in placements
+        )
+        if not allowed:
+            raise Http404
+        return serve_file(request, item)
+
+
+class CourseExportView(LoginRequiredMixin, View):
+    """Offline package of a course for its owner and enrolled students.
+    ``?since=<version>`` returns a delta pack against an earlier package."""
+
+    def get(self, request, pk):
+        course = get_object_or_404(Course.objects.with_contents(), pk=pk)
+        if course.owner_id != request.user.id and not is_enrolled(
+            request.user, course.id
+        ):
+            raise Http404
+
+        package = Package(course, since=request.GET.get("since"))
+        etag = f'"{package.base or ""}{package.version}"'
+        if etag in request.headers.get("If-None-Match", ""):
+            response = HttpResponseNotModified()
+        elif package.is_cached():
+            package.touch()
+            response = FileResponse(
+                open(package.path, "rb"),
+                as_attachment=True,
+                filename=package.filename,
+            )
+        else:
+            response = StreamingHttpResponse(
+                package.stream_to_cache(), content_type="application/zip"
+            )
+            response["Content-Disposition"] = (
+                f'attachment; filename="{package.filename}"'
+            )
+        response["ETag"] = etag
+        response["X-Package-Version"] = package.version
+        return response
+
+
 class ModuleContentListView(LoginRequiredMixin, TemplateResponseMixin, View):
     template_name = "courses/manage/module/content_list.html"
 
@@ -185,34 +421,120 @@ class ModuleContentListView(LoginRequiredMixin, TemplateResponseMixin, View):
             Module, id=module_id, course__owner=request.user
         )
 
-        return self.render_to_response({"module": module})
+        # order keys are sparse, so number the modules by their position
+        modules = list(module.course.modules.all())
+        contents = list(module.contents.with_items())
+        return self.render_to_response(
+            {
+                "module": module,
+                "modules": modules,
+                "module_number": modules.index(module) + 1,
+                "modules_version": order_version(modules),
+                "contents": contents,
+                "contents_version": order_version(contents),
+            }
+        )
+
+
+def order_version(rows):
+    """Token identifying the current order of rows, used by the reorder
+    views to reject orderings computed from a stale page"""
+    state = ",".join(f"{row.pk}:{row.order}" for row in rows)
+    return hashlib.sha1(state.encode()).hexdigest()[:16]
 
 
 # You need a view that recieves the new order of module IDs
 # encoded in JSON
 
 
-class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
-    """Module that orders the course module"""
+class BulkOrderMixin(CsrfExemptMixin, JsonRequestResponseMixin):
+    """Apply a new order to all children of one parent at once.
+
+    Expects ``{"order": [id, ...], "version": token}`` listing every child of
+    the parent, with the ``order_version()`` of the order it was computed
+    from. Orders computed from a stale page are rejected with 409 and the
+    current order and version.
+    """
+
+    model = None
+    parent_field = None
+    owner_lookup = None
+    course_lookup = None
+
+    def get_ordering(self):
+        payload = self.request_json
+        if not isinstance(payload, dict) or not payload.get("version"):
+            raise ValueError
+        return [int(id) for id in payload["order"]], payload["version"]
 
     def post(self, request):
-        for id, order in self.request_json.items():
-            Module.objects.filter(id=id, course__owner=request.user).update(
-                order=order
+        try:
+            ids, version = self.get_ordering()
+        except (KeyError, TypeError, ValueError):
+            return self.render_bad_request_response()
+        if not ids:
+            return self.render_bad_request_response()
+
+        parent = self.model._meta.get_field(self.parent_field).attname
+        with transaction.atomic():
+            # the ownership check is done once, for the parent
+            parent_ids = (
+                self.model.objects.filter(
+                    id=ids[0], **{self.owner_lookup: request.user}
+                )
+                .values_list(parent, self.course_lookup)
+                .first()
             )
-        return self.render_json_response({"saved": "OK"})
+            if parent_ids is None:
+                return self.render_bad_request_response()
+            parent_id, course_id = parent_ids
+            rows = list(
+                self.model.objects.select_for_update()
+                .filter(**{parent: parent_id})
+                .order_by("order")
+                .only("id", "order")
+            )
+            current = {row.id: row for row in rows}
+            if version != order_version(rows):
+                return self.render_json_response(
+                    {
+                        "saved": False,
+                        "order": list(current),
+                        "version": order_version(rows),
+                    },
+                    status=409,
+                )
+            if sorted(ids) != sorted(current):
+                return self.render_bad_request_response()
+
+            rows = [current[id] for id in ids]
+            field = self.model._meta.get_field("order")
+            changed = field.reorder(rows)
+            self.model.objects.bulk_update(changed, ["order"])
+            # bulk_update sends no signals
+            sync.record(changed, [course_id])
+
+        return self.render_json_response(
+            {"saved": "OK", "order": ids, "version": order_version(rows)}
+        )
 
 
-class ContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
-    """View to order module content"""
+class ModuleOrderView(BulkOrderMixin, View):
+    """Module that orders the course module"""
+
+    model = Module
+    parent_field = "course"
+    owner_lookup = "course__owner"
+    course_lookup = "course_id"
 
-    def post(self, request):
-        for id, order in self.request_json.items():
 
-            Content.objects.filter(
-                id=id, module__course__owner=request.user
-            ).update(order=order)
-        return self.render_json_response({"saved": "OK"})
+class ContentOrderView(BulkOrderMixin, View):
+    """View to order module content"""
+
+    model = Content
+    parent_field = "module"
+    owner_lookup = "module__course__owner"
+    course_lookup = "module__course_id"
 
 
 # Creating public views for displaying course information
@@ -227,42 +549,61 @@ class CourseListView(TemplateResponseMixin, View):
     template_name = "courses/course/list.html"
 
     def get(self, request, subject=None):
-        # retrieve all series, including the total number of courses for each series
-
-        # series = Series.objects.annotate(total_courses=Count("courses"))
+        return conditional.respond(
+            request,
+            (conditional.catalog_etag(request, subject), None),
+            lambda: self.render_list(subject),
+        )
 
-        series = cache.get("all_series")
-        if not series:
-            series = Series.objects.annotate(total_courses=Count("courses"))
-            cache.set("all_series", series)
+    def render_list(self, subject):
+        # retrieve all series, including the total number of courses for each series
+        series = catalog.get_series()
 
         # retrieve all courses, including the total number of modules contained in each course
-        all_courses = Course.objects.annotate(total_modules=Count("modules"))
-
         if subject:
             subject = get_object_or_404(Series, slug=subject)
-
-            key = f"subject_{subject.id}_courses"
-            courses = cache.get(key)
-
-            if not courses:
-                courses = all_courses.filter(series=subject)
-                cache.set(key, courses)
+            courses = catalog.get_courses(subject)
         else:
-            courses = cache.get("all_courses")
-            if not courses:
-                courses = all_courses
-                cache.set("all_courses", courses)
+            courses = catalog.get_courses()
 
         return self.render_to_response(
             {"series": series, "subject": subject, "courses": courses}
         )
 
 
+class CourseSearchView(TemplateResponseMixin, View):
+    """Search courses, modules and texts, best matches first"""
+
+    template_name = "courses/course/search.html"
+    paginate_by = 20
+
+    def get(self, request):
+        query = request.GET.get("q", "").strip()
+        results = search(query) if query else SearchDocument.objects.none()
+        page = Paginator(results, self.paginate_by).get_page(
+            request.GET.get("page")
+        )
+        return self.render_to_response({"query": query, "page": page})
+
+
 class CourseDetailView(DetailView):
     model = Course
+    queryset = Course.objects.select_related("series", "owner")
     template_name = "courses/course/detail.html"
 
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        etag = conditional.course_etag(
+            request, self.object.id, series_id=self.object.series_id
+        )
+        return conditional.respond(
+            request,
+            (etag, None),
+            lambda: self.render_to_response(
+                self.get_context_data(object=self.object)
+            ),
+        )
+
     def get_context_data(self, **kwargs):
         """Used to populate a dictionary to use as a template context"""
         context = super().get_context_data(**kwargs)
@@ -0,0 +1,37 @@
+"""Async version of the student course page, see courses.async_views"""
+from asgiref.sync import sync_to_async
+from courses import conditional
+from courses.async_views import arender, load_user
+from courses.models import Course
+from django.http import Http404
+
+from .enrollment import aenrolled_course_ids
+from .progress import course_progress
+from .views import course_context, course_validators
+
+
+async def course_detail(request, pk, module_id=None):
+    user = await load_user(request)
+    if int(pk) not in await aenrolled_course_ids(user):
+        raise Http404("No course found matching the query")
+
+    def load():
+        course = Course.objects.filter(pk=pk).first()
+        if course is None:
+            raise Http404("No course found matching the query")
+        progress = course_progress(user, course.id)
+        return course, progress, course_validators(request, course, progress)
+
+    course, progress, validators = await sync_to_async(load)()
+    response = conditional.not_modified(request, *validators)
+    if response is not None:
+        return response
+    context = await sync_to_async(course_context)(
+        user, course, module_id, progress
+    )
+    response = await arender(
+        request,
+        "students/course/detail.html",
+        {"object": course, "course": course} | context,
+    )
+    return conditional.add_validators(response, *validators)
@@ -0,0 +1,141 @@
+"""Enrollment of whole cohorts of students into a course.
+
+Identifiers (usernames or emails) are read from a stream one row at a time
+and resolved in chunks, so memory use does not depend on the cohort size.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from courses.models import Course
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed
+
+User = get_user_model()
+
+CHUNK_SIZE = 1000
+ENROLL_RETRIES = 3
+
+ENROLLED = "enrolled"
+ALREADY_ENROLLED = "already_enrolled"
+NOT_FOUND = "not_found"
+INVALID = "invalid"
+
+FORMATS = ("csv", "jsonl")
+
+
+def read_identifiers(stream, format="csv"):
+    """Yield ``(line, identifier)`` pairs from a CSV or JSON Lines stream.
+
+    CSV rows hold the identifier in their first column; a ``username`` or
+    ``email`` header row is skipped. JSON lines are either a string or an
+    object with a ``username`` or ``email`` key. Unreadable rows yield None
+    as identifier.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown cohort format {format!r}")
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig")
+
+    if format == "csv":
+        for line, row in enumerate(csv.reader(stream), 1):
+            value = row[0].strip() if row else ""
+            if line == 1 and value.lower() in ("username", "email"):
+                continue
+            if value:
+                yield line, value
+        return
+
+    for line, raw in enumerate(stream, 1):
+        if not raw.strip():
+            continue
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = None
+        if isinstance(value, dict):
+            value = value.get("username") or value.get("email")
+        yield line, value.strip() if isinstance(value, str) else None
+
+
+def enroll_cohort(course, rows, chunk_size=CHUNK_SIZE):
+    """Enroll the users identified by rows into course.
+
+    Yields a result dict per row with its line, identifier and status.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from _enroll_chunk(course, chunk)
+
+
+def _enroll_chunk(course, chunk):
+    Enrollment = Course.students.through
+    identifiers = {value for _, value in chunk if value}
+    users = {}
+    for pk, username, email in User.objects.filter(
+        Q(username__in=identifiers) | Q(email__in=identifiers)
+    ).values_list("id", "username", "email"):
+        users.setdefault(username, pk)
+        if email:
+            users.setdefault(email, pk)
+
+    found = {users[value] for value in identifiers if value in users}
+    for attempt in range(ENROLL_RETRIES):
+        enrolled = _enrolled_ids(course, found)
+        new = found - enrolled
+        if not new:
+            break
+        try:
+            # without ignore_conflicts, so the signals count exactly the
+            # rows inserted here
+            with transaction.atomic():
+                _send_m2m_changed(course, "pre_add", new)
+                Enrollment.objects.bulk_create(
+                    [Enrollment(course_id=course.id, user_id=pk) for pk in new]
+                )
+                # bulk_create skips the signal course.students.add() sends
+                _send_m2m_changed(course, "post_add", new)
+            break
+        except IntegrityError:
+            # enrolled concurrently, read the enrollments again
+            if attempt == ENROLL_RETRIES - 1:
+                raise
+
+    for line, value in chunk:
+        if value is None:
+            status = INVALID
+        elif value not in users:
+            status = NOT_FOUND
+        elif users[value] in enrolled:
+            status = ALREADY_ENROLLED
+        else:
+            status = ENROLLED
+            # a user listed twice is only enrolled by the first row
+            enrolled.add(users[value])
+        yield {"line": line, "identifier": value, "status": status}
+
+
+def _enrolled_ids(course, user_ids):
+    return set(
+        Course.students.through.objects.filter(
+            course_id=course.id, user_id__in=user_ids
+        ).values_list("user_id", flat=True)
+    )
+
+
+def _send_m2m_changed(course, action, pk_set):
+    m2m_changed.send(
+        sender=Course.students.through,
+        instance=course,
+        action=action,
+        reverse=False,
+        model=User,
+        pk_set=set(pk_set),
+        using=course._state.db,
+    )
@@ -0,0 +1,70 @@
+"""Cached set of the courses each user is enrolled in.
+
+The ids are stored per user as a compact array and dropped whenever the
+user's enrollments change (see ``students.signals``), so most enrollment
+checks are answered without a database query.
+"""
+from array import array
+
+from academy.routers import primary
+from asgiref.sync import sync_to_async
+from courses.models import Course
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+ENROLLMENT_CACHE_TIMEOUT = getattr(
+    settings, "ENROLLMENT_CACHE_TIMEOUT", 60 * 60 * 24
+)
+
+
+def enrollment_key(user_id):
+    return f"enrollment:{user_id}"
+
+
+def load_course_ids(user_id):
+    # from the primary, the set is cached until the enrollments change
+    with primary():
+        return array(
+            "q",
+            sorted(
+                Course.students.through.objects.filter(
+                    user_id=user_id
+                ).values_list("course_id", flat=True)
+            ),
+        )
+
+
+def enrolled_course_ids(user):
+    """Ids of the courses user is enrolled in, as a frozenset"""
+    if not user.is_authenticated:
+        return frozenset()
+    key = enrollment_key(user.pk)
+    ids = cache.get(key)
+    if ids is None:
+        ids = load_course_ids(user.pk)
+        cache.set(key, ids, ENROLLMENT_CACHE_TIMEOUT)
+    return frozenset(ids)
+
+
+async def aenrolled_course_ids(user):
+    """enrolled_course_ids() for async views, user has to be loaded"""
+    if not user.is_authenticated:
+        return frozenset()
+    key = enrollment_key(user.pk)
+    ids = await cache.aget(key)
+    if ids is None:
+        ids = await sync_to_async(load_course_ids)(user.pk)
+        await cache.aset(key, ids, ENROLLMENT_CACHE_TIMEOUT)
+    return frozenset(ids)
+
+
+def is_enrolled(user, course_id):
+    return int(course_id) in enrolled_course_ids(user)
+
+
+def forget_enrollments(user_ids):
+    """Drop the cached sets of user_ids, once the change is committed"""
+    keys = [enrollment_key(pk) for pk in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
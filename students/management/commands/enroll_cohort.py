@@ -0,0 +1,49 @@
+import csv
+import sys
+from collections import Counter
+
+from courses.models import Course
+from django.core.management.base import BaseCommand, CommandError
+
+from students.cohort import FORMATS, enroll_cohort, read_identifiers
+
+
+class Command(BaseCommand):
+    help = (
+        "Enroll a cohort of students into a course from a CSV or JSON Lines "
+        "file of usernames or emails. Prints one result row per input row."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_id", type=int)
+        parser.add_argument("path", help="Cohort file, or - for stdin")
+        parser.add_argument("--format", choices=FORMATS)
+
+    def handle(self, *args, **options):
+        try:
+            course = Course.objects.get(pk=options["course_id"])
+        except Course.DoesNotExist:
+            raise CommandError(f"Course {options['course_id']} does not exist")
+
+        path = options["path"]
+        format = options["format"] or (
+            "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+        )
+        try:
+            stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e.strerror}")
+        totals = Counter()
+        writer = csv.writer(self.stdout, lineterminator="\n")
+        writer.writerow(["line", "identifier", "status"])
+        with stream:
+            for result in enroll_cohort(
+                course, read_identifiers(stream, format)
+            ):
+                totals[result["status"]] += 1
+                writer.writerow(
+                    [result["line"], result["identifier"], result["status"]]
+                )
+
+        summary = ", ".join(f"{n} {status}" for status, n in totals.items())
+        self.stderr.write(f"{course}: {summary or 'no rows'}")
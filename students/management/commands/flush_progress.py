@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from students import progress
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the buffered progress heartbeats to the database. With "
+        "--interval keep running and flush every few seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            nargs="?",
+            const=progress.PROGRESS_FLUSH_INTERVAL,
+            help=(
+                "Seconds between flushes, PROGRESS_FLUSH_INTERVAL when no "
+                "value is given"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            written = progress.flush()
+            if not options["interval"]:
+                self.stdout.write(f"Wrote {written} progress rows")
+                return
+            if written:
+                self.stdout.write(f"Wrote {written} progress rows")
+            time.sleep(options["interval"])
@@ -1,5 +1,42 @@
+from courses.models import Content, Course, Module
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
 
+class ContentProgress(models.Model):
+    """How far a student got in one content item.
 
+    Written in batches from the heartbeat buffer, see ``students.progress``.
+    ``module`` and ``course`` repeat the placement of the content, so the
+    last visited module of a course is read without joins.
+    """
+
+    student = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="progress",
+        on_delete=models.CASCADE,
+    )
+    content = models.ForeignKey(
+        Content, related_name="progress", on_delete=models.CASCADE
+    )
+    module = models.ForeignKey(
+        Module, related_name="+", on_delete=models.CASCADE
+    )
+    course = models.ForeignKey(
+        Course, related_name="+", on_delete=models.CASCADE
+    )
+    # seconds into a video, or whatever the player uses to resume
+    position = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    # time of the latest heartbeat, not of the write
+    updated = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("student", "content")
+        indexes = [
+            models.Index(
+                fields=["student", "course", "-updated"],
+                name="progress_last_visit_idx",
+            )
+        ]
+        verbose_name_plural = "content progress"
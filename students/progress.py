@@ -0,0 +1,196 @@
+"""Write-behind buffer of student progress heartbeats.
+
+Players send a heartbeat every few seconds. Heartbeats are kept in the
+cache and written to ContentProgress in batches by ``flush()``, which
+``manage.py flush_progress --interval`` runs every PROGRESS_FLUSH_INTERVAL
+seconds, outside of the requests. The buffer lives in the default cache,
+which has to be shared by all processes (memcached in production). When
+it is local to each process, as in development, the process that records
+the heartbeats flushes them itself at most every PROGRESS_FLUSH_INTERVAL
+seconds, since ``flush_progress`` would never see them.
+
+Every heartbeat takes the next number from a counter and is stored once
+under that numbered slot, never changed afterwards. A flush reads the
+slots between the last flushed number and the counter, merges them per
+student and content item and deletes the slots it wrote, so a heartbeat
+that arrives during a flush lands in a slot for the next one. A counter
+that was evicted restarts from the last flushed number, so the new slots
+are not taken for flushed ones.
+"""
+import time
+from datetime import datetime, timezone
+
+from courses.models import Content, Course
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .models import ContentProgress
+
+PROGRESS_FLUSH_INTERVAL = getattr(settings, "PROGRESS_FLUSH_INTERVAL", 5)
+# heartbeats that were not flushed within this time are dropped
+PROGRESS_BUFFER_TIMEOUT = 60 * 60
+FLUSH_BATCH_SIZE = 500
+FLUSH_LOCK_TIMEOUT = 60
+
+COUNTER_KEY = "progress:slots"
+FLUSHED_KEY = "progress:flushed"
+GAP_KEY = "progress:gap"
+LOCK_KEY = "progress:flush-lock"
+DUE_KEY = "progress:flush-due"
+
+
+def slot_key(number):
+    return f"progress:slot:{number}"
+
+
+def flushes_inline():
+    """Whether the buffer is local to this process, see academy.cache"""
+    backend = caches["default"]
+    return isinstance(getattr(backend, "shared", backend), LocMemCache)
+
+
+def record(user_id, content_id, position=0, completed=False):
+    """Buffer a heartbeat"""
+    cache.add(COUNTER_KEY, cache.get(FLUSHED_KEY, 0), None)
+    number = cache.incr(COUNTER_KEY)
+    cache.set(
+        slot_key(number),
+        (user_id, content_id, position, completed, time.time()),
+        PROGRESS_BUFFER_TIMEOUT,
+    )
+    if flushes_inline() and cache.add(DUE_KEY, 1, PROGRESS_FLUSH_INTERVAL):
+        flush()
+
+
+def merge(heartbeats):
+    """One entry per student and content item: completion sticks, the
+    position is the latest"""
+    entries = {}
+    for heartbeat in sorted(heartbeats, key=lambda heartbeat: heartbeat[4]):
+        user_id, content_id, position, completed, when = heartbeat
+        previous = entries.get((user_id, content_id))
+        if previous is not None:
+            completed = completed or previous[3]
+        entries[user_id, content_id] = (
+            user_id,
+            content_id,
+            position,
+            completed,
+            when,
+        )
+    return list(entries.values())
+
+
+def flush():
+    """Write the buffered heartbeats to the database in batches and return
+    the number of rows written. Only one flush runs at a time."""
+    if not cache.add(LOCK_KEY, 1, FLUSH_LOCK_TIMEOUT):
+        return 0
+    try:
+        flushed = cache.get(FLUSHED_KEY, 0)
+        # an evicted counter restarts from flushed, never below it
+        last = max(cache.get(COUNTER_KEY, 0), flushed)
+        slots = cache.get_many(
+            [slot_key(number) for number in range(flushed + 1, last + 1)]
+        )
+        heartbeats = []
+        for number in range(flushed + 1, last + 1):
+            heartbeat = slots.get(slot_key(number))
+            if heartbeat is not None:
+                heartbeats.append(heartbeat)
+            elif cache.get(GAP_KEY) != number:
+                # the slot may be taken but not filled yet, retry it next
+                # time; a slot that stays empty was abandoned
+                cache.set(GAP_KEY, number, PROGRESS_BUFFER_TIMEOUT)
+                last = number - 1
+                break
+
+        written = 0
+        entries = merge(heartbeats)
+        for start in range(0, len(entries), FLUSH_BATCH_SIZE):
+            written += save(entries[start : start + FLUSH_BATCH_SIZE])
+        # slots are written once, so these hold exactly what was saved
+        cache.delete_many(
+            [slot_key(number) for number in range(flushed + 1, last + 1)]
+        )
+        cache.set(FLUSHED_KEY, last, None)
+        return written
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+@transaction.atomic
+def save(entries):
+    """Upsert buffered entries of enrolled students into ContentProgress"""
+    content_ids = {entry[1] for entry in entries}
+    placements = {
+        content_id: (module_id, course_id)
+        for content_id, module_id, course_id in Content.objects.filter(
+            id__in=content_ids
+        ).values_list("id", "module_id", "module__course_id")
+    }
+    enrolled = set(
+        Course.students.through.objects.filter(
+            user_id__in={entry[0] for entry in entries},
+            course_id__in={course_id for _, course_id in placements.values()},
+        ).values_list("user_id", "course_id")
+    )
+
+    rows = {}
+    for user_id, content_id, position, completed, when in entries:
+        if content_id not in placements:
+            continue
+        module_id, course_id = placements[content_id]
+        if (user_id, course_id) not in enrolled:
+            continue
+        rows[user_id, content_id] = ContentProgress(
+            student_id=user_id,
+            content_id=content_id,
+            module_id=module_id,
+            course_id=course_id,
+            position=position,
+            completed=completed,
+            updated=datetime.fromtimestamp(when, timezone.utc),
+        )
+    if not rows:
+        return 0
+
+    # no portable upsert before Django 4.1: update what exists, insert the
+    # rest
+    updates = []
+    existing = ContentProgress.objects.filter(
+        student_id__in={user_id for user_id, _ in rows},
+        content_id__in={content_id for _, content_id in rows},
+    ).only("id", "student_id", "content_id", "completed", "updated")
+    for progress in existing:
+        new = rows.pop((progress.student_id, progress.content_id), None)
+        if new is None:
+            continue
+        progress.position = new.position
+        progress.completed = progress.completed or new.completed
+        progress.updated = max(progress.updated, new.updated)
+        updates.append(progress)
+    ContentProgress.objects.bulk_update(
+        updates, ["position", "completed", "updated"]
+    )
+    ContentProgress.objects.bulk_create(rows.values(), ignore_conflicts=True)
+    return len(updates) + len(rows)
+
+
+def course_progress(user, course_id):
+    """``(last visited module id, ids of completed contents)`` of user in a
+    course, from one indexed query"""
+    rows = ContentProgress.objects.filter(
+        student_id=user.pk, course_id=course_id
+    ).order_by("-updated")
+    last_module_id, completed = None, set()
+    for content_id, module_id, done in rows.values_list(
+        "content_id", "module_id", "completed"
+    ):
+        if last_module_id is None:
+            last_module_id = module_id
+        if done:
+            completed.add(content_id)
+    return last_module_id, completed
@@ -0,0 +1,22 @@
+from courses.models import Course
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from .enrollment import forget_enrollments
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def enrollments_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # instance is the user whose courses changed
+        if action in ("post_add", "post_remove", "post_clear"):
+            forget_enrollments([instance.pk])
+    elif action == "pre_clear":
+        # pk_set is empty on clear, so collect the students beforehand
+        instance._cleared_student_ids = list(
+            instance.students.values_list("id", flat=True)
+        )
+    elif action == "post_clear":
+        forget_enrollments(getattr(instance, "_cleared_student_ids", []))
+    elif action in ("post_add", "post_remove"):
+        forget_enrollments(pk_set)
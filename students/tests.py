@@ -1,3 +1,384 @@
-from django.test import TestCase
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from academy.testing import QueryBudgetTestCase
+from asgiref.sync import async_to_sync
+from courses.models import Course, Series
+from courses.tests import create_course
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+from django.test import AsyncRequestFactory, TestCase
+from django.urls import reverse
+
+from . import async_views, cohort, progress
+from .enrollment import enrolled_course_ids, enrollment_key
+from .models import ContentProgress
+
+User = get_user_model()
+
+
+class StudentQueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.student = User.objects.create_user("student", "s@example.com")
+        cls.small = create_course(owner, series, modules=1, items=1)
+        cls.large = create_course(owner, series, modules=6, items=8)
+        cls.student.courses_joined.add(cls.small, cls.large)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.student)
+
+    def get_within_budget(self, name, *args):
+        response = self.client.get(reverse(name, args=args))
+        self.assertEqual(response.status_code, 200)
+        return self.assertWithinBudget(response)
+
+    def test_course_list(self):
+        self.get_within_budget("students:student_course_list")
+
+    def test_course_detail_does_not_depend_on_course_size(self):
+        for course in (self.small, self.large):
+            with self.subTest(course=course.title):
+                cache.clear()
+                stats = self.get_within_budget(
+                    "students:student_course_detail", course.id
+                )
+                self.assertEqual(stats.count, 10)
+
+                module = course.modules.last()
+                cache.clear()
+                stats = self.get_within_budget(
+                    "students:student_course_detail_module",
+                    course.id,
+                    module.id,
+                )
+                self.assertEqual(stats.count, 10)
+
+
+class ProgressTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.student = User.objects.create_user("student", "s@example.com")
+        cls.course = create_course(owner, series, modules=2, items=2)
+        cls.student.courses_joined.add(cls.course)
+        cls.url = reverse("api:course-progress", args=[cls.course.id])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.student)
+        # as with memcached, where only flush_progress writes
+        patcher = mock.patch.object(
+            progress, "flushes_inline", return_value=False
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def heartbeat(self, data):
+        response = self.client.post(
+            self.url, data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertWithinBudget(response)
+
+    def test_heartbeats_are_merged_and_resumed(self):
+        first, last = self.course.modules.first(), self.course.modules.last()
+        content = last.contents.first()
+        self.heartbeat({"content": first.contents.first().id})
+        self.heartbeat({"content": content.id, "completed": True})
+        self.heartbeat({"content": content.id, "position": 30})
+        progress.flush()
+
+        row = ContentProgress.objects.get(content=content)
+        self.assertEqual((row.position, row.completed), (30, True))
+        self.assertEqual(
+            self.client.get(self.url).json(),
+            {"module": last.id, "completed": [content.id]},
+        )
+        response = self.client.get(
+            reverse("students:student_course_detail", args=[self.course.id])
+        )
+        self.assertEqual(response.context["module"], last)
+
+    def test_course_page_changes_with_progress(self):
+        url = reverse("students:student_course_detail", args=[self.course.id])
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        content = self.course.modules.first().contents.first()
+        self.heartbeat({"content": content.id, "completed": True})
+        progress.flush()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["completed"], {content.id})
+
+    def test_heartbeats_during_a_flush_are_kept(self):
+        content = self.course.modules.first().contents.first()
+        progress.record(self.student.id, content.id, position=10)
+        save = progress.save
+
+        def save_while_playing(entries):
+            progress.record(self.student.id, content.id, position=20)
+            return save(entries)
+
+        with mock.patch.object(progress, "save", save_while_playing):
+            self.assertEqual(progress.flush(), 1)
+        row = ContentProgress.objects.get(content=content)
+        self.assertEqual(row.position, 10)
+
+        out = StringIO()
+        call_command("flush_progress", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Wrote 1 progress rows")
+        row.refresh_from_db()
+        self.assertEqual(row.position, 20)
+        self.assertEqual(progress.flush(), 0)
+
+    def test_heartbeats_are_written_by_the_flush_only(self):
+        content = self.course.modules.first().contents.first()
+        for position in (10, 20):
+            self.heartbeat({"content": content.id, "position": position})
+        self.assertFalse(ContentProgress.objects.exists())
+        self.assertEqual(progress.flush(), 1)
+        self.assertEqual(ContentProgress.objects.get().position, 20)
+
+    def test_local_buffers_are_flushed_by_the_recording_process(self):
+        content = self.course.modules.first().contents.first()
+        with mock.patch.object(progress, "flushes_inline", return_value=True):
+            self.heartbeat({"content": content.id, "position": 10})
+            self.assertEqual(ContentProgress.objects.get().position, 10)
+            # not due again within PROGRESS_FLUSH_INTERVAL
+            self.heartbeat({"content": content.id, "position": 20})
+            self.assertEqual(ContentProgress.objects.get().position, 10)
+        self.assertEqual(progress.flush(), 1)
+        self.assertEqual(ContentProgress.objects.get().position, 20)
+
+    def test_evicted_counter_restarts_after_the_flushed_slots(self):
+        content = self.course.modules.first().contents.first()
+        progress.record(self.student.id, content.id, position=10)
+        self.assertEqual(progress.flush(), 1)
+        cache.delete(progress.COUNTER_KEY)
+        self.assertEqual(progress.flush(), 0)
+
+        progress.record(self.student.id, content.id, position=20)
+        self.assertEqual(progress.flush(), 1)
+        self.assertEqual(ContentProgress.objects.get().position, 20)
+
+    def test_students_of_other_courses_are_ignored(self):
+        other = User.objects.create_user("other", "o@example.com")
+        content = self.course.modules.first().contents.first()
+        progress.record(other.id, content.id, completed=True)
+        self.assertEqual(progress.flush(), 0)
+        self.assertFalse(ContentProgress.objects.exists())
+
+
+class AsyncCourseDetailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.student = User.objects.create_user("student", "s@example.com")
+        cls.course = create_course(owner, series, modules=2, items=2)
+        cls.student.courses_joined.add(cls.course)
+
+    def get(self, user, *args):
+        request = AsyncRequestFactory().get("/")
+        request.user = user
+        return async_to_sync(async_views.course_detail)(request, *args)
+
+    def test_module_contents_are_rendered(self):
+        module = self.course.modules.last()
+        response = self.get(self.student, self.course.id, str(module.id))
+        self.assertContains(response, module.title)
+        self.assertContains(response, 'class="content"', count=4)
+
+    def test_other_students_get_not_found(self):
+        other = User.objects.create_user("other", "o@example.com")
+        with self.assertRaises(Http404):
+            self.get(other, self.course.id)
+
+
+class EnrollmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(owner, series)
+        cls.student = User.objects.create_user("student", "s@example.com")
+
+    def setUp(self):
+        cache.clear()
+
+    def assertForgotten(self, change, user=None):
+        """The cached courses of user are dropped once change commits"""
+        user = user or self.student
+        enrolled_course_ids(user)
+        self.assertIsNotNone(cache.get(enrollment_key(user.pk)))
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertIsNone(cache.get(enrollment_key(user.pk)))
+
+    def test_enrollments_are_cached(self):
+        self.student.courses_joined.add(self.course)
+        self.assertEqual(enrolled_course_ids(self.student), {self.course.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                enrolled_course_ids(self.student), {self.course.id}
+            )
+
+    def test_enroll_and_unenroll(self):
+        self.assertForgotten(lambda: self.course.students.add(self.student))
+        self.assertEqual(enrolled_course_ids(self.student), {self.course.id})
+        self.assertForgotten(
+            lambda: self.student.courses_joined.remove(self.course)
+        )
+        self.assertEqual(enrolled_course_ids(self.student), set())
+
+    def test_clear(self):
+        self.student.courses_joined.add(self.course)
+        self.assertForgotten(self.course.students.clear)
+        self.assertEqual(enrolled_course_ids(self.student), set())
+        self.student.courses_joined.add(self.course)
+        self.assertForgotten(self.student.courses_joined.clear)
+        self.assertEqual(enrolled_course_ids(self.student), set())
+
+    def test_rolled_back_changes_keep_the_cache(self):
+        enrolled_course_ids(self.student)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.course.students.add(self.student)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertIsNotNone(cache.get(enrollment_key(self.student.pk)))
+        self.assertEqual(enrolled_course_ids(self.student), set())
+
+
+class CohortTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("instructor", "i@example.com")
+        series = Series.objects.create(title="Soil", slug="soil")
+        cls.course = create_course(cls.owner, series)
+        cls.ada = User.objects.create_user("ada", "ada@example.com")
+        cls.bob = User.objects.create_user("bob", "bob@example.com")
+        cls.eve = User.objects.create_user("eve", "eve@example.com")
+        cls.eve.courses_joined.add(cls.course)
+        cls.url = reverse("api:course-enroll-cohort", args=[cls.course.id])
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def upload(self, name, content, query=""):
+        response = self.client.post(
+            self.url + query,
+            {"file": SimpleUploadedFile(name, content.encode())},
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_csv(self):
+        *rows, summary = self.upload(
+            "cohort.csv", "username\nada\nbob@example.com\nnobody\neve\n"
+        )
+        self.assertEqual(
+            [(row["line"], row["status"]) for row in rows],
+            [
+                (2, "enrolled"),
+                (3, "enrolled"),
+                (4, "not_found"),
+                (5, "already_enrolled"),
+            ],
+        )
+        self.assertEqual(
+            summary,
+            {"totals": {"enrolled": 2, "not_found": 1, "already_enrolled": 1}},
+        )
+        self.assertEqual(
+            set(self.course.students.all()), {self.ada, self.bob, self.eve}
+        )
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.student_count, 3)
+
+    def test_json_lines(self):
+        content = '"ada"\n{"email": "bob@example.com"}\nnot json\n"ada"\n'
+        for name, query in (
+            ("cohort.jsonl", ""),
+            ("cohort.txt", "?type=jsonl"),
+        ):
+            with self.subTest(name):
+                *rows, summary = self.upload(name, content, query)
+                self.assertEqual(
+                    [row["identifier"] for row in rows],
+                    ["ada", "bob@example.com", None, "ada"],
+                )
+                self.assertEqual(rows[2]["status"], "invalid")
+                self.assertEqual(rows[3]["status"], "already_enrolled")
+        self.assertEqual(self.course.students.count(), 3)
+
+    def test_concurrent_enrollments_are_counted_once(self):
+        read = cohort._enrolled_ids
+
+        def racing_read(course, user_ids):
+            enrolled = read(course, user_ids)
+            if self.ada.pk not in enrolled:
+                Course.students.through.objects.create(
+                    course=course, user=self.ada
+                )
+            return enrolled
+
+        with mock.patch.object(
+            cohort, "_enrolled_ids", side_effect=racing_read
+        ):
+            rows = list(
+                cohort.enroll_cohort(self.course, [(1, "ada"), (2, "bob")])
+            )
+        self.assertEqual(
+            [row["status"] for row in rows], ["already_enrolled", "enrolled"]
+        )
+        self.course.refresh_from_db()
+        # eve, and bob; ada's row was inserted without the signal
+        self.assertEqual(self.course.student_count, 2)
+
+    def test_unknown_types_are_rejected(self):
+        response = self.client.post(
+            self.url + "?type=xlsx",
+            {"file": SimpleUploadedFile("cohort.csv", b"ada\n")},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_the_owner_enrolls_cohorts(self):
+        self.client.force_login(self.ada)
+        response = self.client.post(
+            self.url, {"file": SimpleUploadedFile("cohort.csv", b"bob\n")}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(self.course.students.filter(pk=self.bob.pk))
+
+    def test_command(self):
+        out = StringIO()
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write("ada\nnobody\n")
+            f.flush()
+            call_command(
+                "enroll_cohort", self.course.id, f.name, stdout=out, stderr=out
+            )
+        self.assertIn("1,ada,enrolled", out.getvalue())
+        self.assertIn("2,nobody,not_found", out.getvalue())
+
+        with self.assertRaisesMessage(CommandError, "Cannot read missing"):
+            call_command("enroll_cohort", self.course.id, "missing.csv")
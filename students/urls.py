@@ -1,5 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+
+from . import async_views, views
+
+course_detail = views.StudentCourseDetailView.as_view()
+if settings.ASYNC_VIEWS:
+    course_detail = async_views.course_detail
 
 app_name = "students"
 urlpatterns = [
@@ -20,12 +26,12 @@ urlpatterns = [
     ),
     path(
         "course/<pk>/",
-        views.StudentCourseDetailView.as_view(),
+        course_detail,
         name="student_course_detail",
     ),
     path(
         "course/<pk>/<module_id>/",
-        views.StudentCourseDetailView.as_view(),
+        course_detail,
         name="student_course_detail_module",
     ),
 ]
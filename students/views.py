@@ -1,7 +1,10 @@
+from courses import conditional
 from courses.models import Course
+from courses.rendering import render_items
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
 from django.views.generic.detail import DetailView
@@ -9,7 +12,9 @@ from django.views.generic.edit import CreateView, FormView
 from django.views.generic.list import ListView
 from users.forms import AcademySignUpForm
 
+from .enrollment import enrolled_course_ids
 from .forms import CourseEnrollForm
+from .progress import course_progress
 
 # Create your views here.
 
@@ -54,7 +59,7 @@ class StudentCourseListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         qs = super().get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        return qs.filter(id__in=enrolled_course_ids(self.request.user))
 
 
 class StudentCourseDetailView(DetailView):
@@ -63,14 +68,68 @@ class StudentCourseDetailView(DetailView):
 
     def get_queryset(self):
         qs = super().get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        return qs.filter(id__in=enrolled_course_ids(self.request.user))
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        self.progress = course_progress(request.user, self.object.id)
+        return conditional.respond(
+            request,
+            course_validators(request, self.object, self.progress),
+            lambda: self.render_to_response(
+                self.get_context_data(object=self.object)
+            ),
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        course = self.get_object()
-
-        if "module_id" in self.kwargs:
-            context["module"] = course.modules.get(id=self.kwargs["module_id"])
-        else:
-            context["module"] = course.modules.all()[0]
+        context.update(
+            course_context(
+                self.request.user,
+                self.object,
+                self.kwargs.get("module_id"),
+                self.progress,
+            )
+        )
         return context
+
+
+def course_validators(request, course, progress):
+    """Validators of the course page of a student, which also shows their
+    progress"""
+    last_module_id, completed = progress
+    etag, _ = conditional.journal_validators(
+        request, course.id, last_module_id, sorted(completed)
+    )
+    # progress is written behind, so the journal does not date the page
+    return etag, None
+
+
+def course_context(user, course, module_id=None, progress=None):
+    """Modules, the current module with its rendered contents, and the
+    completed contents of user in course. Without module_id the module the
+    student visited last is current. progress is the result of
+    ``course_progress()``, if already loaded."""
+    modules = list(course.modules.all())
+    if progress is None:
+        progress = course_progress(user, course.id)
+    last_module_id, completed = progress
+
+    if module_id is not None:
+        module = next((m for m in modules if str(m.id) == module_id), None)
+        if module is None:
+            raise Http404("No module found matching the query")
+    else:
+        # resume where the student left off
+        module = next(
+            (m for m in modules if m.id == last_module_id),
+            modules[0] if modules else None,
+        )
+    contents = list(module.contents.with_items()) if module else []
+    render_items([content.item for content in contents])
+    return {
+        "modules": modules,
+        "module": module,
+        "contents": contents,
+        "completed": completed,
+    }